@@ -1,10 +1,28 @@
 import os
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import google.generativeai as genai
-from sqlalchemy import text
-from app import db
-from config import GEMINI_API_KEY, DB_SCHEMA_DESCRIPTION, CHART_TYPES
+from flask import current_app
+from config import (
+    GEMINI_API_KEY, CHART_TYPES, STREAM_BATCH_SIZE, STREAM_MAX_ROWS, GUARD_STREAM_STATEMENT_TIMEOUT_MS,
+    GEMINI_MODEL_NAMES, GEMINI_HEDGE_DELAY_SECONDS, GEMINI_MODEL_TIMEOUT_SECONDS, GEMINI_MAX_CONCURRENT_REQUESTS,
+    GEMINI_STREAM_RESPONSES
+)
+from query_cache import get_cached_result, store_cached_result
+from circuit_breaker import model_breakers
+from prompt_registry import prompt_registry
+from schema_context import schema_for_query
+from rollups import rewrite_for_rollups
+from query_guard import query_guard, guarded_connection
+from result_cache import result_cache
+from sql_normalizer import normalize_sql, prepared_statements, fingerprint_stats
+from json_stream import IncrementalJSONParser
+from tracing import span
+from intent_matcher import intent_matcher
+from query_router import query_router, LOCAL
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -15,6 +33,31 @@ if not GEMINI_API_KEY:
 else:
     genai.configure(api_key=GEMINI_API_KEY)
 
+# Gemini generation settings shared by every model
+GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+}
+
+# Models are built once per process and reused across requests
+_model_cache = {}
+_model_cache_lock = threading.Lock()
+_configured_api_key = GEMINI_API_KEY or None
+
+# Threads that run (possibly hedged) Gemini requests
+_generation_executor = ThreadPoolExecutor(
+    max_workers=GEMINI_MAX_CONCURRENT_REQUESTS,
+    thread_name_prefix="gemini"
+)
+
+# Threads that run whole voice queries whose SQL is executed while the model is still writing
+_voice_query_executor = ThreadPoolExecutor(
+    max_workers=GEMINI_MAX_CONCURRENT_REQUESTS,
+    thread_name_prefix="voice-query"
+)
+
 def get_chart_recommendation(query_type, data_shape):
     """
     Recommend a chart type based on the query and data
@@ -45,17 +88,43 @@ def get_chart_recommendation(query_type, data_shape):
         }
     }
 
-def process_voice_query(query_text, language_code='en'):
+def is_comment_only_sql(sql):
+    """Check whether the SQL has nothing but -- comment lines"""
+    sql = sql.strip()
+    return sql.startswith('--') and not any(line.strip() and not line.strip().startswith('--') for line in sql.split('\n'))
+
+def process_voice_query(query_text, language_code='en', on_sql=None):
     """
     Process a natural language query using Gemini AI and convert it to SQL
     
+    Queries the local intent matcher is confident about are answered without
+    calling Gemini (see query_router).
+    
     Args:
         query_text: The natural language query text
         language_code: The language code of the query (e.g., 'en', 'hi', 'de', 'ja')
+        on_sql: Optional callback called with the SQL as soon as the model has
+            written it, before the rest of the answer is generated. It is
+            called at most once, from a generation thread, and only for model
+            answers (not for cached or fallback results).
     
     Returns:
         A dictionary with the generated SQL, explanation, and suggested next queries
     """
+    # Answer template-answerable questions locally without calling Gemini
+    with span("route"):
+        decision = query_router.route(query_text, language_code)
+    if decision.route == LOCAL:
+        if decision.shadow:
+            _submit_shadow_check(decision, query_text, language_code)
+        return decision.local_result
+    
+    # Serve repeated questions from the response cache without calling Gemini
+    with span("cache_lookup"):
+        cached_result = get_cached_result(query_text, language_code)
+    if cached_result:
+        return cached_result
+    
     # Check if environment has GEMINI_API_KEY
     import os
     api_key = os.environ.get("GEMINI_API_KEY")
@@ -65,175 +134,32 @@ def process_voice_query(query_text, language_code='en'):
         logger.error("GEMINI_API_KEY not provided in environment. Cannot process query.")
         return None
         
-    # Set language-specific messages based on the language code
-    explanation_label = "explanation"
-    chart_type_label = "chart_type"  
-    suggested_queries_label = "suggested_queries"
-    query_type_label = "query_type"
-    
-    # Language-specific prompt templates
-    language_prompts = {
-        'en': f"""
-        You are a business intelligence assistant that converts natural language queries into SQL.
-        
-        DATABASE SCHEMA:
-        {DB_SCHEMA_DESCRIPTION}
-        
-        USER QUERY: "{query_text}"
-        
-        Generate a valid SQL query to answer this question. Then provide a brief explanation of what the query does and suggest 3 follow-up questions the user might want to ask next.
-        
-        Format your response as a JSON object with the following keys:
-        - "sql": The SQL query to execute
-        - "explanation": A simple explanation of what the query does
-        - "chart_type": Recommended chart type (one of: "bar", "line", "pie")
-        - "suggested_queries": An array of 3 suggested follow-up questions
-        - "query_type": The type of analysis being performed (e.g., "time_series", "comparison", "distribution")
-        
-        The SQL should be valid and should work with PostgreSQL. Use only tables and columns from the schema above.
-        """,
-        
-        'hi': f"""
-        आप एक बिजनेस इंटेलिजेंस सहायक हैं जो प्राकृतिक भाषा क्वेरी को SQL में बदलता है।
-        
-        डेटाबेस स्कीमा:
-        {DB_SCHEMA_DESCRIPTION}
-        
-        उपयोगकर्ता क्वेरी: "{query_text}"
-        
-        इस प्रश्न का उत्तर देने के लिए एक वैध SQL क्वेरी जनरेट करें। फिर क्वेरी क्या करती है इसका संक्षिप्त विवरण प्रदान करें और 3 फॉलो-अप प्रश्न सुझाएं जो उपयोगकर्ता अगले पूछ सकता है।
-        
-        कृपया केवल एक वैध SQL क्वेरी जेनरेट करें, जो टिप्पणियों से शुरू न हो। कृपया सिर्फ टिप्पणियों (-- के साथ शुरू होने वाली पंक्तियां) से बनी SQL न दें।
-        
-        अपने जवाब को निम्न कीस वाले JSON ऑब्जेक्ट के रूप में फॉर्मेट करें:
-        - "sql": चलाने के लिए SQL क्वेरी (-- टिप्पणियां नहीं, सिर्फ वैध SQL)
-        - "explanation": क्वेरी क्या करती है इसका एक सरल स्पष्टीकरण
-        - "chart_type": अनुशंसित चार्ट प्रकार (इनमें से एक: "bar", "line", "pie")
-        - "suggested_queries": 3 सुझाए गए फॉलो-अप प्रश्नों का एक ऐरे
-        - "query_type": किए जा रहे विश्लेषण का प्रकार (जैसे, "time_series", "comparison", "distribution")
-        
-        SQL PostgreSQL के साथ काम करने वाली और वैध होनी चाहिए। केवल उपरोक्त स्कीमा से टेबल और कॉलम का उपयोग करें।
-        
-        यदि क्वेरी का अर्थ स्पष्ट नहीं है, तो किसी भी मामले में एक वैध SQL क्वेरी देना चाहिए जो बिक्री, उत्पाद या ग्राहक डेटा का विश्लेषण करती है। कभी भी केवल टिप्पणियों से युक्त SQL न दें।
-        """,
-        
-        'de': f"""
-        Sie sind ein Business Intelligence-Assistent, der natürlichsprachige Anfragen in SQL umwandelt.
-        
-        DATENBANKSCHEMA:
-        {DB_SCHEMA_DESCRIPTION}
-        
-        BENUTZERANFRAGE: "{query_text}"
-        
-        Generieren Sie eine gültige SQL-Abfrage, um diese Frage zu beantworten. Geben Sie dann eine kurze Erklärung, was die Abfrage macht, und schlagen Sie 3 Folgefragen vor, die der Benutzer als nächstes stellen könnte.
-        
-        Bitte generieren Sie nur eine gültige SQL-Abfrage, die nicht mit Kommentaren beginnt. Bitte geben Sie keine SQL zurück, die nur aus Kommentaren (Zeilen, die mit -- beginnen) besteht.
-        
-        Formatieren Sie Ihre Antwort als JSON-Objekt mit den folgenden Schlüsseln:
-        - "sql": Die auszuführende SQL-Abfrage (keine -- Kommentare, nur gültiges SQL)
-        - "explanation": Eine einfache Erklärung, was die Abfrage macht
-        - "chart_type": Empfohlener Diagrammtyp (einer von: "bar", "line", "pie")
-        - "suggested_queries": Ein Array von 3 vorgeschlagenen Folgefragen
-        - "query_type": Die Art der durchgeführten Analyse (z.B. "time_series", "comparison", "distribution")
-        
-        Das SQL sollte gültig sein und mit PostgreSQL funktionieren. Verwenden Sie nur Tabellen und Spalten aus dem obigen Schema.
-        
-        Wenn der Zweck der Anfrage unklar ist, geben Sie in jedem Fall eine gültige SQL-Abfrage zurück, die Verkaufs-, Produkt- oder Kundendaten analysiert. Geben Sie niemals SQL zurück, das nur aus Kommentaren besteht.
-        """,
-        
-        'ja': f"""
-        あなたは自然言語クエリをSQLに変換するビジネスインテリジェンスアシスタントです。
-        
-        データベーススキーマ:
-        {DB_SCHEMA_DESCRIPTION}
-        
-        ユーザークエリ: "{query_text}"
-        
-        この質問に答えるための有効なSQLクエリを生成してください。次に、クエリが何をするのかの簡単な説明と、ユーザーが次に尋ねるかもしれない3つのフォローアップ質問を提案してください。
-        
-        コメントから始まらない有効なSQLクエリのみを生成してください。コメント（--で始まる行）だけで構成されるSQLを返さないでください。
-        
-        次のキーを持つJSONオブジェクトとして応答をフォーマットしてください:
-        - "sql": 実行するSQLクエリ（--コメントではなく、有効なSQLのみ）
-        - "explanation": クエリが何をするのかの簡単な説明
-        - "chart_type": 推奨チャートタイプ（"bar"、"line"、"pie"のいずれか）
-        - "suggested_queries": 3つの提案されるフォローアップ質問の配列
-        - "query_type": 実行される分析のタイプ（例: "time_series", "comparison", "distribution"）
-        
-        SQLはPostgreSQLで動作する有効なものである必要があります。上記のスキーマのテーブルと列のみを使用してください。
-        
-        クエリの目的が不明確な場合でも、必ず販売、製品、または顧客データを分析する有効なSQLクエリを返してください。コメントのみで構成されるSQLは決して返さないでください。
-        """
-    }
-    
-    # Get the appropriate prompt for the language or use English as fallback
-    prompt = language_prompts.get(language_code, language_prompts['en'])
+    # Build the prompt from the precompiled template for this language,
+    # sending only the parts of the schema this query needs
+    with span("prompt"):
+        prompt = prompt_registry.render(query_text, language_code, schema_for_query(query_text))
 
     try:
-        # Configure the Gemini API with the key from environment
-        genai.configure(api_key=api_key)
-        
         logger.debug(f"Using prompt in language: {language_code}")
         
         logger.debug(f"Sending prompt to Gemini API: {prompt[:100]}...")
         
-        # Configure the Gemini model
-        generation_config = {
-            "temperature": 0.2,
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 2048,
-        }
-        
-        # Generate response from Gemini
-        # Use gemini-2.0-flash as primary model, with fallbacks
-        model_names = ["gemini-2.0-flash", "models/gemini-2.0-flash", "models/gemini-1.5-pro", "gemini-1.0-pro", "gemini-pro"]
-        
-        response = None
-        for model_name in model_names:
-            try:
-                logger.debug(f"Trying Gemini model: {model_name}")
-                model = genai.GenerativeModel(
-                    model_name=model_name,
-                    generation_config=generation_config
-                )
-                
-                response = model.generate_content(prompt)
-                logger.debug(f"Successfully used model: {model_name}")
-                break
-            except Exception as e:
-                logger.debug(f"Failed to use model {model_name}: {str(e)}")
-                if model_name == model_names[-1]:  # If this is the last model we're trying
-                    raise  # Re-raise the exception if all models failed
-                continue  # Try the next model
-                
-        if not response:
-            raise Exception("Failed to get response from any Gemini model")
-        
-        # Parse the response
-        response_text = response.text
-        logger.debug(f"Raw AI response received: {response_text[:100]}...")
-        
-        # Extract JSON from the response
-        if "```json" in response_text:
-            json_str = response_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in response_text:
-            json_str = response_text.split("```")[1].strip()
-        else:
-            json_str = response_text.strip()
-        
-        logger.debug(f"Extracted JSON from AI response: {json_str[:100]}...")
-        
-        # Parse JSON response
-        result = json.loads(json_str)
+        # Generate response from Gemini, hedging across the fallback models
+        try:
+            with span("gemini"):
+                result, model_name = generate_with_fallback(prompt, api_key, on_sql=on_sql)
+        except ModelsUnavailableError:
+            # Every model is known to be failing; answer locally without waiting on Gemini
+            logger.info("All Gemini models unavailable; using fallback SQL generation")
+            return generate_fallback_sql(query_text, language_code)
         
         # Check if the SQL is just a comment or empty
         sql = result["sql"].strip()
-        if sql.startswith('--') and not any(line.strip() and not line.strip().startswith('--') for line in sql.split('\n')):
+        if is_comment_only_sql(sql):
             # This is just a comment, probably an error message or misunderstood query
             logger.warning(f"Received SQL with only comments: {sql}")
             # Use fallback SQL generation
-            fallback_result = generate_fallback_sql(query_text)
+            fallback_result = generate_fallback_sql(query_text, language_code)
             if fallback_result:
                 logger.info("Successfully generated SQL using fallback method after receiving comment-only SQL")
                 return fallback_result
@@ -246,10 +172,15 @@ def process_voice_query(query_text, language_code='en'):
             "explanation": result["explanation"],
             "chart_type": result.get("chart_type", "bar"),
             "suggested_queries": result["suggested_queries"],
-            "query_type": result.get("query_type", "general")
+            "query_type": result.get("query_type", "general"),
+            "model": model_name
         }
         
         logger.debug(f"Successfully processed query with AI: {result.get('chart_type', 'bar')} chart")
+        query_router.record_model_answer(decision, response_data)
+        
+        # Only cache model answers; fallback SQL should not outlive an outage
+        store_cached_result(query_text, language_code, response_data)
         return response_data
         
     except Exception as e:
@@ -260,7 +191,7 @@ def process_voice_query(query_text, language_code='en'):
         # Try a fallback implementation using templates if Gemini API fails
         try:
             logger.info("Attempting to use fallback SQL generation")
-            fallback_result = generate_fallback_sql(query_text)
+            fallback_result = generate_fallback_sql(query_text, language_code)
             if fallback_result:
                 logger.info("Successfully generated SQL using fallback method")
                 return fallback_result
@@ -269,145 +200,475 @@ def process_voice_query(query_text, language_code='en'):
         
         return None
 
-def generate_fallback_sql(query_text):
+def get_gemini_model(model_name, api_key):
     """
-    A fallback method to generate SQL queries based on simple pattern matching
-    when the AI service fails.
+    Get a GenerativeModel for the given name, building it only once
     
     Args:
-        query_text: The natural language query text
-        
+        model_name: The Gemini model name
+        api_key: The Gemini API key; a new key resets the model cache
+    
     Returns:
-        A dictionary with the generated SQL and other necessary fields, or None if no match
+        A configured genai.GenerativeModel
     """
-    query_lower = query_text.lower()
-    
-    # Parse the query to detect intent
-    response = {
-        "explanation": "Generated based on keyword analysis of your query.",
-        "chart_type": "bar",
-        "suggested_queries": [
-            "What are the top selling products?",
-            "Show me monthly sales trends",
-            "Which customers have the highest lifetime value?"
-        ],
-        "query_type": "general"
-    }
+    global _configured_api_key
+    with _model_cache_lock:
+        if api_key != _configured_api_key:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+            _model_cache.clear()
+        
+        model = _model_cache.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=model_name,
+                generation_config=GENERATION_CONFIG
+            )
+            _model_cache[model_name] = model
+        return model
+
+def extract_json_response(response_text):
+    """
+    Extract and parse the JSON object from a model response
     
-    # Match for product category
-    if "category" in query_lower and ("product" in query_lower or "products" in query_lower):
-        if "sales" in query_lower or "revenue" in query_lower or "amount" in query_lower or "total" in query_lower:
-            response["sql"] = """
-            SELECT p.category, SUM(s.total_amount) as total_revenue
-            FROM sales s
-            JOIN product p ON s.product_id = p.id
-            GROUP BY p.category
-            ORDER BY total_revenue DESC;
-            """
-            response["explanation"] = "This query calculates the total revenue by product category, sorted from highest to lowest."
-            response["chart_type"] = "bar"
-            response["query_type"] = "comparison"
-        else:
-            response["sql"] = """
-            SELECT p.category, COUNT(*) as product_count
-            FROM product p
-            GROUP BY p.category
-            ORDER BY product_count DESC;
-            """
-            response["explanation"] = "This query counts the number of products in each category."
-            response["chart_type"] = "pie"
-            response["query_type"] = "distribution"
-    
-    # Match for top products
-    elif "top" in query_lower and "product" in query_lower:
-        limit = 5  # Default
-        for num in ["3", "5", "10", "twenty", "thirty"]:
-            if num in query_lower:
-                limit = int(num) if num.isdigit() else 20 if num == "twenty" else 30
-                break
-                
-        response["sql"] = f"""
-        SELECT p.name, SUM(s.total_amount) as total_revenue
-        FROM sales s
-        JOIN product p ON s.product_id = p.id
-        GROUP BY p.name
-        ORDER BY total_revenue DESC
-        LIMIT {limit};
-        """
-        response["explanation"] = f"This query shows the top {limit} products by total revenue."
-        response["chart_type"] = "bar"
-        response["query_type"] = "comparison"
-    
-    # Match for monthly trends
-    elif ("month" in query_lower or "trend" in query_lower) and ("sales" in query_lower or "revenue" in query_lower):
-        response["sql"] = """
-        SELECT 
-            DATE_TRUNC('month', s.date) as month,
-            SUM(s.total_amount) as total_revenue
-        FROM sales s
-        GROUP BY month
-        ORDER BY month;
-        """
-        response["explanation"] = "This query shows the monthly revenue trend over time."
-        response["chart_type"] = "line"
-        response["query_type"] = "time_series"
-    
-    # Match for customer segments
-    elif "customer" in query_lower and "segment" in query_lower:
-        response["sql"] = """
-        SELECT 
-            c.segment,
-            SUM(s.total_amount) as total_revenue
-        FROM sales s
-        JOIN customer c ON s.customer_id = c.id
-        GROUP BY c.segment
-        ORDER BY total_revenue DESC;
-        """
-        response["explanation"] = "This query shows the total revenue by customer segment."
-        response["chart_type"] = "pie"
-        response["query_type"] = "distribution"
+    Args:
+        response_text: The raw response text, possibly wrapped in code fences
+    
+    Returns:
+        The parsed dictionary
+    """
+    if "```json" in response_text:
+        json_str = response_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in response_text:
+        json_str = response_text.split("```")[1].strip()
+    else:
+        json_str = response_text.strip()
+    
+    logger.debug(f"Extracted JSON from AI response: {json_str[:100]}...")
+    
+    result = json.loads(json_str)
+    missing = [key for key in ("sql", "explanation", "suggested_queries") if key not in result]
+    if missing:
+        raise ValueError(f"AI response is missing keys: {', '.join(missing)}")
+    return result
+
+def _generate_with_model(model_name, prompt, api_key, on_field=None):
+    """
+    Run one model and return its parsed JSON answer
+    
+    With on_field the response is streamed, and on_field(model_name, key, value)
+    is called for each top-level JSON field as soon as it is complete.
+    """
+    logger.debug(f"Trying Gemini model: {model_name}")
+    model = get_gemini_model(model_name, api_key)
+    if on_field is None:
+        response = model.generate_content(
+            prompt,
+            request_options={"timeout": GEMINI_MODEL_TIMEOUT_SECONDS}
+        )
+        logger.debug(f"Raw AI response from {model_name}: {response.text[:100]}...")
+        with span("json_parse"):
+            return extract_json_response(response.text)
+    
+    response = model.generate_content(
+        prompt,
+        stream=True,
+        request_options={"timeout": GEMINI_MODEL_TIMEOUT_SECONDS}
+    )
+    parser = IncrementalJSONParser()
+    chunks = []
+    for chunk in response:
+        chunks.append(chunk.text)
+        for key, value in parser.feed(chunk.text):
+            on_field(model_name, key, value)
     
-    # Default query if no pattern matches
+    response_text = "".join(chunks)
+    logger.debug(f"Raw streamed AI response from {model_name}: {response_text[:100]}...")
+    try:
+        with span("json_parse"):
+            return extract_json_response(response_text)
+    except (ValueError, json.JSONDecodeError):
+        if "sql" not in parser.fields:
+            raise
+        # The SQL may already be running, so keep it even if a later field is unusable
+        logger.warning(f"Incomplete streamed answer from {model_name}; keeping the fields that parsed")
+        return {"explanation": "", "suggested_queries": [], **parser.fields}
+
+class ModelsUnavailableError(Exception):
+    """Raised when every Gemini model is skipped by its circuit breaker"""
+
+def _record_model_outcome(breaker, future):
+    """Feed a finished model call into its circuit breaker"""
+    error = future.exception()
+    if error is None:
+        breaker.record_success()
+    elif isinstance(error, (ValueError, json.JSONDecodeError)):
+        # The model answered but with unusable JSON; that is not an outage
+        breaker.record_success()
     else:
-        response["sql"] = """
-        SELECT 
-            p.name as product_name,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.total_amount) as total_revenue
-        FROM sales s
-        JOIN product p ON s.product_id = p.id
-        GROUP BY p.name
-        ORDER BY total_revenue DESC
-        LIMIT 10;
+        breaker.record_failure(error)
+
+def generate_with_fallback(prompt, api_key, model_names=None, on_sql=None):
+    """
+    Ask the Gemini models for an answer using hedged requests
+    
+    The primary model is called first. If it has not answered within
+    GEMINI_HEDGE_DELAY_SECONDS, or as soon as it fails, the next model is
+    started as well. The first model to return valid JSON wins; earlier
+    models in the list win ties. Each model is abandoned after
+    GEMINI_MODEL_TIMEOUT_SECONDS. Models whose circuit breaker is open are
+    skipped without being called.
+    
+    With on_sql (and GEMINI_STREAM_RESPONSES on), responses are streamed and
+    on_sql is called with the first usable "sql" field any model completes.
+    That model is then committed to: no more hedges are started and only its
+    answer is returned, so the result always matches the SQL already handed out.
+    
+    Args:
+        prompt: The prompt to send
+        api_key: The Gemini API key
+        model_names: Models in order of preference (defaults to GEMINI_MODEL_NAMES)
+        on_sql: Optional callback for the SQL, called at most once
+    
+    Returns:
+        Tuple of (parsed result dictionary, name of the model that answered)
+    
+    Raises:
+        ModelsUnavailableError: If every model's circuit breaker is open
+    """
+    model_names = list(model_names or GEMINI_MODEL_NAMES)
+    remaining = list(model_names)
+    in_flight = {}
+    errors = []
+    last_launch = 0.0
+    committed = {}
+    committed_lock = threading.Lock()
+    
+    def commit(model_name):
+        """Pick the model whose answer is used; returns False if another was picked first"""
+        with committed_lock:
+            return committed.setdefault("model", model_name) == model_name
+    
+    def report_field(model_name, key, value):
+        if key != "sql" or not isinstance(value, str) or not value.strip() or is_comment_only_sql(value):
+            return
+        if commit(model_name):
+            logger.debug(f"Model {model_name} produced SQL before finishing its answer")
+            on_sql(value.strip())
+    
+    on_field = report_field if on_sql is not None and GEMINI_STREAM_RESPONSES else None
+    
+    def launch_next():
+        nonlocal last_launch
+        while remaining:
+            model_name = remaining.pop(0)
+            breaker = model_breakers.get(model_name)
+            if not breaker.allow_request():
+                logger.debug(f"Skipping model {model_name}: circuit breaker is {breaker.state}")
+                errors.append(f"{model_name}: circuit open")
+                continue
+            
+            future = _generation_executor.submit(_generate_with_model, model_name, prompt, api_key, on_field)
+            future.add_done_callback(lambda f, breaker=breaker: _record_model_outcome(breaker, f))
+            last_launch = time.monotonic()
+            in_flight[future] = (model_name, last_launch)
+            return True
+        return False
+    
+    if not launch_next():
+        raise ModelsUnavailableError("All Gemini model circuit breakers are open")
+    while in_flight:
+        now = time.monotonic()
+        deadlines = [started + GEMINI_MODEL_TIMEOUT_SECONDS for _, started in in_flight.values()]
+        if remaining and not committed:
+            deadlines.append(last_launch + GEMINI_HEDGE_DELAY_SECONDS)
+        done, _ = wait(list(in_flight), timeout=max(0, min(deadlines) - now), return_when=FIRST_COMPLETED)
+        
+        failed = False
+        for future in sorted(done, key=lambda f: model_names.index(in_flight[f][0])):
+            model_name, _ = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.debug(f"Failed to use model {model_name}: {str(e)}")
+                errors.append(f"{model_name}: {str(e)}")
+                if committed.get("model") == model_name:
+                    raise Exception(f"Model {model_name} failed after producing SQL: {str(e)}")
+                failed = True
+                continue
+            
+            if not commit(model_name):
+                # Another model's SQL is already running; its answer is the one to use
+                logger.debug(f"Discarding answer from {model_name}; committed to {committed['model']}")
+                continue
+            
+            logger.debug(f"Successfully used model: {model_name}")
+            return result, model_name
+        
+        now = time.monotonic()
+        for future, (model_name, started) in list(in_flight.items()):
+            if now - started >= GEMINI_MODEL_TIMEOUT_SECONDS:
+                logger.debug(f"Model {model_name} timed out after {GEMINI_MODEL_TIMEOUT_SECONDS}s")
+                errors.append(f"{model_name}: timed out")
+                in_flight.pop(future)
+                if committed.get("model") == model_name:
+                    raise Exception(f"Model {model_name} timed out after producing SQL")
+                failed = True
+        
+        hedge_due = now - last_launch >= GEMINI_HEDGE_DELAY_SECONDS
+        if remaining and not committed and (failed or hedge_due or not in_flight):
+            launch_next()
+    
+    raise Exception(f"Failed to get response from any Gemini model: {'; '.join(errors)}")
+
+def _shadow_check(app, decision, query_text, language_code, api_key):
+    """Ask the model about a locally answered query, to measure how often they agree"""
+    try:
+        with app.app_context():
+            prompt = prompt_registry.render(query_text, language_code, schema_for_query(query_text))
+            result, _ = generate_with_fallback(prompt, api_key)
+        query_router.record_model_answer(decision, result)
+    except Exception as e:
+        logger.debug(f"Shadow model check failed: {str(e)}")
+
+def _submit_shadow_check(decision, query_text, language_code):
+    """Run a shadow model check in the background, off the request path"""
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if api_key:
+        app = current_app._get_current_object()
+        _voice_query_executor.submit(_shadow_check, app, decision, query_text, language_code, api_key)
+
+class StreamingGeneration:
+    """
+    Run process_voice_query in the background and hand out the SQL early
+    
+    The model's answer is streamed, so the SQL is usually available while the
+    explanation and suggested queries are still being written. Callers can
+    start executing it from wait_for_sql() and collect the full answer from
+    result() afterwards.
+    """
+    
+    def __init__(self, query_text, language_code='en'):
+        self.sql = None
+        self._sql_ready = threading.Event()
+        app = current_app._get_current_object()
+        self.future = _voice_query_executor.submit(self._run, app, query_text, language_code)
+    
+    def _run(self, app, query_text, language_code):
+        try:
+            with app.app_context():
+                return process_voice_query(query_text, language_code=language_code, on_sql=self._set_sql)
+        finally:
+            self._sql_ready.set()
+    
+    def _set_sql(self, sql):
+        self.sql = sql
+        self._sql_ready.set()
+    
+    def done(self):
+        return self.future.done()
+    
+    def wait_for_sql(self, timeout=None):
+        """
+        Wait for the SQL, either streamed early or from the finished answer
+        
+        Args:
+            timeout: Seconds to wait (None waits for generation to finish)
+        
+        Returns:
+            The SQL text, or None if no SQL could be generated
         """
-        response["explanation"] = "This query shows the top 10 products by total revenue."
-        response["chart_type"] = "bar"
-        response["query_type"] = "comparison"
+        self._sql_ready.wait(timeout)
+        if self.sql is None and self.future.done():
+            result = self.future.result()
+            self.sql = result["sql"] if result else None
+        return self.sql
     
-    return response
+    def result(self, timeout=None):
+        """Wait for and return the full process_voice_query result"""
+        return self.future.result(timeout)
 
-def execute_sql_query(sql_query):
+def generate_fallback_sql(query_text, language_code='en'):
     """
-    Execute the SQL query against the database
+    Generate SQL locally from keyword tables when the AI service fails
+    
+    Args:
+        query_text: The natural language query text
+        language_code: The language code of the query
+        
+    Returns:
+        A dictionary with the generated SQL and other necessary fields, plus
+        the matched "intent" and a "confidence" between 0 and 1
+    """
+    with span("fallback_sql"):
+        return intent_matcher.match(query_text, language_code)
+
+def prepare_sql_query(sql_query, params=None, auto_limit=True):
+    """
+    Plan how a SQL query will run: rollup rewrite first, then the query guard
     
     Args:
         sql_query: The SQL query to execute
+        params: Optional bind parameters for the query
+        auto_limit: Let the guard add a LIMIT to queries with too many estimated rows
     
     Returns:
-        Tuple of (results, columns)
+        The guard decision, whose "sql" is the statement to execute
+    
+    Raises:
+        QueryRejectedError: If the query is not allowed to run
+    """
+    with span("sql_prepare"):
+        # Answer dashboard aggregates from the rollup tables when possible
+        sql_query = rewrite_for_rollups(sql_query)
+        return query_guard.check(sql_query, params, auto_limit=auto_limit)
+
+def fetch_prepared_rows(decision, params=None):
     """
+    Execute a query planned by prepare_sql_query and return rows as plain tuples
+    
+    Args:
+        decision: The result of prepare_sql_query
+        params: Optional bind parameters for the query
+    
+    Returns:
+        Tuple of (rows, columns) where rows is a list of value tuples
+    """
+    # Lift literals into bind parameters so each query shape is planned once
+    normalized = normalize_sql(decision["sql"])
+    started = time.perf_counter()
     try:
-        # Execute the SQL query
-        with db.engine.connect() as connection:
-            result = connection.execute(text(sql_query))
+        # Execute the SQL query read-only, with a statement timeout
+        with span("sql_execute"), guarded_connection() as connection:
+            result = prepared_statements.execute(connection, normalized, params)
             # Convert RMKeyView to list of strings for JSON serialization
             columns = list(map(str, result.keys()))
-            results = [dict(zip(columns, row)) for row in result.fetchall()]
+            fetched = result.fetchall()
+        fingerprint_stats.record(normalized, time.perf_counter() - started, len(fetched))
+        
+        with span("row_conversion"):
+            rows = [tuple(row) for row in fetched]
             
-        return results, columns
+        return rows, columns
         
     except Exception as e:
+        fingerprint_stats.record(normalized, time.perf_counter() - started, failed=True)
         logger.error(f"Error executing SQL query: {str(e)}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise
+
+def fetch_sql_rows(sql_query, params=None, auto_limit=True):
+    """
+    Execute the SQL query and return rows as plain tuples
+    
+    Args:
+        sql_query: The SQL query to execute
+        params: Optional bind parameters for the query
+        auto_limit: Let the guard add a LIMIT to queries with too many estimated rows
+    
+    Returns:
+        Tuple of (rows, columns) where rows is a list of value tuples
+    """
+    return fetch_prepared_rows(prepare_sql_query(sql_query, params, auto_limit), params)
+
+def fetch_sql_rows_cached(sql_query):
+    """
+    Execute the SQL query through the result cache
+    
+    Args:
+        sql_query: The SQL query to execute
+    
+    Returns:
+        Tuple of (rows, columns, decision, age) where decision is the query
+        guard decision and age is the cached entry's age in seconds, or None
+        on a cache miss
+    """
+    # Serve repeated dashboard queries from the result cache, without touching the database
+    with span("result_cache"):
+        cached = result_cache.get(sql_query, with_metadata=True)
+    if cached:
+        rows, columns, age, decision = cached
+        return rows, columns, decision, age
+    
+    # Check the query; a LIMIT may be added if it would return too many rows
+    versions = result_cache.current_versions(sql_query)
+    decision = prepare_sql_query(sql_query)
+    rows, columns = fetch_prepared_rows(decision)
+    # The guard decision (limited, estimated_rows) is served with the cached rows
+    result_cache.set(sql_query, rows, columns, versions=versions, metadata=decision)
+    return rows, columns, decision, None
+
+def execute_sql_query(sql_query):
+    """
+    Execute the SQL query against the database
+    
+    Args:
+        sql_query: The SQL query to execute
+    
+    Returns:
+        Tuple of (results, columns)
+    """
+    rows, columns = fetch_sql_rows(sql_query)
+    with span("row_conversion"):
+        results = [dict(zip(columns, row)) for row in rows]
+    return results, columns
+
+def stream_sql_query(sql_query, max_rows=STREAM_MAX_ROWS, batch_size=STREAM_BATCH_SIZE, as_dicts=True,
+                     row_cap=STREAM_MAX_ROWS):
+    """
+    Execute the SQL query with a server-side cursor and yield rows in batches
+    
+    Only one batch is held in memory at a time, so peak memory does not grow
+    with the size of the result.
+    
+    Args:
+        sql_query: The SQL query to execute
+        max_rows: Stop after this many rows (capped at row_cap)
+        batch_size: Number of rows fetched from the cursor per batch
+        as_dicts: Yield row dictionaries (True) or value tuples (False)
+        row_cap: The most rows any caller may ask for (STREAM_MAX_ROWS unless
+            the endpoint has its own limit)
+    
+    Yields:
+        The list of column names first, then lists of rows.
+        The generator's return value is (row_count, truncated).
+    """
+    max_rows = min(max_rows or row_cap, row_cap)
+    row_count = 0
+    truncated = False
+    
+    # The stream caps rows itself, so the guard only rejects, never adds a LIMIT
+    normalized = normalize_sql(prepare_sql_query(sql_query, auto_limit=False)["sql"])
+    started = time.perf_counter()
+    
+    try:
+        with guarded_connection(GUARD_STREAM_STATEMENT_TIMEOUT_MS) as connection:
+            streaming_connection = connection.execution_options(stream_results=True, yield_per=batch_size)
+            # A server-side cursor cannot be declared over EXECUTE, so only bind the lifted literals
+            result = prepared_statements.execute(streaming_connection, normalized, prepare=False)
+            columns = list(map(str, result.keys()))
+            yield columns
+            
+            for partition in result.partitions(batch_size):
+                remaining = max_rows - row_count
+                if len(partition) > remaining:
+                    partition = partition[:remaining]
+                    truncated = True
+                row_count += len(partition)
+                yield [dict(zip(columns, row)) for row in partition] if as_dicts else [tuple(row) for row in partition]
+                if truncated or row_count >= max_rows:
+                    # Stop reading; closing the connection discards the rest of the cursor
+                    truncated = truncated or result.fetchone() is not None
+                    break
+            result.close()
+        
+        fingerprint_stats.record(normalized, time.perf_counter() - started, row_count)
+        return row_count, truncated
+    
+    except Exception as e:
+        fingerprint_stats.record(normalized, time.perf_counter() - started, row_count, failed=True)
+        logger.error(f"Error streaming SQL query: {str(e)}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise
@@ -9,6 +9,11 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+from config import (
+    DATABASE_REPLICA_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_POOL_USE_LIFO, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW
+)
+
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -27,13 +32,44 @@ app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 # Configure CORS to allow requests from the frontend
 CORS(app)
 
+# Encode JSON responses with the typed result serializer (orjson when installed)
+from serializers import ResultJSONProvider
+app.json = ResultJSONProvider(app)
+
+# Time each request and add Server-Timing headers
+from tracing import start_request_timer, finish_request_timer, configure_opentelemetry
+app.before_request(start_request_timer)
+app.after_request(finish_request_timer)
+configure_opentelemetry()
+
+def engine_options(database_url, pool_size, max_overflow):
+    """Build SQLAlchemy engine options for a database from the pool settings"""
+    options = {
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if database_url and not database_url.startswith("sqlite"):
+        options.update({
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_use_lifo": DB_POOL_USE_LIFO,
+        })
+    return options
+
 # Configure the PostgreSQL database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(os.environ.get("DATABASE_URL"), DB_POOL_SIZE, DB_MAX_OVERFLOW)
+
+# Analytic SELECTs go to a read replica when one is configured
+if DATABASE_REPLICA_URL:
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": {
+            "url": DATABASE_REPLICA_URL,
+            **engine_options(DATABASE_REPLICA_URL, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW),
+        }
+    }
 
 # Initialize the app with the SQLAlchemy extension
 db.init_app(app)
@@ -48,8 +84,12 @@ with app.app_context():
     # Import routes after database is initialized
     from routes import *
     
-    # Initialize sample data if database is empty
-    from database import initialize_sample_data
+    # Register the "flask generate-data" CLI command
+    import datagen
+    
+    # Partition sales if configured, then initialize sample data if database is empty
+    from database import prepare_sales_table, initialize_sample_data
+    prepare_sales_table()
     initialize_sample_data()
 
 logger.info("Voice to Visualization app initialized")
@@ -0,0 +1,317 @@
+"""
+Benchmark the query pipeline with a local stand-in for Gemini
+
+Seeds a database at one or more scales, then drives /api/voice-query and
+/api/run-sql concurrently through the Flask test client and reports latency
+percentiles, throughput and memory per endpoint. Every endpoint runs in a
+fresh process, so its peak RSS is its own; /api/run-sql runs with the result
+cache off so it measures query execution rather than cache hits. Gemini is
+replaced by FakeGenerativeModel, which answers with canned JSON after a
+configurable delay, so runs are reproducible and need no API key or network.
+
+Usage:
+    python benchmark.py --scales small,medium --concurrency 8 --requests 200
+    python benchmark.py --save-baseline      # record the current numbers
+    python benchmark.py                      # compare against the baseline
+
+By default a throwaway SQLite database is used; pass --database-url to run
+against Postgres. The database is truncated for every scale.
+"""
+import argparse
+import json
+import os
+import multiprocessing
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Dataset sizes passed to datagen.generate_dataset
+SCALES = {
+    "small": {"products": 50, "customers": 1000, "days": 90, "rows_per_day": 100},
+    "medium": {"products": 100, "customers": 10000, "days": 365, "rows_per_day": 1000},
+    "large": {"products": 500, "customers": 100000, "days": 730, "rows_per_day": 5000},
+}
+
+# Portable SQL (SQLite and Postgres) returned by the fake model
+CANNED_ANSWERS = [
+    {
+        "sql": "SELECT p.name, SUM(s.total_amount) AS total_revenue FROM sales s JOIN product p ON s.product_id = p.id "
+               "GROUP BY p.name ORDER BY total_revenue DESC LIMIT 10",
+        "explanation": "Top 10 products by revenue.",
+        "chart_type": "bar",
+        "query_type": "comparison",
+    },
+    {
+        "sql": "SELECT p.category, SUM(s.total_amount) AS total_revenue FROM sales s JOIN product p ON s.product_id = p.id "
+               "GROUP BY p.category ORDER BY total_revenue DESC",
+        "explanation": "Revenue by product category.",
+        "chart_type": "pie",
+        "query_type": "distribution",
+    },
+    {
+        "sql": "SELECT c.segment, COUNT(*) AS sale_count FROM sales s JOIN customer c ON s.customer_id = c.id "
+               "GROUP BY c.segment",
+        "explanation": "Number of sales per customer segment.",
+        "chart_type": "bar",
+        "query_type": "comparison",
+    },
+    {
+        "sql": "SELECT s.date, SUM(s.total_amount) AS daily_revenue FROM sales s GROUP BY s.date ORDER BY s.date DESC LIMIT 30",
+        "explanation": "Daily revenue for the last 30 days with sales.",
+        "chart_type": "line",
+        "query_type": "time_series",
+    },
+    {
+        "sql": "SELECT c.location, COUNT(DISTINCT c.id) AS customers FROM customer c GROUP BY c.location ORDER BY customers DESC",
+        "explanation": "Customers per location.",
+        "chart_type": "bar",
+        "query_type": "comparison",
+    },
+]
+
+QUESTIONS = [
+    "top products by revenue",
+    "revenue by category",
+    "sales per customer segment",
+    "daily revenue trend",
+    "customers per location",
+]
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeGenerativeModel:
+    """
+    Stand-in for genai.GenerativeModel that answers with canned JSON
+
+    Each call sleeps for latency seconds plus up to jitter seconds, then
+    returns one of CANNED_ANSWERS (chosen by the question in the prompt). With
+    stream=True the answer is split into chunks spread over the delay.
+    """
+
+    latency = 0.2
+    jitter = 0.05
+
+    def __init__(self, model_name=None, generation_config=None, **kwargs):
+        self.model_name = model_name
+
+    def _answer(self, prompt):
+        index = next((i for i, question in enumerate(QUESTIONS) if question in prompt), 0)
+        answer = dict(CANNED_ANSWERS[index], suggested_queries=QUESTIONS[:3])
+        return "```json\n" + json.dumps(answer) + "\n```"
+
+    def generate_content(self, prompt, stream=False, request_options=None, **kwargs):
+        text = self._answer(prompt)
+        delay = self.latency + random.uniform(0, self.jitter)
+        if not stream:
+            time.sleep(delay)
+            return FakeChunk(text)
+
+        def chunks(size=32):
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+            for piece in pieces:
+                time.sleep(delay / len(pieces))
+                yield FakeChunk(piece)
+        return chunks()
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KiB on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+def drive(app, endpoint, make_body, total_requests, concurrency, warmup=0):
+    """
+    Send total_requests POSTs to endpoint from concurrency threads
+
+    The first warmup requests are sent one at a time and not measured, so
+    pools, prepared plans and caches are filled before timing starts.
+
+    Returns:
+        A dictionary with latency percentiles (ms), requests/s, errors, the
+        process's peak RSS and how much of it the measured requests added
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(index):
+        nonlocal errors
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        response = client.post(endpoint, json=make_body(index))
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code >= 400:
+                errors += 1
+
+    warmup_client = app.test_client()
+    for index in range(warmup):
+        warmup_client.post(endpoint, json=make_body(-1 - index)).get_data()
+
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(total_requests)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "errors": errors,
+        "requests_per_second": round(total_requests / wall, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_growth_mb": round(peak_rss_mb() - rss_before, 1),
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Print changes against a baseline and list regressions beyond tolerance
+
+    A regression is a p95 latency more than tolerance (a fraction) above the
+    baseline, or throughput more than tolerance below it.
+    """
+    regressions = []
+    for scale, endpoints in results.items():
+        for endpoint, current in endpoints.items():
+            previous = baseline.get(scale, {}).get(endpoint)
+            if not previous:
+                continue
+            p95_change = (current["p95_ms"] - previous["p95_ms"]) / max(previous["p95_ms"], 1e-9)
+            rps_change = (current["requests_per_second"] - previous["requests_per_second"]) / max(
+                previous["requests_per_second"], 1e-9)
+            print(f"  {scale:<7} {endpoint:<18} p95 {p95_change:+.1%}  req/s {rps_change:+.1%}")
+            if p95_change > tolerance or rps_change < -tolerance:
+                regressions.append(f"{scale} {endpoint}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the QueryTalk query pipeline")
+    parser.add_argument("--scales", default="small", help=f"Comma-separated scales ({', '.join(SCALES)})")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and scale")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per endpoint before timing")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Fake model delay in seconds")
+    parser.add_argument("--model-jitter", type=float, default=0.05, help="Extra random fake model delay in seconds")
+    parser.add_argument("--database-url", default=None, help="Database to seed (default: a temporary SQLite file)")
+    parser.add_argument("--no-router", action="store_true", help="Send every voice query to the model")
+    parser.add_argument("--no-caches", action="store_true", help="Disable the result and persistent query caches")
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"), help="Baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95/throughput change before failing")
+    args = parser.parse_args()
+    unknown = [scale for scale in args.scales.split(",") if scale not in SCALES]
+    if unknown:
+        parser.error(f"Unknown scales: {', '.join(unknown)}")
+    return args
+
+def configure(args, environ):
+    """Point the app at the benchmark database; it reads its settings at import time"""
+    environ["DATABASE_URL"] = args.database_url
+    environ["GEMINI_API_KEY"] = "benchmark"
+    if args.no_router:
+        environ["ROUTER_ENABLED"] = "false"
+    if args.no_caches:
+        environ["RESULT_CACHE_ENABLED"] = "false"
+        environ["PERSISTENT_QUERY_CACHE_ENABLED"] = "false"
+
+def load_app(args):
+    """Import the app with Gemini replaced by FakeGenerativeModel"""
+    import logging
+    import google.generativeai as genai
+    FakeGenerativeModel.latency = args.model_latency
+    FakeGenerativeModel.jitter = args.model_jitter
+    genai.GenerativeModel = FakeGenerativeModel
+
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+def seed(args, scale):
+    """Truncate the database and generate the dataset for scale (runs in a child process)"""
+    configure(args, os.environ)
+    app = load_app(args)
+    from datagen import generate_dataset
+    with app.app_context():
+        return generate_dataset(truncate=True, progress=lambda *_: None, **SCALES[scale])
+
+def measure(args, scale, endpoint, run_id):
+    """Benchmark one endpoint in a fresh process (runs in a child process)"""
+    configure(args, os.environ)
+    if endpoint == "/api/run-sql":
+        # The same few statements repeat, so a warm result cache would answer all of them
+        os.environ["RESULT_CACHE_ENABLED"] = "false"
+    app = load_app(args)
+
+    if endpoint == "/api/voice-query":
+        # Every question is unique so each voice query reaches the (fake) model
+        make_body = lambda index: {"query": f"{QUESTIONS[index % len(QUESTIONS)]} {run_id}-{scale}-{index}"}
+    else:
+        make_body = lambda index: {"sql": CANNED_ANSWERS[index % len(CANNED_ANSWERS)]["sql"]}
+    return drive(app, endpoint, make_body, args.requests, args.concurrency, args.warmup)
+
+def in_new_process(function, *args):
+    """Run function in a freshly spawned interpreter and return its result"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+def main():
+    args = parse_args()
+    args.database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+
+    run_id = f"{time.time():.0f}"
+    results = {}
+    for scale in args.scales.split(","):
+        print(f"Seeding {scale} dataset...")
+        print(f"  {in_new_process(seed, args, scale)}")
+        results[scale] = {
+            endpoint: in_new_process(measure, args, scale, endpoint, run_id)
+            for endpoint in ("/api/voice-query", "/api/run-sql")
+        }
+
+    print(f"\n{'scale':<7} {'endpoint':<18} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'rss MiB':>8} {'+rss':>6} {'errors':>6}")
+    for scale, endpoints in results.items():
+        for endpoint, stats in endpoints.items():
+            print(f"{scale:<7} {endpoint:<18} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} "
+                  f"{stats['requests_per_second']:>9} {stats['peak_rss_mb']:>8} {stats['rss_growth_mb']:>6} {stats['errors']:>6}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nCompared with {args.baseline}:")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections import deque
+from google.api_core import exceptions as google_exceptions
+from config import (
+    CIRCUIT_BREAKER_WINDOW_SIZE,
+    CIRCUIT_BREAKER_MIN_CALLS,
+    CIRCUIT_BREAKER_FAILURE_RATE,
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+    CIRCUIT_BREAKER_PERMANENT_COOLDOWN_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Errors that will not go away by retrying soon (deprecated model, bad key)
+PERMANENT_ERRORS = (
+    google_exceptions.NotFound,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+)
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker for one Gemini model
+
+    The breaker opens when the failure rate over the last window_size calls
+    reaches failure_rate (after at least min_calls calls), or right away on a
+    permanent error such as a deprecated model. After the cooldown it lets a
+    single probe request through (half-open). A successful probe closes it,
+    and a failed probe opens it again.
+    """
+
+    def __init__(self, name, window_size=CIRCUIT_BREAKER_WINDOW_SIZE, min_calls=CIRCUIT_BREAKER_MIN_CALLS,
+                 failure_rate=CIRCUIT_BREAKER_FAILURE_RATE, cooldown_seconds=CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+                 permanent_cooldown_seconds=CIRCUIT_BREAKER_PERMANENT_COOLDOWN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self.permanent_cooldown_seconds = permanent_cooldown_seconds
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+        self._opened_at = None
+        self._open_for = cooldown_seconds
+        self._probe_started_at = None
+        self.total_successes = 0
+        self.total_failures = 0
+        self.last_error = None
+
+    def _open(self, cooldown):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._open_for = cooldown
+        self._probe_started_at = None
+        logger.warning(f"Circuit breaker for {self.name} opened for {cooldown}s: {self.last_error}")
+
+    def allow_request(self):
+        """
+        Check whether a request may be sent to this model
+
+        Returns:
+            True if the breaker is closed, or if this call is the half-open probe
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self._opened_at >= self._open_for:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                # Only one probe at a time; a probe that never reported back expires
+                if self._probe_started_at is None or now - self._probe_started_at >= self.cooldown_seconds:
+                    self._probe_started_at = now
+                    return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.total_successes += 1
+            self._outcomes.append(True)
+            if self.state != CLOSED:
+                logger.info(f"Circuit breaker for {self.name} closed after a successful probe")
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._outcomes.append(True)
+                self._probe_started_at = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.total_failures += 1
+            self._outcomes.append(False)
+            self.last_error = f"{type(error).__name__}: {str(error)[:200]}"
+
+            if isinstance(error, PERMANENT_ERRORS):
+                self._open(self.permanent_cooldown_seconds)
+            elif self.state == HALF_OPEN:
+                self._open(self.cooldown_seconds)
+            elif self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open(self.cooldown_seconds)
+
+    def status(self):
+        """
+        Get the breaker state for the status endpoint
+
+        Returns:
+            A dictionary with state, recent error rate and totals
+        """
+        with self._lock:
+            window = len(self._outcomes)
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0.0, round(self._open_for - (time.monotonic() - self._opened_at), 1))
+            return {
+                "state": self.state,
+                "error_rate": round(self._outcomes.count(False) / window, 4) if window else 0.0,
+                "window_calls": window,
+                "retry_in_seconds": retry_in,
+                "total_successes": self.total_successes,
+                "total_failures": self.total_failures,
+                "last_error": self.last_error,
+            }
+
+class CircuitBreakerRegistry:
+    """One CircuitBreaker per model name, created on first use"""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name)
+                self._breakers[name] = breaker
+            return breaker
+
+    def status(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.status() for breaker in breakers}
+
+# Breakers for the Gemini models used by ai_agent
+model_breakers = CircuitBreakerRegistry()
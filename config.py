@@ -3,6 +3,19 @@ import os
 # Gemini API configuration
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
 
+# Gemini models in order of preference, with hedging and timeouts
+GEMINI_MODEL_NAMES = [
+    name.strip() for name in os.environ.get(
+        "GEMINI_MODEL_NAMES",
+        "gemini-2.0-flash,models/gemini-2.0-flash,models/gemini-1.5-pro,gemini-1.0-pro,gemini-pro"
+    ).split(",") if name.strip()
+]
+GEMINI_HEDGE_DELAY_SECONDS = float(os.environ.get("GEMINI_HEDGE_DELAY_SECONDS", "2.5"))
+GEMINI_MODEL_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_MODEL_TIMEOUT_SECONDS", "20"))
+GEMINI_MAX_CONCURRENT_REQUESTS = int(os.environ.get("GEMINI_MAX_CONCURRENT_REQUESTS", "16"))
+# Stream model answers so /api/ask can start running the SQL before the explanation is written
+GEMINI_STREAM_RESPONSES = os.environ.get("GEMINI_STREAM_RESPONSES", "true").lower() == "true"
+
 # Database schema description for the AI agent
 DB_SCHEMA_DESCRIPTION = """
 This is a business intelligence database with the following tables:
@@ -38,6 +51,36 @@ Example business questions that can be answered:
 - Sales growth in specific regions
 """
 
+# Schema context sent to the model: "introspected" builds it from the models,
+# "description" sends DB_SCHEMA_DESCRIPTION as written
+SCHEMA_CONTEXT_MODE = os.environ.get("SCHEMA_CONTEXT_MODE", "introspected")
+SCHEMA_CONTEXT_TABLES = os.environ.get("SCHEMA_CONTEXT_TABLES", "sales,product,customer,query_history").split(",")
+SCHEMA_SAMPLE_COLUMNS = os.environ.get(
+    "SCHEMA_SAMPLE_COLUMNS", "product.category,customer.segment,customer.location"
+).split(",")
+SCHEMA_SAMPLE_MAX_VALUES = int(os.environ.get("SCHEMA_SAMPLE_MAX_VALUES", "12"))
+SCHEMA_SAMPLE_TTL_SECONDS = int(os.environ.get("SCHEMA_SAMPLE_TTL_SECONDS", "3600"))
+
+# Prompt templates (<language>.txt with $schema and $query placeholders)
+PROMPT_TEMPLATE_DIR = os.environ.get(
+    "PROMPT_TEMPLATE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+)
+PROMPT_DEFAULT_LANGUAGE = os.environ.get("PROMPT_DEFAULT_LANGUAGE", "en")
+
+# Keyword lexicons for the local intent matcher (<language>.json)
+INTENT_LEXICON_DIR = os.environ.get(
+    "INTENT_LEXICON_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents")
+)
+INTENT_MAX_LIMIT = int(os.environ.get("INTENT_MAX_LIMIT", "100"))
+
+# Local-first routing: intent matches at or above this confidence skip Gemini
+ROUTER_ENABLED = os.environ.get("ROUTER_ENABLED", "true").lower() == "true"
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.85"))
+# Share of locally answered queries also sent to Gemini in the background to measure agreement
+ROUTER_SHADOW_SAMPLE_RATE = float(os.environ.get("ROUTER_SHADOW_SAMPLE_RATE", "0.05"))
+
 # Chart configuration
 CHART_TYPES = {
     "BAR": "bar",
@@ -51,3 +94,109 @@ DEFAULT_CHART_COLORS = [
     "#4e79a7", "#f28e2c", "#e15759", "#76b7b2", 
     "#59a14f", "#edc949", "#af7aa1", "#ff9da7"
 ]
+
+# NL-to-SQL response cache settings
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "1024"))
+QUERY_CACHE_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_TTL_SECONDS", "3600"))
+QUERY_CACHE_FUZZY = os.environ.get("QUERY_CACHE_FUZZY", "true").lower() == "true"
+PERSISTENT_QUERY_CACHE_ENABLED = os.environ.get("PERSISTENT_QUERY_CACHE_ENABLED", "true").lower() == "true"
+PERSISTENT_QUERY_CACHE_MAX_ROWS = int(os.environ.get("PERSISTENT_QUERY_CACHE_MAX_ROWS", "50000"))
+PERSISTENT_QUERY_CACHE_TTL_SECONDS = int(os.environ.get("PERSISTENT_QUERY_CACHE_TTL_SECONDS", "604800"))
+PERSISTENT_QUERY_CACHE_EVICT_EVERY = int(os.environ.get("PERSISTENT_QUERY_CACHE_EVICT_EVERY", "100"))
+
+# SQL result-set cache settings
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "300"))
+
+# Streaming execution settings for /api/run-sql
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "1000"))
+STREAM_MAX_ROWS = int(os.environ.get("STREAM_MAX_ROWS", "1000000"))
+
+# Result serialization for /api/run-sql ("auto" uses orjson when installed, "json" forces the json module)
+RESULT_JSON_ENCODER = os.environ.get("RESULT_JSON_ENCODER", "auto").lower()
+
+# Arrow IPC / Parquet exports (/api/export, needs pyarrow)
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "50000"))
+EXPORT_MAX_ROWS = int(os.environ.get("EXPORT_MAX_ROWS", "50000000"))
+EXPORT_PARQUET_COMPRESSION = os.environ.get("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+# Pagination settings for /api/run-sql
+PAGINATION_DEFAULT_PAGE_SIZE = int(os.environ.get("PAGINATION_DEFAULT_PAGE_SIZE", "500"))
+PAGINATION_MAX_PAGE_SIZE = int(os.environ.get("PAGINATION_MAX_PAGE_SIZE", "10000"))
+PAGINATION_COUNT_CACHE_MAX_BYTES = int(os.environ.get("PAGINATION_COUNT_CACHE_MAX_BYTES", str(1024 * 1024)))
+
+# Circuit breaker settings for Gemini models
+CIRCUIT_BREAKER_WINDOW_SIZE = int(os.environ.get("CIRCUIT_BREAKER_WINDOW_SIZE", "20"))
+CIRCUIT_BREAKER_MIN_CALLS = int(os.environ.get("CIRCUIT_BREAKER_MIN_CALLS", "5"))
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.environ.get("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "30"))
+CIRCUIT_BREAKER_PERMANENT_COOLDOWN_SECONDS = float(os.environ.get("CIRCUIT_BREAKER_PERMANENT_COOLDOWN_SECONDS", "600"))
+
+# Synthetic data generator settings (flask generate-data)
+DATAGEN_BATCH_SIZE = int(os.environ.get("DATAGEN_BATCH_SIZE", "50000"))
+
+# Pre-aggregated rollup tables for dashboard queries
+ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "true").lower() == "true"
+# Start a background refresh when a query finds the rollups behind (the query itself uses sales)
+ROLLUP_REFRESH_ON_READ = os.environ.get("ROLLUP_REFRESH_ON_READ", "true").lower() == "true"
+ROLLUP_FRESHNESS_CHECK_SECONDS = float(os.environ.get("ROLLUP_FRESHNESS_CHECK_SECONDS", "5"))
+# Sales ids below the watermark that each refresh rescans, for rows whose transaction committed late
+ROLLUP_REFRESH_LAG_IDS = int(os.environ.get("ROLLUP_REFRESH_LAG_IDS", "10000"))
+
+# Sales table storage settings ("none" or "monthly" range partitioning on Postgres)
+SALES_PARTITIONING = os.environ.get("SALES_PARTITIONING", "none").lower()
+SALES_PARTITION_MONTHS_AHEAD = int(os.environ.get("SALES_PARTITION_MONTHS_AHEAD", "3"))
+SALES_BRIN_PAGES_PER_RANGE = int(os.environ.get("SALES_BRIN_PAGES_PER_RANGE", "32"))
+
+# Pre-execution guard for generated SQL (cost estimates are Postgres planner units)
+GUARD_ENABLED = os.environ.get("GUARD_ENABLED", "true").lower() == "true"
+GUARD_MAX_COST = float(os.environ.get("GUARD_MAX_COST", "5000000"))
+GUARD_MAX_ROWS = int(os.environ.get("GUARD_MAX_ROWS", "100000"))
+GUARD_AUTO_LIMIT = os.environ.get("GUARD_AUTO_LIMIT", "true").lower() == "true"
+GUARD_STATEMENT_TIMEOUT_MS = int(os.environ.get("GUARD_STATEMENT_TIMEOUT_MS", "15000"))
+GUARD_STREAM_STATEMENT_TIMEOUT_MS = int(os.environ.get("GUARD_STREAM_STATEMENT_TIMEOUT_MS", "120000"))
+GUARD_PLAN_CACHE_MAX_ENTRIES = int(os.environ.get("GUARD_PLAN_CACHE_MAX_ENTRIES", "2048"))
+GUARD_PLAN_CACHE_TTL_SECONDS = int(os.environ.get("GUARD_PLAN_CACHE_TTL_SECONDS", "600"))
+
+# Literal lifting, prepared statements and per-fingerprint stats for generated SQL
+SQL_NORMALIZE_ENABLED = os.environ.get("SQL_NORMALIZE_ENABLED", "true").lower() == "true"
+SQL_NORMALIZE_CACHE_SIZE = int(os.environ.get("SQL_NORMALIZE_CACHE_SIZE", "4096"))
+SQL_PREPARED_STATEMENTS = os.environ.get("SQL_PREPARED_STATEMENTS", "true").lower() == "true"
+SQL_PREPARED_MAX_PER_CONNECTION = int(os.environ.get("SQL_PREPARED_MAX_PER_CONNECTION", "100"))
+SQL_FINGERPRINT_STATS_MAX = int(os.environ.get("SQL_FINGERPRINT_STATS_MAX", "500"))
+SQL_FINGERPRINT_SAMPLES = int(os.environ.get("SQL_FINGERPRINT_SAMPLES", "200"))
+
+# Connection pool settings (pool sizing is ignored for SQLite)
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL", "")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+# Pre-ping costs a round trip per checkout; with DB_POOL_RECYCLE below the server's idle timeout it can be turned off
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_USE_LIFO = os.environ.get("DB_POOL_USE_LIFO", "false").lower() == "true"
+DB_REPLICA_POOL_SIZE = int(os.environ.get("DB_REPLICA_POOL_SIZE", str(DB_POOL_SIZE)))
+DB_REPLICA_MAX_OVERFLOW = int(os.environ.get("DB_REPLICA_MAX_OVERFLOW", str(DB_MAX_OVERFLOW)))
+DB_POOL_WAIT_SAMPLES = int(os.environ.get("DB_POOL_WAIT_SAMPLES", "1000"))
+
+# Background query jobs (/api/jobs)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+JOB_MAX_PENDING = int(os.environ.get("JOB_MAX_PENDING", "64"))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("JOB_RESULT_TTL_SECONDS", "600"))
+JOB_SSE_HEARTBEAT_SECONDS = float(os.environ.get("JOB_SSE_HEARTBEAT_SECONDS", "15"))
+# How often a worker re-reads the state of a job another worker is running
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get("JOB_POLL_INTERVAL_SECONDS", "0.5"))
+JOB_RETRY_AFTER_SECONDS = int(os.environ.get("JOB_RETRY_AFTER_SECONDS", "2"))
+
+# Per-stage timings (Server-Timing headers and /metrics histograms)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "true").lower() == "true"
+TRACING_HISTOGRAM_BUCKETS = [
+    float(bound) for bound in os.environ.get(
+        "TRACING_HISTOGRAM_BUCKETS", "0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30"
+    ).split(",")
+]
+# OpenTelemetry export needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http
+OTEL_ENABLED = os.environ.get("OTEL_ENABLED", "false").lower() == "true"
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "querytalk")
+OTEL_EXPORTER_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "")
@@ -1,12 +1,27 @@
 import logging
 import datetime
-from app import db
-from models import Product, Customer, Sales
+import click
+from sqlalchemy import insert, inspect, text
+from app import app, db
+from models import Product, Customer, Sales, QueryHistory
+from config import SALES_PARTITIONING, SALES_PARTITION_MONTHS_AHEAD
 
 logger = logging.getLogger(__name__)
 
+# Advisory lock key serializing sales migrations across gunicorn workers ("qtsales")
+SALES_MIGRATION_LOCK_ID = 0x717473616C6573
+
+def lock_sales_migration(connection):
+    """Hold the sales migration lock until the connection's transaction ends"""
+    connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SALES_MIGRATION_LOCK_ID})
+
 def initialize_sample_data():
-    """Initialize the database with sample data if tables are empty"""
+    """
+    Initialize the database with sample data if tables are empty
+
+    This is a small fixed demo dataset. Use "flask generate-data" (datagen.py)
+    for load-test scale data.
+    """
     # Check if data already exists
     if Product.query.first() is not None:
         logger.info("Sample data already exists in the database.")
@@ -53,6 +68,7 @@ def initialize_sample_data():
         sales = []
         today = datetime.date.today()
         start_date = today - datetime.timedelta(days=365)
+        prices = {product.id: product.price for product in products}
         
         # Generate sales for each month with seasonal variations
         for day_offset in range(365):
@@ -84,20 +100,18 @@ def initialize_sample_data():
                 quantity = ((day_offset + _ + product_id) % 5) + 1
                 
                 # Calculate total amount
-                product = next((p for p in products if p.id == product_id), None)
-                if product:
-                    total_amount = product.price * quantity
-                    
-                    # Create sales record
-                    sales.append(Sales(
-                        date=current_date,
-                        product_id=product_id,
-                        customer_id=customer_id,
-                        quantity=quantity,
-                        total_amount=total_amount
-                    ))
+                price = prices.get(product_id)
+                if price is not None:
+                    sales.append({
+                        "date": current_date,
+                        "product_id": product_id,
+                        "customer_id": customer_id,
+                        "quantity": quantity,
+                        "total_amount": price * quantity
+                    })
         
-        db.session.add_all(sales)
+        # One executemany INSERT instead of an ORM object per row
+        db.session.execute(insert(Sales), sales)
         db.session.commit()
         
         logger.info(f"Sample data initialized - {len(products)} products, {len(customers)} customers, {len(sales)} sales records")
@@ -106,3 +120,187 @@ def initialize_sample_data():
         db.session.rollback()
         logger.error(f"Error initializing sample data: {str(e)}")
         raise
+
+def record_query_history(voice_query, result):
+    """
+    Save a processed voice query to the query history
+    
+    Args:
+        voice_query: The natural language query text
+        result: The response from process_voice_query
+    """
+    query_history = QueryHistory(
+        voice_query=voice_query,
+        generated_sql=result['sql'],
+        explanation=result['explanation']
+    )
+    db.session.add(query_history)
+    db.session.commit()
+
+def ensure_sales_indexes():
+    """
+    Create any Sales indexes missing from an existing table
+
+    db.create_all only creates indexes together with a new table, so databases
+    created before the indexes were declared need this once.
+    
+    Returns:
+        The names of the indexes that were created
+    """
+    existing = {index["name"] for index in inspect(db.engine).get_indexes(Sales.__tablename__)}
+    created = []
+    with db.engine.begin() as connection:
+        for index in Sales.__table__.indexes:
+            if index.name in existing:
+                continue
+            # Skip the dialect-specific variant that does not apply here (BRIN vs btree)
+            if connection.dialect.name == 'postgresql' and index.name == 'ix_sales_date':
+                continue
+            if connection.dialect.name != 'postgresql' and index.name == 'ix_sales_date_brin':
+                continue
+            logger.info(f"Creating index {index.name} on sales...")
+            index.create(connection, checkfirst=True)
+            created.append(index.name)
+    return created
+
+def is_sales_partitioned(connection):
+    """Check whether sales is a partitioned table (Postgres only)"""
+    if connection.dialect.name != 'postgresql':
+        return False
+    kind = connection.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('sales')")).scalar()
+    return kind == 'p'
+
+def _month_start(date):
+    return date.replace(day=1)
+
+def _next_month(date):
+    return (date.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+def create_sales_partitions(connection, first_month, last_month):
+    """
+    Create the monthly sales partitions for a range of months if they are missing
+
+    Args:
+        connection: An open connection to a Postgres database
+        first_month: Any date in the first month to cover
+        last_month: Any date in the last month to cover
+
+    Returns:
+        The names of the partitions that were created
+    """
+    created = []
+    month = _month_start(first_month)
+    while month <= last_month:
+        following = _next_month(month)
+        name = f"sales_y{month.year}m{month.month:02d}"
+        if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+            connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF sales "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            ))
+            created.append(name)
+        month = following
+    return created
+
+def partition_sales_table():
+    """
+    Convert sales into a table range-partitioned by month (Postgres only)
+
+    The existing rows are copied into the new partitioned table in one
+    transaction, so the table is locked for writes while this runs. The
+    primary key becomes (id, date), because Postgres requires the partition
+    key in every unique constraint. Rows outside the created months land in
+    a default partition.
+    
+    Returns:
+        The number of partitions created, or 0 if sales was already partitioned
+    """
+    with db.engine.begin() as connection:
+        if connection.dialect.name != 'postgresql':
+            raise RuntimeError("Sales partitioning requires PostgreSQL")
+        # Other workers block here, then find the table already partitioned
+        lock_sales_migration(connection)
+        if is_sales_partitioned(connection):
+            logger.info("Sales table is already partitioned.")
+            return 0
+        
+        first_date, last_date = connection.execute(text("SELECT MIN(date), MAX(date) FROM sales")).one()
+        today = datetime.date.today()
+        first_date = min(first_date or today, today)
+        last_date = max(last_date or today, today)
+        for _ in range(SALES_PARTITION_MONTHS_AHEAD):
+            last_date = _next_month(last_date)
+        
+        # Index names are schema-wide, so drop them from the old table first
+        for index in Sales.__table__.indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text("ALTER TABLE sales RENAME TO sales_unpartitioned"))
+        connection.execute(text(
+            "CREATE TABLE sales (LIKE sales_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (date)"
+        ))
+        connection.execute(text("ALTER TABLE sales ADD PRIMARY KEY (id, date)"))
+        connection.execute(text("ALTER TABLE sales ADD FOREIGN KEY (product_id) REFERENCES product (id)"))
+        connection.execute(text("ALTER TABLE sales ADD FOREIGN KEY (customer_id) REFERENCES customer (id)"))
+        # Keep the id sequence alive when the old table is dropped
+        connection.execute(text("ALTER SEQUENCE sales_id_seq OWNED BY sales.id"))
+        
+        partitions = create_sales_partitions(connection, first_date, last_date)
+        connection.execute(text("CREATE TABLE sales_default PARTITION OF sales DEFAULT"))
+        connection.execute(text("INSERT INTO sales SELECT * FROM sales_unpartitioned"))
+        connection.execute(text("DROP TABLE sales_unpartitioned"))
+        
+        # Indexes on the parent are created on every partition
+        for index in Sales.__table__.indexes:
+            if index.name != 'ix_sales_date':
+                index.create(connection)
+        connection.execute(text("ANALYZE sales"))
+    
+    logger.info(f"Partitioned sales into {len(partitions)} monthly partitions")
+    return len(partitions)
+
+def prepare_sales_table():
+    """
+    Apply the configured SALES_PARTITIONING at startup
+
+    An empty sales table is partitioned right away. A populated one is left
+    alone, since copying it can take a long time; run "flask migrate-sales"
+    instead. On an already partitioned table this only adds the partitions for
+    the coming months.
+    """
+    if SALES_PARTITIONING != 'monthly' or db.engine.dialect.name != 'postgresql':
+        return
+    
+    with db.engine.begin() as connection:
+        lock_sales_migration(connection)
+        partitioned = is_sales_partitioned(connection)
+        if partitioned:
+            today = datetime.date.today()
+            last_month = today
+            for _ in range(SALES_PARTITION_MONTHS_AHEAD):
+                last_month = _next_month(last_month)
+            created = create_sales_partitions(connection, today, last_month)
+            if created:
+                logger.info(f"Created sales partitions: {', '.join(created)}")
+            return
+        has_rows = connection.execute(text("SELECT EXISTS (SELECT 1 FROM sales)")).scalar()
+    
+    if has_rows:
+        logger.warning("SALES_PARTITIONING is 'monthly' but sales is not partitioned; run 'flask migrate-sales'")
+    else:
+        partition_sales_table()
+
+@app.cli.command("migrate-sales")
+@click.option("--partition/--no-partition", default=None,
+              help="Convert sales to monthly partitions (default: on when SALES_PARTITIONING is 'monthly')")
+def migrate_sales_command(partition):
+    """Add missing sales indexes and optionally partition the table by month"""
+    if partition is None:
+        partition = SALES_PARTITIONING == 'monthly'
+    
+    if partition:
+        created = partition_sales_table()
+        click.echo(f"Created {created} monthly partitions")
+    
+    created = ensure_sales_indexes()
+    click.echo(f"Created indexes: {', '.join(created) if created else 'none'}")
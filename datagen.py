@@ -0,0 +1,221 @@
+import csv
+import datetime
+import io
+import logging
+import random
+import time
+import click
+from sqlalchemy import select, func, text
+from app import app, db
+from models import Product, Customer, Sales
+from result_cache import table_versions
+from rollups import refresh_rollups
+from config import DATAGEN_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ["Electronics", "Furniture", "Appliances", "Wearables", "Office Supplies", "Outdoor", "Toys", "Books"]
+SEGMENTS = ["Enterprise", "SMB", "Consumer"]
+SEGMENT_WEIGHTS = [1, 3, 6]
+LOCATIONS = [
+    "New York", "San Francisco", "Chicago", "Los Angeles", "Denver", "Miami", "Boston", "Seattle",
+    "Portland", "Austin", "Atlanta", "Dallas", "Phoenix", "Detroit", "Minneapolis", "Philadelphia",
+]
+QUANTITIES = [1, 2, 3, 4, 5]
+QUANTITY_WEIGHTS = [40, 25, 15, 12, 8]
+
+# Same seasonality as the sample data: busy Q4, quiet Q1
+MONTH_FACTORS = {1: 0.7, 2: 0.7, 3: 0.7, 4: 1.0, 5: 1.0, 6: 1.0, 7: 1.2, 8: 1.2, 9: 1.2, 10: 1.5, 11: 1.5, 12: 1.5}
+
+PRODUCT_COLUMNS = ["name", "category", "price", "cost"]
+CUSTOMER_COLUMNS = ["name", "email", "location", "segment", "created_at"]
+SALES_COLUMNS = ["date", "product_id", "customer_id", "quantity", "total_amount"]
+
+def _log_progress(stage, done, total):
+    logger.info(f"Generating {stage}: {done}/{total} rows")
+
+def _copy_rows(connection, table_name, columns, rows):
+    """Stream rows into Postgres with COPY ... FROM STDIN (CSV)"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+def write_batch(connection, table, columns, rows, use_copy):
+    """
+    Write one batch of row tuples using COPY or a bulk Core insert
+
+    Args:
+        connection: An open SQLAlchemy connection
+        table: The target Table
+        columns: Column names matching the tuple order
+        rows: List of row tuples
+        use_copy: Use Postgres COPY instead of an executemany INSERT
+    """
+    if not rows:
+        return
+    if use_copy:
+        _copy_rows(connection, table.name, columns, rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+def _id_range(connection, table, after_id):
+    """Get the ids inserted after after_id, as a range when they are contiguous"""
+    low, high, count = connection.execute(
+        select(func.min(table.c.id), func.max(table.c.id), func.count()).where(table.c.id > after_id)
+    ).one()
+    if count and high - low + 1 == count:
+        return range(low, high + 1)
+    return connection.execute(select(table.c.id).where(table.c.id > after_id).order_by(table.c.id)).scalars().all()
+
+def generate_dataset(products=100, customers=10000, days=365, rows_per_day=1000, batch_size=DATAGEN_BATCH_SIZE,
+                     seed=42, use_copy=None, truncate=False, progress=_log_progress):
+    """
+    Generate a synthetic sales dataset at the given scale
+
+    Rows are built in batches from vectorized random draws, with prices
+    looked up by id. Batches are written with Postgres COPY, or with bulk
+    Core inserts on other databases. With the defaults this writes about
+    400k sales rows. Raising rows_per_day and days scales it to tens of
+    millions.
+
+    Sales use the products and customers created by this run. With
+    products=0 (or customers=0) they use the existing ones instead.
+
+    Args:
+        products: Number of products to create
+        customers: Number of customers to create
+        days: Number of days of sales history, ending today
+        rows_per_day: Average sales rows per day before seasonality
+        batch_size: Rows per write batch
+        seed: Random seed, for reproducible datasets
+        use_copy: Force COPY on/off (defaults to on for PostgreSQL)
+        truncate: Delete existing sales, products and customers first
+        progress: Callback called as progress(stage, done, total)
+
+    Returns:
+        A dictionary with the number of rows written per table
+
+    Raises:
+        ValueError: If sales are requested but there are no products or
+            customers to sell to
+    """
+    rng = random.Random(seed)
+    if use_copy is None:
+        use_copy = db.engine.dialect.name == "postgresql"
+
+    product_table = Product.__table__
+    customer_table = Customer.__table__
+    sales_table = Sales.__table__
+    today = datetime.date.today()
+    start_date = today - datetime.timedelta(days=days)
+    day_counts = [
+        int(rows_per_day * MONTH_FACTORS[(start_date + datetime.timedelta(days=offset)).month])
+        for offset in range(days)
+    ]
+    total_sales = sum(day_counts)
+
+    with db.engine.begin() as connection:
+        if truncate:
+            if db.engine.dialect.name == "postgresql":
+                connection.execute(text("TRUNCATE sales, product, customer RESTART IDENTITY"))
+            else:
+                for table in (sales_table, product_table, customer_table):
+                    connection.execute(table.delete())
+
+        last_product_id = connection.execute(select(func.coalesce(func.max(product_table.c.id), 0))).scalar()
+        last_customer_id = connection.execute(select(func.coalesce(func.max(customer_table.c.id), 0))).scalar()
+
+        # Products
+        product_rows = []
+        for index in range(products):
+            price = round(rng.uniform(5, 1500), 2)
+            product_rows.append((f"Product {last_product_id + index + 1}", rng.choice(CATEGORIES), price,
+                                 round(price * rng.uniform(0.4, 0.8), 2)))
+        write_batch(connection, product_table, PRODUCT_COLUMNS, product_rows, use_copy)
+        progress("products", products, products)
+
+        # Customers, in batches since there can be millions
+        created_at = datetime.datetime.combine(start_date, datetime.time())
+        for batch_start in range(0, customers, batch_size):
+            count = min(batch_size, customers - batch_start)
+            numbers = range(last_customer_id + batch_start + 1, last_customer_id + batch_start + count + 1)
+            locations = rng.choices(LOCATIONS, k=count)
+            segments = rng.choices(SEGMENTS, weights=SEGMENT_WEIGHTS, k=count)
+            rows = [
+                (f"Customer {number}", f"customer{number}@example.com", location, segment, created_at)
+                for number, location, segment in zip(numbers, locations, segments)
+            ]
+            write_batch(connection, customer_table, CUSTOMER_COLUMNS, rows, use_copy)
+            progress("customers", batch_start + count, customers)
+
+        # Without new products or customers, sales go to the existing ones
+        product_prices = dict(connection.execute(
+            select(product_table.c.id, product_table.c.price)
+            .where(product_table.c.id > (last_product_id if products else 0))
+        ).all())
+        product_ids = list(product_prices)
+        customer_ids = _id_range(connection, customer_table, last_customer_id if customers else 0)
+        if total_sales and not (product_ids and customer_ids):
+            missing = "products" if not product_ids else "customers"
+            raise ValueError(f"No {missing} to generate sales for; pass --{missing} or generate them first")
+
+    # Sales are committed batch by batch so a long run does not hold one huge transaction
+    written = 0
+    batch = []
+    for offset, count in enumerate(day_counts):
+        sale_date = start_date + datetime.timedelta(days=offset)
+        product_draws = rng.choices(product_ids, k=count)
+        customer_draws = rng.choices(customer_ids, k=count)
+        quantity_draws = rng.choices(QUANTITIES, weights=QUANTITY_WEIGHTS, k=count)
+        batch.extend(
+            (sale_date, product_id, customer_id, quantity, round(product_prices[product_id] * quantity, 2))
+            for product_id, customer_id, quantity in zip(product_draws, customer_draws, quantity_draws)
+        )
+
+        while len(batch) >= batch_size or (offset == days - 1 and batch):
+            chunk, batch = batch[:batch_size], batch[batch_size:]
+            with db.engine.begin() as connection:
+                write_batch(connection, sales_table, SALES_COLUMNS, chunk, use_copy)
+            written += len(chunk)
+            progress("sales", written, total_sales)
+
+    # COPY bypasses SQLAlchemy's statement hooks, so invalidate cached results here
+    for table in (product_table, customer_table, sales_table):
+        table_versions.bump(table.name)
+
+    # Build the rollups now rather than on the first dashboard query
+    progress("rollups", 0, 1)
+    refresh_rollups(full=truncate)
+    progress("rollups", 1, 1)
+
+    return {"products": products, "customers": customers, "sales": written}
+
+@app.cli.command("generate-data")
+@click.option("--products", default=100, show_default=True, help="Number of products")
+@click.option("--customers", default=10000, show_default=True, help="Number of customers")
+@click.option("--days", default=365, show_default=True, help="Days of sales history")
+@click.option("--rows-per-day", default=1000, show_default=True, help="Average sales rows per day")
+@click.option("--batch-size", default=DATAGEN_BATCH_SIZE, show_default=True, help="Rows per write batch")
+@click.option("--seed", default=42, show_default=True, help="Random seed")
+@click.option("--copy/--no-copy", "use_copy", default=None, help="Force COPY on or off (default: on for PostgreSQL)")
+@click.option("--truncate", is_flag=True, help="Delete existing sales, products and customers first")
+def generate_data_command(products, customers, days, rows_per_day, batch_size, seed, use_copy, truncate):
+    """Generate a synthetic load-test dataset"""
+    started = time.monotonic()
+
+    def report(stage, done, total):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        click.echo(f"\r{stage}: {done:,}/{total:,} rows ({done / elapsed:,.0f} rows/s)", nl=done >= total)
+
+    try:
+        counts = generate_dataset(products=products, customers=customers, days=days, rows_per_day=rows_per_day,
+                                  batch_size=batch_size, seed=seed, use_copy=use_copy, truncate=truncate,
+                                  progress=report)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo(f"Done in {time.monotonic() - started:.1f}s: {counts}")
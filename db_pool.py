@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app import db
+from config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_REPLICA_POOL_SIZE,
+    DB_REPLICA_MAX_OVERFLOW,
+    DB_POOL_WAIT_SAMPLES,
+)
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = "replica"
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class PoolMetrics:
+    """
+    Checkout wait times and saturation for one engine's connection pool
+
+    The wait time is measured around engine.connect(), so it includes queueing
+    for a free connection and the pre-ping round trip when that is enabled.
+    """
+
+    def __init__(self, name, pool_size, max_overflow, samples=DB_POOL_WAIT_SAMPLES):
+        self.name = name
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self._waits = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self._waits.append(seconds)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self, engine):
+        """
+        Get pool usage and checkout wait statistics
+
+        Args:
+            engine: The engine these metrics belong to
+
+        Returns:
+            A dictionary with pool occupancy, saturation and wait percentiles
+        """
+        pool = engine.pool
+        checked_out = pool.checkedout() if hasattr(pool, "checkedout") else None
+        capacity = self.pool_size + max(self.max_overflow, 0)
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "pool_class": type(pool).__name__,
+                "pool_size": pool.size() if hasattr(pool, "size") else None,
+                "max_overflow": self.max_overflow,
+                "checked_out": checked_out,
+                "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+                "saturation": round(checked_out / capacity, 4) if checked_out is not None and capacity else None,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_p50_ms": round(_percentile(waits, 0.5) * 1000, 3),
+                "wait_p95_ms": round(_percentile(waits, 0.95) * 1000, 3),
+                "wait_p99_ms": round(_percentile(waits, 0.99) * 1000, 3),
+                "wait_max_ms": round(self.max_wait * 1000, 3),
+            }
+
+pool_metrics = {
+    "primary": PoolMetrics("primary", DB_POOL_SIZE, DB_MAX_OVERFLOW),
+    REPLICA_BIND: PoolMetrics(REPLICA_BIND, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW),
+}
+
+def read_engine():
+    """Get the engine for analytic reads: the replica if configured, else the primary"""
+    return db.engines.get(REPLICA_BIND) or db.engine
+
+def _engine_name(engine):
+    return REPLICA_BIND if engine is not db.engine else "primary"
+
+@contextmanager
+def timed_connect(engine=None):
+    """
+    Check a connection out of a pool and record how long that took
+
+    Args:
+        engine: The engine to connect to (defaults to read_engine())
+
+    Yields:
+        The SQLAlchemy connection
+    """
+    engine = engine or read_engine()
+    metrics = pool_metrics[_engine_name(engine)]
+    started = time.perf_counter()
+    try:
+        connection = engine.connect()
+    except PoolTimeoutError:
+        metrics.record_timeout()
+        logger.warning(f"Timed out waiting for a {metrics.name} database connection")
+        raise
+    metrics.record_wait(time.perf_counter() - started)
+    with connection:
+        yield connection
+
+def pool_stats():
+    """
+    Get pool metrics for the primary and (if configured) replica engines
+
+    Returns:
+        A dictionary keyed by engine name
+    """
+    stats = {"primary": pool_metrics["primary"].stats(db.engine)}
+    replica = db.engines.get(REPLICA_BIND)
+    if replica is not None:
+        stats[REPLICA_BIND] = pool_metrics[REPLICA_BIND].stats(replica)
+    return stats
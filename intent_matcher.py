@@ -0,0 +1,619 @@
+import datetime
+import json
+import logging
+import os
+import re
+import textwrap
+from query_cache import normalize_query
+from config import INTENT_LEXICON_DIR, PROMPT_DEFAULT_LANGUAGE, INTENT_MAX_LIMIT
+
+logger = logging.getLogger(__name__)
+
+SLOT_PATTERN = re.compile(r"\{(joins|where|limit)\}")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+# Joins that bring in the alias a filter needs, from the sales table
+FILTER_JOINS = {
+    "p": "JOIN product p ON s.product_id = p.id",
+    "c": "JOIN customer c ON s.customer_id = c.id",
+}
+FILTER_COLUMNS = {
+    "category": "p.category",
+    "segment": "c.segment",
+    "location": "c.location",
+}
+
+class SQLTemplate:
+    """
+    A SQL template compiled into literal segments and {joins}/{where}/{limit} slots
+
+    Like the prompt templates, it is split once at import time so rendering is
+    a single join. Only validated values are substituted: integers, ISO dates
+    and filter values from the lexicons.
+    """
+
+    def __init__(self, template_text):
+        parts = SLOT_PATTERN.split(textwrap.dedent(template_text).strip())
+        self._literals = parts[0::2]
+        self._slots = parts[1::2]
+        self.slots = frozenset(self._slots)
+        self.aliases = set(re.findall(r"\b(?:FROM|JOIN)\s+\w+\s+(\w)\b", template_text))
+
+    def render(self, joins="", where="", limit=""):
+        values = {"joins": joins, "where": where, "limit": str(limit)}
+        pieces = [self._literals[0]]
+        for slot, literal in zip(self._slots, self._literals[1:]):
+            pieces.append(values[slot])
+            pieces.append(literal)
+        return "".join(pieces)
+
+class Intent:
+    """
+    One kind of question the matcher can answer without the model
+
+    Args:
+        name: Intent name, also the key of its explanation in the lexicons
+        requires: Concepts that must all be present; a tuple means any one of them
+        sql: SQL template with {joins}, {where} and optionally {limit} slots
+        chart_type: Recommended chart type
+        query_type: The type of analysis
+        boosts: Optional concepts that make this intent a better match
+        excludes: Concepts that rule this intent out
+        default_limit: Row limit when the query does not give one
+    """
+
+    def __init__(self, name, requires, sql, chart_type, query_type, boosts=(), excludes=(), default_limit=10):
+        self.name = name
+        self.requires = [group if isinstance(group, tuple) else (group,) for group in requires]
+        self.template = SQLTemplate(sql)
+        self.chart_type = chart_type
+        self.query_type = query_type
+        self.boosts = set(boosts)
+        self.excludes = set(excludes)
+        self.default_limit = default_limit
+        # Every concept the SQL answers for; any other concept in a query is left unanswered
+        self.concepts = self.boosts.union(*self.requires)
+
+    def score(self, concepts):
+        """Score how well the concepts fit this intent, or 0 if they rule it out"""
+        if concepts & self.excludes:
+            return 0.0
+        if not all(concepts.intersection(group) for group in self.requires):
+            return 0.0
+        return len(self.requires) + 0.5 * len(concepts & self.boosts)
+
+# Checked in order; earlier intents win ties
+INTENTS = [
+    Intent("revenue_by_category", ["category", "sales"], """
+        SELECT p.category, SUM(s.total_amount) AS total_revenue
+        FROM sales s
+        JOIN product p ON s.product_id = p.id{joins}{where}
+        GROUP BY p.category
+        ORDER BY total_revenue DESC
+    """, "bar", "comparison", boosts=["product", "total"]),
+    Intent("products_by_category", ["category"], """
+        SELECT p.category, COUNT(*) AS product_count
+        FROM product p{joins}{where}
+        GROUP BY p.category
+        ORDER BY product_count DESC
+    """, "pie", "distribution", boosts=["product", "count"], excludes=["sales", "quantity", "top", "bottom"]),
+    Intent("top_products_by_quantity", ["product", "quantity"], """
+        SELECT p.name, SUM(s.quantity) AS total_quantity
+        FROM sales s
+        JOIN product p ON s.product_id = p.id{joins}{where}
+        GROUP BY p.name
+        ORDER BY total_quantity DESC
+        LIMIT {limit}
+    """, "bar", "comparison", boosts=["top", "sales", "total"], excludes=["bottom"]),
+    Intent("bottom_products", ["product", "bottom"], """
+        SELECT p.name, SUM(s.total_amount) AS total_revenue
+        FROM sales s
+        JOIN product p ON s.product_id = p.id{joins}{where}
+        GROUP BY p.name
+        ORDER BY total_revenue ASC
+        LIMIT {limit}
+    """, "bar", "comparison", boosts=["sales"], default_limit=5),
+    Intent("top_products", ["product", "top"], """
+        SELECT p.name, SUM(s.total_amount) AS total_revenue
+        FROM sales s
+        JOIN product p ON s.product_id = p.id{joins}{where}
+        GROUP BY p.name
+        ORDER BY total_revenue DESC
+        LIMIT {limit}
+    """, "bar", "comparison", boosts=["sales", "total"], default_limit=5),
+    Intent("top_customers", ["customer", "top"], """
+        SELECT c.name, SUM(s.total_amount) AS total_spent
+        FROM sales s
+        JOIN customer c ON s.customer_id = c.id{joins}{where}
+        GROUP BY c.name
+        ORDER BY total_spent DESC
+        LIMIT {limit}
+    """, "bar", "comparison", boosts=["sales", "total"]),
+    Intent("monthly_average_order_value", ["average", "month"], """
+        SELECT DATE_TRUNC('month', s.date) AS month, AVG(s.total_amount) AS average_sale_amount, COUNT(*) AS sale_count
+        FROM sales s{joins}{where}
+        GROUP BY month
+        ORDER BY month
+    """, "line", "time_series", boosts=["sales", "orders", "trend"], excludes=["day"]),
+    Intent("monthly_trend", [("month", "trend"), ("sales", "orders")], """
+        SELECT DATE_TRUNC('month', s.date) AS month, SUM(s.total_amount) AS total_revenue
+        FROM sales s{joins}{where}
+        GROUP BY month
+        ORDER BY month
+    """, "line", "time_series", boosts=["month", "trend", "total"], excludes=["day", "average"]),
+    Intent("daily_trend", ["day"], """
+        SELECT s.date, SUM(s.total_amount) AS total_revenue
+        FROM sales s{joins}{where}
+        GROUP BY s.date
+        ORDER BY s.date
+    """, "line", "time_series", boosts=["sales", "trend", "total"], excludes=["average"]),
+    Intent("customers_by_segment", ["segment", "customer", "count"], """
+        SELECT c.segment, COUNT(*) AS customer_count
+        FROM customer c{joins}{where}
+        GROUP BY c.segment
+        ORDER BY customer_count DESC
+    """, "pie", "distribution", excludes=["sales"]),
+    Intent("revenue_by_segment", ["segment"], """
+        SELECT c.segment, SUM(s.total_amount) AS total_revenue
+        FROM sales s
+        JOIN customer c ON s.customer_id = c.id{joins}{where}
+        GROUP BY c.segment
+        ORDER BY total_revenue DESC
+    """, "pie", "distribution", boosts=["customer", "sales", "total"]),
+    Intent("customers_by_location", ["location", "customer", "count"], """
+        SELECT c.location, COUNT(*) AS customer_count
+        FROM customer c{joins}{where}
+        GROUP BY c.location
+        ORDER BY customer_count DESC
+    """, "bar", "distribution", excludes=["sales"]),
+    Intent("revenue_by_location", ["location"], """
+        SELECT c.location, SUM(s.total_amount) AS total_revenue
+        FROM sales s
+        JOIN customer c ON s.customer_id = c.id{joins}{where}
+        GROUP BY c.location
+        ORDER BY total_revenue DESC
+    """, "bar", "comparison", boosts=["customer", "sales", "total"]),
+    Intent("average_order_value", ["average"], """
+        SELECT AVG(s.total_amount) AS average_sale_amount, COUNT(*) AS sale_count
+        FROM sales s{joins}{where}
+    """, "bar", "general", boosts=["sales", "orders"]),
+    Intent("order_count", ["count", ("orders", "sales")], """
+        SELECT COUNT(*) AS sale_count, SUM(s.quantity) AS total_quantity
+        FROM sales s{joins}{where}
+    """, "bar", "general"),
+    Intent("total_revenue", ["sales"], """
+        SELECT SUM(s.total_amount) AS total_revenue, COUNT(*) AS sale_count
+        FROM sales s{joins}{where}
+    """, "bar", "general", boosts=["total"]),
+]
+
+# Used when no intent matches, as the old keyword fallback did
+DEFAULT_INTENT = Intent("default", [], """
+    SELECT p.name AS product_name, SUM(s.quantity) AS total_quantity, SUM(s.total_amount) AS total_revenue
+    FROM sales s
+    JOIN product p ON s.product_id = p.id{joins}{where}
+    GROUP BY p.name
+    ORDER BY total_revenue DESC
+    LIMIT {limit}
+""", "bar", "comparison")
+
+class Match:
+    """One recognised keyword: a concept, a number or a filter value"""
+
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+class Lexicon:
+    """
+    Keywords, number words and filter values for one language
+
+    Every phrase is indexed once, after the same normalization as queries.
+    Space-separated languages are matched token by token, longest phrase
+    first. Languages written without spaces (segmentation "characters") are
+    matched with one precompiled alternation, longest keyword first.
+    """
+
+    def __init__(self, language, data, shared_values=None):
+        self.language = language
+        self.segmentation = data.get("segmentation", "tokens")
+        self.explanations = data.get("explanations", {})
+        self.suggested_queries = data.get("suggested_queries", [])
+        self.index = {}
+
+        for kind, values in (shared_values or {}).items():
+            self._add_values(kind, values)
+        for kind, values in data.get("values", {}).items():
+            self._add_values(kind, values)
+        for word, number in data.get("numbers", {}).items():
+            self._add(word, ("number", number))
+        for concept, words in data.get("concepts", {}).items():
+            for word in words:
+                self._add(word, ("concept", concept))
+
+        self.stopwords = {normalize_query(word) for word in data.get("stopwords", [])}
+        self.max_phrase_tokens = max((len(phrase.split()) for phrase in self.index), default=1)
+        if self.segmentation == "characters":
+            keywords = sorted(self.index, key=len, reverse=True)
+            self.pattern = re.compile("|".join([re.escape(keyword) for keyword in keywords] + [DIGITS_PATTERN.pattern]))
+            self.stopword_pattern = re.compile("|".join(re.escape(word) for word in sorted(self.stopwords, key=len, reverse=True) if word))
+
+    def _add(self, phrase, entry):
+        key = normalize_query(phrase)
+        if key:
+            self.index[key] = entry
+
+    def _add_values(self, kind, values):
+        for word, canonical in values.items():
+            self._add(word, ("value", (kind, canonical)))
+
+    def scan(self, query_text):
+        """
+        Find every known keyword in a query
+
+        Args:
+            query_text: The natural language query text
+
+        Returns:
+            Tuple of (matches, unknown) where unknown is the amount of the
+            query's content (ignoring stopwords) that was not recognised, in
+            tokens (or characters). Numbers are not counted either way; they
+            only count as recognised once they are used (see coverage)
+        """
+        text = normalize_query(query_text)
+        if self.segmentation == "characters":
+            return self._scan_characters(text)
+        return self._scan_tokens(text.split())
+
+    def _scan_tokens(self, tokens):
+        matches = []
+        unknown = 0
+        position = 0
+        while position < len(tokens):
+            token = tokens[position]
+            if token.isdigit():
+                matches.append(Match("number", int(token), position, position + 1))
+                position += 1
+                continue
+
+            for size in range(min(self.max_phrase_tokens, len(tokens) - position), 0, -1):
+                entry = self.index.get(" ".join(tokens[position:position + size]))
+                if entry is not None:
+                    matches.append(Match(*entry, position, position + size))
+                    position += size
+                    break
+            else:
+                if token not in self.stopwords:
+                    unknown += 1
+                position += 1
+
+        return matches, unknown
+
+    def _scan_characters(self, text):
+        matches = []
+        remainder = []
+        last_end = 0
+        for found in self.pattern.finditer(text):
+            keyword = found.group()
+            if keyword.isdigit():
+                matches.append(Match("number", int(keyword), found.start(), found.end()))
+            else:
+                matches.append(Match(*self.index[keyword], found.start(), found.end()))
+            remainder.append(text[last_end:found.start()])
+            last_end = found.end()
+        remainder.append(text[last_end:])
+
+        rest = " ".join(remainder)
+        if self.stopwords:
+            rest = self.stopword_pattern.sub(" ", rest)
+        return matches, len(rest.replace(" ", ""))
+
+def coverage(matches, unknown, used_numbers=()):
+    """
+    Share of a query's content that was recognised
+
+    Numbers count as recognised only when they were used (as the row limit, a
+    day count or the year of the date range); others count as unknown.
+
+    Args:
+        matches: Matches from Lexicon.scan
+        unknown: Unrecognised content from Lexicon.scan
+        used_numbers: The number matches that were used
+
+    Returns:
+        A float between 0 and 1
+    """
+    recognised = 0
+    for match in matches:
+        size = match.end - match.start
+        if match.kind != "number" or any(match is used for used in used_numbers):
+            recognised += size
+        else:
+            unknown += size
+    return recognised / max(recognised + unknown, 1)
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _previous_month_start(day):
+    return (_month_start(day) - datetime.timedelta(days=1)).replace(day=1)
+
+# Numbers read as a year ("in 2023") rather than as a row limit
+YEARS = range(1900, 2101)
+
+# Date range concepts: function of today -> (start, end) with an exclusive end
+DATE_RANGES = {
+    "date_last_month": lambda today: (_previous_month_start(today), _month_start(today)),
+    "date_this_month": lambda today: (_month_start(today), today + datetime.timedelta(days=1)),
+    "date_this_year": lambda today: (today.replace(month=1, day=1), today + datetime.timedelta(days=1)),
+    "date_last_year": lambda today: (today.replace(year=today.year - 1, month=1, day=1), today.replace(month=1, day=1)),
+}
+
+# Concepts that only carry parameters (a date range, a negation) rather than pick an intent
+PARAMETER_CONCEPTS = {"negation", "date_recent", "date_days", *DATE_RANGES}
+
+def extract_parameters(matches, today=None):
+    """
+    Pull the row limit, date range and filter values out of the keyword matches
+
+    A number directly before a "days" keyword ("last 30 days") sets the date
+    range, and so does a year ("in 2023") or a date keyword ("last month"),
+    whichever comes first; the first other number is the row limit. A query
+    with a negation
+    ("excluding electronics", "電子機器以外") gets no filters, since the
+    value may be the one to leave out.
+
+    Args:
+        matches: Matches from Lexicon.scan
+        today: Date the ranges are relative to (defaults to today)
+
+    Returns:
+        A dictionary with "limit", "date_range" ((start, end) or None),
+        "filters" (kind -> canonical value), "negated" (whether the query has
+        a negation), "limit_number" / "date_numbers" (the number matches
+        used for each) and "years" (every number read as a year)
+    """
+    today = today or datetime.date.today()
+    limit = None
+    limit_number = None
+    date_range = None
+    filters = {}
+    date_numbers = []
+    years = []
+    negated = any(match.kind == "concept" and match.value == "negation" for match in matches)
+
+    for match in matches:
+        if match.kind == "concept" and match.value == "date_days":
+            for number in matches:
+                if number.kind == "number" and 0 <= match.start - number.end <= 1 and date_range is None:
+                    date_numbers.append(number)
+                    # The last N days include today
+                    date_range = (today - datetime.timedelta(days=number.value - 1), today + datetime.timedelta(days=1))
+
+    for match in matches:
+        if match.kind == "number" and any(match is number for number in date_numbers):
+            continue
+        if match.kind == "number" and match.value in YEARS:
+            years.append(match)
+            if date_range is None:
+                date_numbers.append(match)
+                date_range = (datetime.date(match.value, 1, 1), datetime.date(match.value + 1, 1, 1))
+        elif match.kind == "number" and limit is None:
+            limit = match.value
+            limit_number = match
+        elif match.kind == "concept" and match.value in DATE_RANGES and date_range is None:
+            date_range = DATE_RANGES[match.value](today)
+        elif match.kind == "value" and not negated:
+            kind, canonical = match.value
+            filters.setdefault(kind, canonical)
+
+    return {
+        "limit": limit,
+        "date_range": date_range,
+        "filters": filters,
+        "negated": negated,
+        "limit_number": limit_number,
+        "date_numbers": date_numbers,
+        "years": years,
+    }
+
+def _sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+class IntentMatcher:
+    """
+    Answer common questions locally from keyword tables, without the model
+
+    Lexicons are loaded from <language>.json files, and every lexicon also
+    knows the default language's filter values (city names,
+    English category names). A query is scanned once against the token index,
+    each intent is scored on the concepts found, and the best intent's
+    precompiled SQL is rendered with the extracted parameters.
+    """
+
+    def __init__(self, intents=INTENTS, default_intent=DEFAULT_INTENT, default_language=PROMPT_DEFAULT_LANGUAGE):
+        self.intents = intents
+        self.default_intent = default_intent
+        self.default_language = default_language
+        self._lexicons = {}
+
+    def load_directory(self, directory):
+        """
+        Load every <language>.json lexicon in a directory
+
+        Args:
+            directory: Path to the lexicon directory
+
+        Returns:
+            The list of language codes that were loaded
+        """
+        data = {}
+        for filename in sorted(os.listdir(directory)):
+            language, extension = os.path.splitext(filename)
+            if extension != ".json":
+                continue
+            with open(os.path.join(directory, filename), encoding="utf-8") as lexicon_file:
+                data[language] = json.load(lexicon_file)
+
+        shared_values = data.get(self.default_language, {}).get("values", {})
+        for language, lexicon_data in data.items():
+            self._lexicons[language] = Lexicon(language, lexicon_data, shared_values)
+
+        logger.info(f"Loaded intent lexicons for languages: {', '.join(data)}")
+        return list(data)
+
+    def lexicon(self, language):
+        """Get the lexicon for a language, falling back to the default language"""
+        return self._lexicons.get(language) or self._lexicons[self.default_language]
+
+    def classify(self, query_text, language_code='en'):
+        """
+        Find the best intent for a query
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+
+        Returns:
+            Tuple of (intent or None, matches, unknown, lexicon)
+        """
+        lexicons = [self.lexicon(language_code)]
+        if lexicons[0].language != self.default_language:
+            # Queries often mix in English words; try the default language too
+            lexicons.append(self._lexicons[self.default_language])
+
+        scans = []
+        for lexicon in lexicons:
+            matches, unknown = lexicon.scan(query_text)
+            concepts = {match.value for match in matches if match.kind == "concept"}
+            best_score, best_intent = 0.0, None
+            for intent in self.intents:
+                score = intent.score(concepts)
+                if score > best_score:
+                    best_score, best_intent = score, intent
+            if best_intent is not None:
+                return best_intent, matches, unknown, lexicon
+            scans.append((matches, unknown, lexicon))
+
+        matches, unknown, lexicon = scans[0]
+        return None, matches, unknown, lexicon
+
+    def render_sql(self, intent, parameters):
+        """
+        Render an intent's SQL with the extracted parameters
+
+        Filters and date ranges are only applied where the intent's tables
+        allow them (joining product or customer from sales when needed).
+
+        Returns:
+            Tuple of (sql, applied filters dict, whether the date range was applied)
+        """
+        aliases = intent.template.aliases
+        joins = []
+        conditions = []
+        applied = {}
+
+        date_range = parameters["date_range"]
+        if date_range and "s" in aliases:
+            start, end = date_range
+            conditions.append(f"s.date >= {_sql_string(start.isoformat())} AND s.date < {_sql_string(end.isoformat())}")
+        else:
+            date_range = None
+
+        for kind, value in parameters["filters"].items():
+            column = FILTER_COLUMNS[kind]
+            alias = column.split(".")[0]
+            if alias not in aliases:
+                if "s" not in aliases:
+                    continue
+                if FILTER_JOINS[alias] not in joins:
+                    joins.append(FILTER_JOINS[alias])
+            conditions.append(f"{column} = {_sql_string(value)}")
+            applied[kind] = value
+
+        limit = parameters["limit"] or intent.default_limit
+        sql = intent.template.render(
+            joins="".join(f"\n{join}" for join in joins),
+            where=f"\nWHERE {' AND '.join(conditions)}" if conditions else "",
+            limit=max(1, min(int(limit), INTENT_MAX_LIMIT)),
+        )
+        return sql, applied, date_range is not None
+
+    def match(self, query_text, language_code='en', today=None):
+        """
+        Build a full response for a query from the best matching intent
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+            today: Date that relative date ranges are based on (defaults to today)
+
+        Returns:
+            A dictionary shaped like a model response, plus "intent", a
+            "confidence" between 0 and 1 (0 when no intent matched and the
+            default query was used, or when the query has a negation) and
+            "unapplied", the parameters found in the query that the intent's
+            SQL could not use ("limit", "date_range" or a filter kind, also
+            "date_range" for a year the date range does not cover), and
+            "concept:<name>" for every concept in the query that the intent
+            does not answer for ("average" matched to a SUM intent)
+        """
+        intent, matches, unknown, lexicon = self.classify(query_text, language_code)
+        matched = intent is not None
+        intent = intent or self.default_intent
+        parameters = extract_parameters(matches, today)
+        sql, applied, dated = self.render_sql(intent, parameters)
+
+        used_numbers = list(parameters["date_numbers"]) if dated else []
+        if parameters["limit_number"] is not None and "limit" in intent.template.slots:
+            used_numbers.append(parameters["limit_number"])
+        unapplied = [kind for kind in parameters["filters"] if kind not in applied]
+        ignored_years = [year for year in parameters["years"] if not any(year is used for used in used_numbers)]
+        if (parameters["date_range"] and not dated) or ignored_years:
+            unapplied.insert(0, "date_range")
+        if parameters["limit_number"] is not None and "limit" not in intent.template.slots:
+            unapplied.insert(0, "limit")
+        if matched:
+            unapplied.extend(
+                f"concept:{concept}" for concept in sorted({match.value for match in matches if match.kind == "concept"})
+                if concept not in intent.concepts and concept not in PARAMETER_CONCEPTS
+            )
+        if matched and not parameters["negated"]:
+            confidence = round(coverage(matches, unknown, used_numbers), 3)
+        else:
+            confidence = 0.0
+
+        explanations = lexicon.explanations
+        fallback_explanations = self.lexicon(self.default_language).explanations
+        limit = max(1, min(int(parameters["limit"] or intent.default_limit), INTENT_MAX_LIMIT))
+        explanation = explanations.get(intent.name, fallback_explanations[intent.name]).format(limit=limit)
+        if dated:
+            start, end = parameters["date_range"]
+            end = end - datetime.timedelta(days=1)
+            explanation += explanations.get("date_range", fallback_explanations["date_range"]).format(
+                start=start.isoformat(), end=end.isoformat())
+        for value in applied.values():
+            explanation += explanations.get("filter", fallback_explanations["filter"]).format(value=value)
+
+        return {
+            "sql": sql,
+            "explanation": explanation,
+            "chart_type": intent.chart_type,
+            "suggested_queries": list(lexicon.suggested_queries),
+            "query_type": intent.query_type,
+            "model": "fallback",
+            "intent": intent.name,
+            "confidence": confidence,
+            "unapplied": unapplied,
+        }
+
+    def languages(self):
+        return sorted(self._lexicons)
+
+# Lexicons shared by generate_fallback_sql, indexed once at import
+intent_matcher = IntentMatcher()
+intent_matcher.load_directory(INTENT_LEXICON_DIR)
@@ -0,0 +1,422 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select, update, delete
+from sqlalchemy.exc import SQLAlchemyError
+from app import app, db
+from models import QueryJob
+from database import record_query_history
+from ai_agent import process_voice_query, fetch_sql_rows_cached
+from config import JOB_WORKERS, JOB_MAX_PENDING, JOB_RESULT_TTL_SECONDS, JOB_POLL_INTERVAL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+GENERATING = "generating"
+SQL_READY = "sql_ready"
+EXECUTING = "executing"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class JobQueueFullError(Exception):
+    """Raised when too many jobs are already queued or running"""
+
+class JobStore:
+    """
+    Job state in the query_job table, so every worker can answer for a job
+
+    The worker that accepted a job runs it and writes each status change here;
+    the others read it back. Database errors are logged and otherwise ignored
+    so the store can never fail a job.
+    """
+
+    def __init__(self):
+        self.table = QueryJob.__table__
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def _failed(self, action, e):
+        with self._lock:
+            self.errors += 1
+        logger.warning(f"Could not {action} query job state: {str(e)}")
+
+    def save(self, job):
+        """Write the job's status, events and result"""
+        values = {
+            "status": job.status,
+            "events_json": json.dumps(job.events, default=str),
+            "result_json": json.dumps(job.ai_result, default=str) if job.ai_result else None,
+            "error": job.error,
+            "finished_at": job.finished_at,
+        }
+        try:
+            with db.engine.begin() as connection:
+                updated = connection.execute(update(self.table).where(self.table.c.id == job.id).values(**values))
+                if updated.rowcount == 0:
+                    connection.execute(self.table.insert().values(
+                        id=job.id, query_text=job.query_text, language=job.language_code,
+                        created_at=job.created_at, **values
+                    ))
+        except SQLAlchemyError as e:
+            self._failed("save", e)
+
+    def load(self, job_id):
+        """
+        Read a job written by any worker
+
+        Returns:
+            The query_job row, or None if there is no such job
+        """
+        try:
+            with db.engine.connect() as connection:
+                return connection.execute(select(self.table).where(self.table.c.id == job_id)).first()
+        except SQLAlchemyError as e:
+            self._failed("load", e)
+            return None
+
+    def claim(self, job_id):
+        """
+        Move a queued job to generating unless another worker cancelled it
+
+        Returns:
+            False if the job was cancelled
+        """
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(
+                    select(self.table.c.status).where(self.table.c.id == job_id)
+                ).first()
+                if row is None:
+                    return True
+                return connection.execute(
+                    update(self.table)
+                    .where(self.table.c.id == job_id)
+                    .where(self.table.c.status == QUEUED)
+                    .values(status=GENERATING)
+                ).rowcount == 1
+        except SQLAlchemyError as e:
+            self._failed("claim", e)
+            return True
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that is still queued on another worker
+
+        The status only changes while it is still "queued", so a job the
+        owning worker has already claimed keeps running.
+
+        Returns:
+            True if the job was cancelled
+        """
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(select(self.table).where(self.table.c.id == job_id)).first()
+                if row is None or row.status != QUEUED:
+                    return False
+                now = time.time()
+                events = json.loads(row.events_json)
+                events.append({"seq": len(events), "status": CANCELLED, "at": now})
+                return connection.execute(
+                    update(self.table)
+                    .where(self.table.c.id == job_id)
+                    .where(self.table.c.status == QUEUED)
+                    .values(status=CANCELLED, events_json=json.dumps(events), finished_at=now)
+                ).rowcount == 1
+        except SQLAlchemyError as e:
+            self._failed("cancel", e)
+            return False
+
+    def expire(self, ttl_seconds):
+        """Delete jobs that finished more than ttl_seconds ago"""
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(delete(self.table).where(self.table.c.finished_at < time.time() - ttl_seconds))
+        except SQLAlchemyError as e:
+            self._failed("expire", e)
+
+class Job:
+    """
+    One voice query moving through generation and execution
+
+    Every status change is appended to events with an increasing "seq", so
+    pollers and SSE clients can resume from the last event they saw, and is
+    written to the store for the other workers.
+    """
+
+    def __init__(self, query_text, language_code, store=None):
+        self.id = uuid.uuid4().hex
+        self.query_text = query_text
+        self.language_code = language_code
+        self.status = QUEUED
+        self.events = []
+        self.ai_result = None
+        self.rows = None
+        self.columns = None
+        self.decision = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self.store = store
+        self._condition = threading.Condition()
+        self.publish(QUEUED)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def publish(self, status, **data):
+        """Move the job to a new status and wake up anyone waiting for events"""
+        with self._condition:
+            self.status = status
+            if status in FINISHED_STATES:
+                self.finished_at = time.time()
+            self.events.append({"seq": len(self.events), "status": status, "at": time.time(), **data})
+            if self.store is not None:
+                self.store.save(self)
+            self._condition.notify_all()
+
+    def wait_for_events(self, after_seq, timeout):
+        """
+        Wait until there are events with seq >= after_seq
+
+        Args:
+            after_seq: The first event seq the caller has not seen
+            timeout: Seconds to wait before returning an empty list
+
+        Returns:
+            The list of new events
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.events) > after_seq, timeout)
+            return self.events[after_seq:]
+
+    def result_rows(self):
+        """
+        Get the rows of a finished job
+
+        Returns:
+            A (rows, columns, decision) tuple
+        """
+        return self.rows, self.columns, self.decision
+
+    def to_dict(self):
+        with self._condition:
+            return {
+                "jobId": self.id,
+                "status": self.status,
+                "query": self.query_text,
+                "language": self.language_code,
+                "events": list(self.events),
+                "error": self.error,
+                "createdAt": self.created_at,
+                "finishedAt": self.finished_at,
+            }
+
+class StoredJob(Job):
+    """
+    Read-only view of a job that another worker is running
+
+    Events are re-read from the store every JOB_POLL_INTERVAL_SECONDS while
+    waiting, and the rows of a finished job are fetched by running its SQL
+    again, which the result cache usually answers.
+    """
+
+    def __init__(self, row, store, poll_interval=JOB_POLL_INTERVAL_SECONDS):
+        self.id = row.id
+        self.query_text = row.query_text
+        self.language_code = row.language
+        self.created_at = row.created_at
+        self.rows = None
+        self.columns = None
+        self.decision = None
+        self.future = None
+        self.store = store
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._apply(row)
+
+    def _apply(self, row):
+        with self._condition:
+            self.status = row.status
+            self.events = json.loads(row.events_json)
+            self.ai_result = json.loads(row.result_json) if row.result_json else None
+            self.error = row.error
+            self.finished_at = row.finished_at
+
+    def refresh(self):
+        row = self.store.load(self.id)
+        if row is not None:
+            self._apply(row)
+
+    def publish(self, status, **data):
+        raise RuntimeError("Jobs run by another worker are read-only")
+
+    def wait_for_events(self, after_seq, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            self.refresh()
+            with self._condition:
+                if len(self.events) > after_seq:
+                    return self.events[after_seq:]
+            remaining = deadline - time.monotonic()
+            if self.finished or remaining <= 0:
+                return []
+            time.sleep(min(self.poll_interval, remaining))
+
+    def result_rows(self):
+        if self.rows is None and self.status == DONE:
+            self.rows, self.columns, self.decision, _ = fetch_sql_rows_cached(self.ai_result['sql'])
+        return self.rows, self.columns, self.decision
+
+class JobManager:
+    """
+    Run voice queries in the background on a bounded thread pool
+
+    At most max_pending jobs may be queued or running at once; submit() raises
+    JobQueueFullError beyond that so the route can answer 429 instead of
+    queueing without bound; the limit is per worker process. Finished jobs are
+    kept for ttl_seconds. A job runs in the worker that accepted it, but its
+    state is kept in the store so status, events and cancellation work from
+    any worker.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, ttl_seconds=JOB_RESULT_TTL_SECONDS,
+                 store=None):
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="query-job")
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished and now - job.finished_at > self.ttl_seconds
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        self.store.expire(self.ttl_seconds)
+
+    def submit(self, query_text, language_code):
+        """
+        Queue a voice query
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+
+        Returns:
+            The new Job
+
+        Raises:
+            JobQueueFullError: If max_pending jobs are already queued or running
+        """
+        self._expire()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFullError(f"Too many queries in progress ({self._pending}); try again shortly")
+            self._pending += 1
+            self.submitted += 1
+
+        job = Job(query_text, language_code, store=self.store)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """
+        Look up a job accepted by this or any other worker
+
+        Returns:
+            The Job, a StoredJob for another worker's job, or None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        row = self.store.load(job_id)
+        return StoredJob(row, self.store) if row is not None else None
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that has not started yet
+
+        Returns:
+            True if the job was cancelled
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self.store.cancel(job_id)
+        if job.future is None or not job.future.cancel():
+            return False
+        with self._lock:
+            self._pending -= 1
+        job.publish(CANCELLED)
+        return True
+
+    def _run(self, job):
+        try:
+            with app.app_context():
+                if not self.store.claim(job.id):
+                    # Cancelled from another worker while it was queued
+                    job.publish(CANCELLED)
+                    return
+                job.publish(GENERATING)
+                result = process_voice_query(job.query_text, language_code=job.language_code)
+                if not result:
+                    raise ValueError("Failed to process query with AI")
+                job.ai_result = result
+                job.publish(SQL_READY, result=result)
+
+                record_query_history(job.query_text, result)
+
+                job.publish(EXECUTING)
+                rows, columns, decision, _ = fetch_sql_rows_cached(result['sql'])
+                job.rows, job.columns, job.decision = rows, columns, decision
+                job.publish(DONE, rowCount=len(rows), columns=columns, limited=decision['limited'])
+            with self._lock:
+                self.completed += 1
+
+        except Exception as e:
+            logger.error(f"Query job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.publish(FAILED, error=str(e))
+            with self._lock:
+                self.failed += 1
+
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "tracked": len(self._jobs),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "store_errors": self.store.errors,
+            }
+
+# Background query jobs for /api/jobs
+job_manager = JobManager()
@@ -0,0 +1,127 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = " \t\r\n"
+
+class IncrementalJSONParser:
+    """
+    Parse the top-level fields of a JSON object while it is still arriving
+
+    Model output is fed in chunks with feed(). Anything before the first "{"
+    (such as a ```json code fence) is skipped. Each top-level value is decoded
+    as soon as it is complete, so a caller can act on "sql" while later keys
+    are still being generated. Nested values are returned whole once their
+    closing bracket arrives.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._text = ""
+        self._position = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._key = None
+        self._expecting_key = False
+        self._value_start = None
+
+    def feed(self, chunk):
+        """
+        Add more model output
+
+        Args:
+            chunk: The next piece of text
+
+        Returns:
+            List of (key, value) pairs for top-level fields completed by this chunk
+        """
+        if self.complete or not chunk:
+            return []
+        self._text += chunk
+        completed = []
+        text = self._text
+        position = self._position
+
+        while position < len(text):
+            char = text[position]
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                    self._expecting_key = True
+                position += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        completed.extend(self._finish_string(position))
+                position += 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = position
+            elif char in "{[":
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = position
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    completed.extend(self._finish_value(position + 1))
+                elif self._depth == 0:
+                    completed.extend(self._finish_value(position))
+                    self.complete = True
+                    position += 1
+                    break
+            elif self._depth == 1:
+                if char == ":":
+                    self._expecting_key = False
+                elif char == ",":
+                    completed.extend(self._finish_value(position))
+                    self._expecting_key = True
+                elif char not in WHITESPACE and self._value_start is None:
+                    # Start of a number, true, false or null
+                    self._value_start = position
+            position += 1
+
+        self._position = position
+        return completed
+
+    def _finish_string(self, end):
+        """Handle a closing quote at the top level: either a key or a string value"""
+        start, self._value_start = self._value_start, None
+        raw = self._text[start:end + 1]
+        if self._expecting_key:
+            self._key = json.loads(raw)
+            return []
+        return self._store(raw)
+
+    def _finish_value(self, end):
+        """Handle the end of a number, literal, array or object value"""
+        if self._value_start is None or self._expecting_key:
+            self._value_start = None
+            return []
+        start, self._value_start = self._value_start, None
+        return self._store(self._text[start:end].strip())
+
+    def _store(self, raw):
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            logger.debug(f"Could not decode streamed value for {self._key}: {raw[:100]}")
+            return []
+        self.fields[self._key] = value
+        return [(self._key, value)]
@@ -1,5 +1,9 @@
 from app import db
 from datetime import datetime
+from config import SALES_BRIN_PAGES_PER_RANGE
+
+def _not_postgresql(ddl, target, bind, **kw):
+    return bind.dialect.name != 'postgresql'
 
 class Sales(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,6 +13,16 @@ class Sales(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     
+    __table_args__ = (
+        # Foreign key indexes, with date second so per-product/customer time ranges are index scans
+        db.Index('ix_sales_product_id_date', 'product_id', 'date'),
+        db.Index('ix_sales_customer_id_date', 'customer_id', 'date'),
+        # Sales are appended in date order, so a tiny BRIN index covers date ranges on Postgres
+        db.Index('ix_sales_date_brin', 'date', postgresql_using='brin',
+                 postgresql_with={'pages_per_range': SALES_BRIN_PAGES_PER_RANGE}).ddl_if(dialect='postgresql'),
+        db.Index('ix_sales_date', 'date').ddl_if(callable_=_not_postgresql),
+    )
+    
     def __repr__(self):
         return f'<Sales {self.id}: {self.total_amount}>'
 
@@ -48,3 +62,75 @@ class QueryHistory(db.Model):
     
     def __repr__(self):
         return f'<QueryHistory {self.id}: {self.voice_query[:30]}...>'
+
+class QueryCacheEntry(db.Model):
+    """Shared NL-to-SQL cache entry, visible to every worker"""
+    id = db.Column(db.Integer, primary_key=True)
+    query_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    fuzzy_hash = db.Column(db.String(64), nullable=True, index=True)
+    normalized_query = db.Column(db.Text, nullable=False)
+    language = db.Column(db.String(10), nullable=False)
+    schema_hash = db.Column(db.String(16), nullable=False)
+    result_json = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<QueryCacheEntry {self.id}: {self.normalized_query[:30]}...>'
+
+class TableVersion(db.Model):
+    """Write counter per table, shared by every worker (see result_cache.TableVersions)"""
+    table_name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<TableVersion {self.table_name}: {self.version}>'
+
+class SalesDailyRollup(db.Model):
+    """Sales pre-aggregated per day, product and customer segment (maintained by rollups.py)"""
+    date = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    segment = db.Column(db.String(50), primary_key=True)
+    sale_count = db.Column(db.BigInteger, nullable=False, default=0)
+    quantity = db.Column(db.BigInteger, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SalesDailyRollup {self.date} {self.product_id} {self.segment}>'
+
+class SalesMonthlyCategoryRollup(db.Model):
+    """Sales pre-aggregated per month and product category (maintained by rollups.py)"""
+    month_start = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    sale_count = db.Column(db.BigInteger, nullable=False, default=0)
+    quantity = db.Column(db.BigInteger, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SalesMonthlyCategoryRollup {self.month_start} {self.category}>'
+
+class RollupState(db.Model):
+    """Highest sales.id already folded into the rollup tables"""
+    name = db.Column(db.String(50), primary_key=True)
+    last_sales_id = db.Column(db.BigInteger, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RollupState {self.name}: {self.last_sales_id}>'
+
+class QueryJob(db.Model):
+    """Background query job state, shared so any worker can answer status and event requests"""
+    id = db.Column(db.String(32), primary_key=True)
+    query_text = db.Column(db.Text, nullable=False)
+    language = db.Column(db.String(10), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    events_json = db.Column(db.Text, nullable=False)
+    result_json = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # Epoch seconds, like the "at" of every event
+    created_at = db.Column(db.Float, nullable=False)
+    finished_at = db.Column(db.Float, nullable=True, index=True)
+    
+    def __repr__(self):
+        return f'<QueryJob {self.id}: {self.status}>'
@@ -0,0 +1,268 @@
+import base64
+import datetime
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from ai_agent import fetch_sql_rows
+from result_cache import ResultCache, canonicalize_sql, SQL_TOKEN_PATTERN
+from rollups import rewrite_for_rollups
+from config import PAGINATION_DEFAULT_PAGE_SIZE, PAGINATION_MAX_PAGE_SIZE, PAGINATION_COUNT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Top-level "ORDER BY <column> [ASC|DESC]" at the end of the query, optionally
+# followed by the query's own LIMIT/OFFSET
+ORDER_BY_TAIL_PATTERN = re.compile(
+    r"\border by\s+([a-z_][\w.]*)(?:\s+(asc|desc))?(?:\s+limit\s+\d+)?(?:\s+offset\s+\d+)?$"
+)
+# A single-column GROUP BY, which makes that column unique in the result
+GROUP_BY_PATTERN = re.compile(r"\bgroup by\s+([a-z_][\w.]*)\s*(?=order by|having|limit|$)")
+# The outer query's ORDER BY list, with its own LIMIT/OFFSET split off
+ORDER_BY_LIST_PATTERN = re.compile(r"\border by\s+(.+?)(\s+limit\s+\S+)?(\s+offset\s+\S+)?$")
+SORT_KEY_PATTERN = re.compile(r"^(?:[a-z_]\w*\.)?([a-z_]\w*|\d+)(?:\s+(asc|desc))?(?:\s+nulls\s+(?:first|last))?$")
+
+# Total counts are cached separately from pages and invalidated with the tables they read
+count_cache = ResultCache(max_bytes=PAGINATION_COUNT_CACHE_MAX_BYTES)
+
+# Output column names of recently paginated queries, keyed by canonical SQL
+_result_columns = OrderedDict()
+_result_columns_lock = threading.Lock()
+RESULT_COLUMNS_MAX_ENTRIES = 256
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor that was not produced by encode_cursor"""
+
+def encode_cursor(state):
+    """Encode cursor state as an opaque URL-safe token"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        InvalidCursorError: If the cursor is malformed
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        int(state["o"])
+    except (ValueError, TypeError, KeyError, UnicodeError) as e:
+        raise InvalidCursorError(f"Invalid pagination cursor: {str(e)}")
+    return state
+
+def top_level_sql(canonical_sql):
+    """
+    Blank out everything inside parentheses, so patterns only see the outer query
+
+    Subqueries, function arguments and string literals inside them become
+    spaces; the parentheses themselves are kept.
+    """
+    parts = []
+    depth = 0
+    for literal, quoted, line_comment, block_comment, other in SQL_TOKEN_PATTERN.findall(canonical_sql):
+        token = literal or quoted or line_comment or block_comment
+        if token:
+            parts.append(token if depth == 0 else " " * len(token))
+            continue
+        for char in other:
+            if char == "(":
+                parts.append(char if depth == 0 else " ")
+                depth += 1
+            elif char == ")":
+                depth = max(depth - 1, 0)
+                parts.append(char if depth == 0 else " ")
+            else:
+                parts.append(char if depth == 0 else " ")
+    return "".join(parts)
+
+def keyset_column(sql_query):
+    """
+    Find a column the query result can be keyset-paginated on
+
+    Keyset pagination needs the final ORDER BY column to be unique in the
+    result. That is guaranteed when the query groups by that same single
+    column (e.g. "GROUP BY month ORDER BY month").
+
+    Args:
+        sql_query: The SQL query text
+
+    Returns:
+        Tuple of (column name, 'asc' or 'desc'), or None if only OFFSET works
+    """
+    canonical = top_level_sql(canonicalize_sql(sql_query))
+    order_match = ORDER_BY_TAIL_PATTERN.search(canonical)
+    group_match = GROUP_BY_PATTERN.search(canonical)
+    if not order_match or not group_match:
+        return None
+
+    order_column = order_match.group(1)
+    group_column = group_match.group(1)
+    if order_column.split(".")[-1] != group_column.split(".")[-1]:
+        return None
+    return order_column.split(".")[-1], order_match.group(2) or "asc"
+
+def _cursor_value(value):
+    """Convert a key value to something JSON can carry back in a cursor"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def result_columns(inner_sql):
+    """
+    Get a query's output column names without fetching any rows
+
+    Args:
+        inner_sql: The SQL query text
+
+    Returns:
+        The list of column names
+    """
+    key = canonicalize_sql(inner_sql)
+    with _result_columns_lock:
+        if key in _result_columns:
+            _result_columns.move_to_end(key)
+            return _result_columns[key]
+
+    _, columns = fetch_sql_rows(f"SELECT * FROM (\n{inner_sql}\n) AS q LIMIT 0")
+    columns = list(map(str, columns))
+    with _result_columns_lock:
+        _result_columns[key] = columns
+        while len(_result_columns) > RESULT_COLUMNS_MAX_ENTRIES:
+            _result_columns.popitem(last=False)
+    return columns
+
+def _outer_sort_keys(order_list, columns):
+    """Map inner ORDER BY keys to output positions, or None if one is an expression"""
+    lowered = [column.lower() for column in columns]
+    keys = []
+    for key in order_list.split(","):
+        key_match = SORT_KEY_PATTERN.match(key.strip())
+        if not key_match:
+            return None
+        name, direction = key_match.groups()
+        if name.isdigit():
+            position = int(name)
+        elif name in lowered:
+            position = lowered.index(name) + 1
+        else:
+            return None
+        keys.append(f"{position} {(direction or 'asc').upper()}")
+    return keys
+
+def offset_page_query(inner_sql):
+    """
+    Build the OFFSET page query, with an ORDER BY that pages cannot drift under
+    
+    A subquery's ORDER BY is not guaranteed to survive the wrapping SELECT,
+    so the outer query repeats the inner sort keys (by output position) and
+    then every output column as a tie-breaker, giving a total order. When an
+    inner sort key is an expression with no output column, the query is paged
+    directly instead (its own top-level ORDER BY then applies), unless it has
+    its own LIMIT/OFFSET; then the outer query sorts by every column.
+    
+    Args:
+        inner_sql: The query being paginated
+    
+    Returns:
+        The page SQL with :page_limit and :page_offset parameters
+    """
+    columns = result_columns(inner_sql)
+    order_match = ORDER_BY_LIST_PATTERN.search(top_level_sql(canonicalize_sql(inner_sql)))
+    keys = _outer_sort_keys(order_match.group(1), columns) if order_match else []
+    if keys is None:
+        if not (order_match.group(2) or order_match.group(3)):
+            return f"{inner_sql}\nLIMIT :page_limit OFFSET :page_offset"
+        keys = []
+    keys.extend(str(position) for position in range(1, len(columns) + 1))
+    return f"SELECT * FROM (\n{inner_sql}\n) AS q ORDER BY {', '.join(keys)} LIMIT :page_limit OFFSET :page_offset"
+
+def build_page_query(sql_query, page_size, state=None):
+    """
+    Wrap the query in a subquery that returns one page plus a look-ahead row
+
+    Args:
+        sql_query: The SQL query text
+        page_size: Number of rows per page
+        state: Decoded cursor state, or None for the first page
+
+    Returns:
+        Tuple of (page SQL, bind parameters)
+    """
+    inner_sql = rewrite_for_rollups(sql_query).strip().rstrip(";")
+    params = {"page_limit": page_size + 1}
+    keyset = keyset_column(sql_query)
+
+    if state and "k" in state and keyset:
+        column, direction = keyset
+        comparison = f"q.{column} < :page_after" if direction == "desc" else f"(q.{column} > :page_after OR q.{column} IS NULL)"
+        params["page_after"] = state["k"]
+        page_sql = f"SELECT * FROM (\n{inner_sql}\n) AS q WHERE {comparison} ORDER BY q.{column} {direction.upper()} LIMIT :page_limit"
+    else:
+        params["page_offset"] = int(state["o"]) if state else 0
+        page_sql = offset_page_query(inner_sql)
+
+    return page_sql, params
+
+def next_cursor(sql_query, state, rows, columns, page_size):
+    """
+    Build the cursor for the page after the given rows
+
+    Args:
+        sql_query: The SQL query text
+        state: Decoded cursor state of the current page, or None
+        rows: The rows fetched for the current page (including the look-ahead row)
+        columns: Column names of the result
+        page_size: Number of rows per page
+
+    Returns:
+        An opaque cursor string, or None if this was the last page
+    """
+    if len(rows) <= page_size:
+        return None
+
+    offset = (int(state["o"]) if state else 0) + page_size
+    next_state = {"o": offset}
+    keyset = keyset_column(sql_query)
+    if keyset and keyset[0] in columns:
+        last_value = rows[page_size - 1][columns.index(keyset[0])]
+        # A NULL key cannot be compared against, so continue with OFFSET
+        if last_value is not None:
+            next_state["k"] = _cursor_value(last_value)
+    return encode_cursor(next_state)
+
+def count_query(sql_query):
+    """Wrap the query so it returns its total row count"""
+    return f"SELECT COUNT(*) FROM (\n{rewrite_for_rollups(sql_query).strip().rstrip(';')}\n) AS q"
+
+def total_row_count(sql_query):
+    """
+    Get the total row count of a query, cached until a table it reads changes
+
+    Args:
+        sql_query: The SQL query text
+
+    Returns:
+        The number of rows the unpaginated query returns
+    """
+    counting_sql = count_query(sql_query)
+    cached = count_cache.get(counting_sql)
+    if cached:
+        return cached[0][0][0]
+
+    versions = count_cache.current_versions(counting_sql)
+    rows, columns = fetch_sql_rows(counting_sql)
+    count_cache.set(counting_sql, rows, columns, versions=versions)
+    return rows[0][0]
+
+def clamp_page_size(page_size):
+    """Clamp a client-supplied page size to the configured bounds"""
+    try:
+        page_size = int(page_size or PAGINATION_DEFAULT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        page_size = PAGINATION_DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, PAGINATION_MAX_PAGE_SIZE))
@@ -0,0 +1,105 @@
+import logging
+import os
+import re
+from config import PROMPT_TEMPLATE_DIR, PROMPT_DEFAULT_LANGUAGE
+from schema_context import default_schema_text
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_PATTERN = re.compile(r"\$(schema|query)\b")
+
+class PromptTemplate:
+    """
+    A prompt template compiled into literal segments and placeholder slots
+
+    The template text uses $schema and $query placeholders. It is split once
+    at compile time, so rendering a prompt is a single join. $schema falls
+    back to the registry's default schema when no per-query schema is given.
+    """
+
+    def __init__(self, language, template_text, default_schema):
+        parts = PLACEHOLDER_PATTERN.split(template_text)
+        self.language = language
+        self.default_schema = default_schema
+        self._literals = parts[0::2]
+        self._slots = parts[1::2]
+        if self._slots.count("query") != 1:
+            raise ValueError(f"Prompt template '{language}' must contain $query exactly once")
+
+    def render(self, query_text, schema_text=None):
+        values = {"query": query_text, "schema": schema_text or self.default_schema}
+        pieces = [self._literals[0]]
+        for slot, literal in zip(self._slots, self._literals[1:]):
+            pieces.append(values[slot])
+            pieces.append(literal)
+        return "".join(pieces)
+
+class PromptRegistry:
+    """
+    Compiled prompt templates keyed by language code
+
+    Templates are loaded from <language>.txt files. Unknown languages fall back
+    to the default language.
+    """
+
+    def __init__(self, schema_text, default_language=PROMPT_DEFAULT_LANGUAGE):
+        self.schema_text = schema_text
+        self.default_language = default_language
+        self._templates = {}
+
+    def register(self, language, template_text):
+        """
+        Compile and register a template for a language
+
+        Args:
+            language: The language code (e.g., 'en', 'hi')
+            template_text: Template text with $schema and $query placeholders
+        """
+        self._templates[language] = PromptTemplate(language, template_text, self.schema_text)
+
+    def load_directory(self, directory):
+        """
+        Register every <language>.txt template in a directory
+
+        Args:
+            directory: Path to the template directory
+
+        Returns:
+            The list of language codes that were loaded
+        """
+        loaded = []
+        for filename in sorted(os.listdir(directory)):
+            language, extension = os.path.splitext(filename)
+            if extension != ".txt":
+                continue
+            with open(os.path.join(directory, filename), encoding="utf-8") as template_file:
+                self.register(language, template_file.read())
+            loaded.append(language)
+
+        logger.info(f"Loaded prompt templates for languages: {', '.join(loaded)}")
+        return loaded
+
+    def get(self, language):
+        """Get the template for a language, falling back to the default language"""
+        return self._templates.get(language) or self._templates[self.default_language]
+
+    def render(self, query_text, language, schema_text=None):
+        """
+        Build the prompt for a query
+
+        Args:
+            query_text: The natural language query text
+            language: The language code of the query
+            schema_text: Schema context for this query (defaults to the full schema)
+
+        Returns:
+            The full prompt string
+        """
+        return self.get(language).render(query_text, schema_text)
+
+    def languages(self):
+        return sorted(self._templates)
+
+# Templates shared by process_voice_query, compiled once at import
+prompt_registry = PromptRegistry(default_schema_text())
+prompt_registry.load_directory(PROMPT_TEMPLATE_DIR)
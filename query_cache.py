@@ -0,0 +1,443 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from app import db
+from models import QueryCacheEntry
+from schema_context import default_schema_text
+from config import (
+    QUERY_CACHE_MAX_ENTRIES,
+    QUERY_CACHE_TTL_SECONDS,
+    QUERY_CACHE_FUZZY,
+    PERSISTENT_QUERY_CACHE_ENABLED,
+    PERSISTENT_QUERY_CACHE_MAX_ROWS,
+    PERSISTENT_QUERY_CACHE_TTL_SECONDS,
+    PERSISTENT_QUERY_CACHE_EVICT_EVERY,
+)
+
+logger = logging.getLogger(__name__)
+
+# Filler words that do not change the meaning of a BI question ("by", "not"
+# and "without" do, so they are not here)
+FUZZY_STOPWORDS = {
+    "a", "an", "the", "me", "my", "our", "us", "i", "we", "you", "please",
+    "show", "give", "get", "list", "display", "tell", "find", "see", "want",
+    "can", "could", "would", "what", "which", "is", "are", "was", "were",
+    "of", "for", "to", "in", "on", "with", "all", "about", "and",
+}
+
+def schema_fingerprint(schema_text=None):
+    """
+    Hash the schema so cached SQL is dropped when the schema changes
+
+    Args:
+        schema_text: The schema text that is sent to the model (defaults to default_schema_text())
+
+    Returns:
+        A short hex digest of the schema text
+    """
+    schema_text = schema_text if schema_text is not None else default_schema_text()
+    return hashlib.sha256(schema_text.encode("utf-8")).hexdigest()[:16]
+
+def normalize_query(query_text):
+    """
+    Normalize a natural language query for exact cache matching
+
+    Lowercases the text, removes punctuation and collapses whitespace. Only
+    Unicode punctuation is removed so Devanagari and Japanese text keep their
+    combining marks.
+
+    Args:
+        query_text: The natural language query text
+
+    Returns:
+        The normalized query string
+    """
+    text = unicodedata.normalize("NFKC", query_text or "").lower()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+def fuzzy_query_key(query_text):
+    """
+    Build a key used to match near-duplicate queries
+
+    "Show me monthly sales trends" and "monthly sales trend" produce the same
+    key: filler words are dropped and simple plurals are folded. The
+    remaining tokens keep their order, since "customers by segment" and
+    "segment customers by" are different questions.
+
+    Args:
+        query_text: The natural language query text
+
+    Returns:
+        The fuzzy key string (may be empty if the query only has filler words)
+    """
+    tokens = []
+    for token in normalize_query(query_text).split():
+        if token in FUZZY_STOPWORDS:
+            continue
+        if token.isascii() and len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return " ".join(tokens)
+
+class QueryCache:
+    """
+    Bounded in-process LRU cache for NL-to-SQL results with TTL expiry
+
+    Entries are keyed on the normalized query text, the language code and the
+    schema fingerprint. A secondary fuzzy index maps near-duplicate phrasings
+    to the same entry.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+                 fuzzy=QUERY_CACHE_FUZZY, schema_hash=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fuzzy = fuzzy
+        self.schema_hash = schema_hash or schema_fingerprint()
+        self._entries = OrderedDict()
+        self._fuzzy_index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _keys(self, query_text, language_code):
+        exact_key = (normalize_query(query_text), language_code, self.schema_hash)
+        fuzzy_key = (fuzzy_query_key(query_text), language_code, self.schema_hash)
+        return exact_key, fuzzy_key
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry and self._fuzzy_index.get(entry["fuzzy_key"]) == key:
+            del self._fuzzy_index[entry["fuzzy_key"]]
+
+    def get(self, query_text, language_code='en'):
+        """
+        Look up a cached result for the query
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+
+        Returns:
+            A copy of the cached result dictionary, or None on a miss
+        """
+        exact_key, fuzzy_key = self._keys(query_text, language_code)
+        now = time.monotonic()
+
+        with self._lock:
+            key = exact_key
+            is_fuzzy = False
+            if key not in self._entries and self.fuzzy and fuzzy_key[0]:
+                key = self._fuzzy_index.get(fuzzy_key)
+                is_fuzzy = key is not None
+
+            entry = self._entries.get(key) if key is not None else None
+            if entry and self.ttl_seconds and now - entry["stored_at"] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if is_fuzzy:
+                self.fuzzy_hits += 1
+            result = entry["result"]
+
+        logger.debug(f"Query cache {'fuzzy ' if is_fuzzy else ''}hit for: {query_text}")
+        return copy.deepcopy(result)
+
+    def set(self, query_text, language_code, result):
+        """
+        Store a result for the query, evicting the least recently used entries
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+            result: The result dictionary returned by process_voice_query
+        """
+        if self.max_entries <= 0:
+            return
+
+        exact_key, fuzzy_key = self._keys(query_text, language_code)
+
+        with self._lock:
+            self._remove(exact_key)
+            self._entries[exact_key] = {
+                "result": copy.deepcopy(result),
+                "fuzzy_key": fuzzy_key,
+                "stored_at": time.monotonic(),
+            }
+            if self.fuzzy and fuzzy_key[0]:
+                self._fuzzy_index[fuzzy_key] = exact_key
+
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._fuzzy_index.clear()
+            self.hits = self.fuzzy_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Get the cache counters
+
+        Returns:
+            A dictionary with size, hit/miss counters and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+def _key_hash(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class PersistentQueryCache:
+    """
+    Cross-worker NL-to-SQL cache stored in the query_cache_entry table
+
+    Every gunicorn worker and restart sees the same entries. Entries expire
+    ttl_seconds after they were stored, however often they are used. Lookups
+    bump hit_count and last_used_at, and the least recently used rows beyond
+    max_rows are deleted periodically. Database errors are logged and treated
+    as misses so the cache can never fail a request.
+    """
+
+    def __init__(self, max_rows=PERSISTENT_QUERY_CACHE_MAX_ROWS, ttl_seconds=PERSISTENT_QUERY_CACHE_TTL_SECONDS,
+                 evict_every=PERSISTENT_QUERY_CACHE_EVICT_EVERY, fuzzy=QUERY_CACHE_FUZZY, schema_hash=None):
+        self.max_rows = max_rows
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.fuzzy = fuzzy
+        self.schema_hash = schema_hash or schema_fingerprint()
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _hashes(self, query_text, language_code):
+        normalized = normalize_query(query_text)
+        fuzzy_key = fuzzy_query_key(query_text)
+        query_hash = _key_hash(normalized, language_code, self.schema_hash)
+        fuzzy_hash = _key_hash(fuzzy_key, language_code, self.schema_hash) if fuzzy_key else None
+        return normalized, query_hash, fuzzy_hash
+
+    def get(self, query_text, language_code='en'):
+        """
+        Look up a cached result shared by all workers
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+
+        Returns:
+            The cached result dictionary, or None on a miss
+        """
+        _, query_hash, fuzzy_hash = self._hashes(query_text, language_code)
+        table = QueryCacheEntry.__table__
+        now = datetime.utcnow()
+
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(
+                    select(table.c.id, table.c.result_json, table.c.created_at).where(table.c.query_hash == query_hash)
+                ).first()
+                if row is None and self.fuzzy and fuzzy_hash:
+                    row = connection.execute(
+                        select(table.c.id, table.c.result_json, table.c.created_at)
+                        .where(table.c.fuzzy_hash == fuzzy_hash)
+                        .where(table.c.schema_hash == self.schema_hash)
+                        .order_by(table.c.last_used_at.desc())
+                        .limit(1)
+                    ).first()
+
+                # Measured from when the SQL was generated, like the in-memory tier
+                expired = (
+                    row is not None and self.ttl_seconds and row.created_at
+                    and now - row.created_at > timedelta(seconds=self.ttl_seconds)
+                )
+                if expired:
+                    connection.execute(delete(table).where(table.c.id == row.id))
+                    row = None
+
+                if row is None:
+                    with self._lock:
+                        self.misses += 1
+                    return None
+
+                connection.execute(
+                    update(table)
+                    .where(table.c.id == row.id)
+                    .values(hit_count=table.c.hit_count + 1, last_used_at=now)
+                )
+        except SQLAlchemyError as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"Persistent query cache lookup failed: {str(e)}")
+            return None
+
+        with self._lock:
+            self.hits += 1
+        logger.debug(f"Persistent query cache hit for: {query_text}")
+        return json.loads(row.result_json)
+
+    def set(self, query_text, language_code, result):
+        """
+        Store a result so every worker can reuse it
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+            result: The result dictionary returned by process_voice_query
+        """
+        normalized, query_hash, fuzzy_hash = self._hashes(query_text, language_code)
+        table = QueryCacheEntry.__table__
+        now = datetime.utcnow()
+        values = {
+            "fuzzy_hash": fuzzy_hash,
+            "normalized_query": normalized,
+            "language": language_code,
+            "schema_hash": self.schema_hash,
+            "result_json": json.dumps(result),
+            "last_used_at": now,
+        }
+
+        try:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        table.insert().values(query_hash=query_hash, hit_count=0, created_at=now, **values)
+                    )
+            except IntegrityError:
+                # Another worker stored the same query first; refresh its result (and its age)
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        update(table).where(table.c.query_hash == query_hash).values(created_at=now, **values)
+                    )
+
+            with self._lock:
+                self._writes_since_eviction += 1
+                run_eviction = self._writes_since_eviction >= self.evict_every
+                if run_eviction:
+                    self._writes_since_eviction = 0
+            if run_eviction:
+                self.evict()
+        except SQLAlchemyError as e:
+            with self._lock:
+                self.errors += 1
+            logger.warning(f"Persistent query cache store failed: {str(e)}")
+
+    def evict(self):
+        """
+        Delete expired rows and the least recently used rows beyond max_rows
+
+        Returns:
+            The number of rows deleted
+        """
+        table = QueryCacheEntry.__table__
+        deleted = 0
+        with db.engine.begin() as connection:
+            if self.ttl_seconds:
+                cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+                deleted += connection.execute(delete(table).where(table.c.created_at < cutoff)).rowcount
+
+            total = connection.execute(select(func.count()).select_from(table)).scalar()
+            if total > self.max_rows:
+                stale_ids = (
+                    select(table.c.id)
+                    .order_by(table.c.last_used_at.asc())
+                    .limit(total - self.max_rows)
+                    .scalar_subquery()
+                )
+                deleted += connection.execute(delete(table).where(table.c.id.in_(stale_ids))).rowcount
+
+        if deleted:
+            logger.info(f"Evicted {deleted} persistent query cache entries")
+        return deleted
+
+    def stats(self):
+        """
+        Get this worker's counters and the shared table size
+
+        Returns:
+            A dictionary with size, hit/miss counters and hit rate
+        """
+        try:
+            with db.engine.connect() as connection:
+                size = connection.execute(select(func.count()).select_from(QueryCacheEntry.__table__)).scalar()
+        except SQLAlchemyError:
+            size = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "max_rows": self.max_rows,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+# Shared caches used by process_voice_query
+query_cache = QueryCache()
+persistent_query_cache = PersistentQueryCache()
+
+def get_cached_result(query_text, language_code='en'):
+    """
+    Look up a query in the in-process cache, then in the shared table
+
+    Args:
+        query_text: The natural language query text
+        language_code: The language code of the query
+
+    Returns:
+        The cached result dictionary, or None on a miss
+    """
+    result = query_cache.get(query_text, language_code)
+    if result is None and PERSISTENT_QUERY_CACHE_ENABLED:
+        result = persistent_query_cache.get(query_text, language_code)
+        if result is not None:
+            query_cache.set(query_text, language_code, result)
+    return result
+
+def store_cached_result(query_text, language_code, result):
+    """
+    Store a model answer in both cache tiers
+
+    Args:
+        query_text: The natural language query text
+        language_code: The language code of the query
+        result: The result dictionary returned by process_voice_query
+    """
+    query_cache.set(query_text, language_code, result)
+    if PERSISTENT_QUERY_CACHE_ENABLED:
+        persistent_query_cache.set(query_text, language_code, result)
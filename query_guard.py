@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import text
+from result_cache import canonicalize_sql, READ_STATEMENT_PATTERN
+from db_pool import read_engine, timed_connect
+from config import (
+    GUARD_ENABLED,
+    GUARD_MAX_COST,
+    GUARD_MAX_ROWS,
+    GUARD_AUTO_LIMIT,
+    GUARD_STATEMENT_TIMEOUT_MS,
+    GUARD_PLAN_CACHE_MAX_ENTRIES,
+    GUARD_PLAN_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+
+class QueryRejectedError(ValueError):
+    """Raised when a query is not allowed to run (not read-only, or too expensive)"""
+
+def sql_hash(sql_query):
+    """Hash the canonical SQL text, so formatting differences share a plan cache entry"""
+    return hashlib.sha256(canonicalize_sql(sql_query).encode("utf-8")).hexdigest()
+
+def _plan_estimates(explain_output):
+    """Get (total cost, plan rows) from EXPLAIN (FORMAT JSON) output"""
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    plan = explain_output[0]["Plan"]
+    return float(plan["Total Cost"]), int(plan["Plan Rows"])
+
+@contextmanager
+def guarded_connection(timeout_ms=GUARD_STATEMENT_TIMEOUT_MS):
+    """
+    Open a connection that can only read and whose statements time out
+
+    The connection comes from the read replica when one is configured. On
+    Postgres the transaction is READ ONLY with a local statement_timeout.
+    On SQLite the connection is switched to query_only and long statements are
+    interrupted by a progress handler. The transaction is rolled back on exit.
+
+    Args:
+        timeout_ms: Statement timeout in milliseconds (0 disables it)
+
+    Yields:
+        The SQLAlchemy connection
+    """
+    with timed_connect(read_engine()) as connection:
+        dialect = connection.dialect.name
+        if not GUARD_ENABLED:
+            yield connection
+            return
+
+        if dialect == "postgresql":
+            connection.execute(text("SET TRANSACTION READ ONLY"))
+            if timeout_ms:
+                connection.execute(text("SELECT set_config('statement_timeout', :timeout, true)"),
+                                   {"timeout": str(int(timeout_ms))})
+            yield connection
+        elif dialect == "sqlite":
+            raw_connection = connection.connection.dbapi_connection
+            raw_connection.execute("PRAGMA query_only = ON")
+            if timeout_ms:
+                deadline = time.monotonic() + timeout_ms / 1000
+                # A non-zero return value interrupts the running statement
+                raw_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+            try:
+                yield connection
+            finally:
+                raw_connection.set_progress_handler(None, 0)
+                raw_connection.execute("PRAGMA query_only = OFF")
+        else:
+            yield connection
+
+class QueryGuard:
+    """
+    Check generated SQL before it runs
+
+    Only single read statements are allowed. On Postgres the planner's
+    estimates from EXPLAIN (FORMAT JSON) are checked as well: queries above
+    max_cost are rejected, and queries expected to return more than max_rows
+    rows get a LIMIT (or are rejected when auto_limit is off). EXPLAIN results
+    are cached per SQL hash for ttl_seconds.
+    """
+
+    def __init__(self, enabled=GUARD_ENABLED, max_cost=GUARD_MAX_COST, max_rows=GUARD_MAX_ROWS,
+                 auto_limit=GUARD_AUTO_LIMIT, max_entries=GUARD_PLAN_CACHE_MAX_ENTRIES,
+                 ttl_seconds=GUARD_PLAN_CACHE_TTL_SECONDS):
+        self.enabled = enabled
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.auto_limit = auto_limit
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"checked": 0, "plan_cache_hits": 0, "rejected": 0, "limited": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _cached_plan(self, key):
+        with self._lock:
+            entry = self._plans.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["stored_at"] > self.ttl_seconds:
+                del self._plans[key]
+                return None
+            self._plans.move_to_end(key)
+            self._counts["plan_cache_hits"] += 1
+            return entry
+
+    def _store_plan(self, key, cost, rows):
+        with self._lock:
+            self._plans[key] = {"cost": cost, "rows": rows, "stored_at": time.monotonic()}
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def explain(self, sql_query, params=None):
+        """
+        Get the planner's cost and row estimates for a query (Postgres only)
+
+        Args:
+            sql_query: The SQL query text
+            params: Optional bind parameters for the query
+
+        Returns:
+            Tuple of (estimated total cost, estimated rows), or (None, None)
+            on databases without EXPLAIN (FORMAT JSON)
+        """
+        if read_engine().dialect.name != "postgresql":
+            return None, None
+
+        key = sql_hash(sql_query)
+        entry = self._cached_plan(key)
+        if entry is not None:
+            return entry["cost"], entry["rows"]
+
+        with guarded_connection() as connection:
+            output = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql_query}"), params or {}).scalar()
+        cost, rows = _plan_estimates(output)
+        self._store_plan(key, cost, rows)
+        return cost, rows
+
+    def check(self, sql_query, params=None, auto_limit=True):
+        """
+        Decide whether and how a query may run
+
+        Args:
+            sql_query: The SQL query text
+            params: Optional bind parameters for the query
+            auto_limit: Add a LIMIT to queries expected to return too many rows
+                (callers that cap rows themselves, like streaming, turn this off)
+
+        Returns:
+            A dictionary with the "sql" to execute, "estimated_cost",
+            "estimated_rows" and whether a LIMIT was added ("limited")
+
+        Raises:
+            QueryRejectedError: If the query is not a single read statement or
+                is estimated to be too expensive
+        """
+        decision = {"sql": sql_query, "estimated_cost": None, "estimated_rows": None, "limited": False}
+        if not self.enabled:
+            return decision
+        self._count("checked")
+
+        canonical = canonicalize_sql(sql_query)
+        if not READ_STATEMENT_PATTERN.match(canonical.lstrip("( ")):
+            self._count("rejected")
+            raise QueryRejectedError("Only SELECT queries can be run")
+        if ";" in LITERAL_PATTERN.sub("''", canonical):
+            self._count("rejected")
+            raise QueryRejectedError("Only a single SQL statement can be run")
+
+        cost, rows = self.explain(sql_query, params)
+        decision["estimated_cost"] = cost
+        decision["estimated_rows"] = rows
+
+        if cost is not None and self.max_cost and cost > self.max_cost:
+            self._count("rejected")
+            logger.warning(f"Rejected query with estimated cost {cost:.0f}: {sql_query}")
+            raise QueryRejectedError(
+                f"Query is too expensive to run (estimated cost {cost:.0f}, limit {self.max_cost:.0f}). "
+                "Try narrowing it with a date range or a filter."
+            )
+
+        if rows is not None and self.max_rows and rows > self.max_rows:
+            if not auto_limit:
+                return decision
+            if not self.auto_limit:
+                self._count("rejected")
+                raise QueryRejectedError(
+                    f"Query would return too many rows (estimated {rows}, limit {self.max_rows})"
+                )
+            self._count("limited")
+            decision["sql"] = f"SELECT * FROM (\n{sql_query.strip().rstrip(';')}\n) AS q LIMIT {int(self.max_rows)}"
+            decision["limited"] = True
+
+        return decision
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_cost": self.max_cost,
+                "max_rows": self.max_rows,
+                "plan_cache_size": len(self._plans),
+                **self._counts,
+            }
+
+# Shared guard for every query run on behalf of a client
+query_guard = QueryGuard()
@@ -0,0 +1,162 @@
+import logging
+import random
+import re
+import threading
+from result_cache import canonicalize_sql
+from intent_matcher import intent_matcher
+from config import ROUTER_ENABLED, ROUTER_MIN_CONFIDENCE, ROUTER_SHADOW_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+LOCAL = "local"
+MODEL = "model"
+
+# Upper bounds of the confidence buckets that agreement is tracked in
+CONFIDENCE_BUCKETS = [0.5, 0.7, 0.85, 0.95, 1.0]
+
+TABLE_PATTERN = re.compile(r"\b(?:from|join)\s+(\w+)")
+AGGREGATE_PATTERN = re.compile(r"\b(sum|count|avg|min|max)\s*\(")
+GROUP_BY_PATTERN = re.compile(r"\bgroup by\s+(.+?)(?:\s+having\b|\s+order by\b|\s+limit\b|$)")
+LIMIT_PATTERN = re.compile(r"\blimit\s+(\d+)")
+QUALIFIER_PATTERN = re.compile(r"\b\w+\.")
+
+def sql_signature(sql_query):
+    """
+    Reduce a query to its shape: tables, aggregates, grouping, filtering and limit
+
+    Two queries with the same signature answer the same question even if
+    they differ in aliases, column order or formatting.
+    """
+    canonical = canonicalize_sql(sql_query)
+    group_by = GROUP_BY_PATTERN.search(canonical)
+    limit = LIMIT_PATTERN.search(canonical)
+    return (
+        tuple(sorted(set(TABLE_PATTERN.findall(canonical)))),
+        tuple(sorted(set(AGGREGATE_PATTERN.findall(canonical)))),
+        QUALIFIER_PATTERN.sub("", group_by.group(1)).replace(" ", "") if group_by else "",
+        " where " in canonical,
+        int(limit.group(1)) if limit else None,
+    )
+
+def _bucket(confidence):
+    lower = 0.0
+    for bound in CONFIDENCE_BUCKETS:
+        if confidence < bound or bound == CONFIDENCE_BUCKETS[-1]:
+            return f"{lower:.2f}-{bound:.2f}"
+        lower = bound
+
+class RouteDecision:
+    """Where one voice query is answered, with the local matcher's answer"""
+
+    __slots__ = ("route", "local_result", "confidence", "shadow")
+
+    def __init__(self, route, local_result, confidence, shadow=False):
+        self.route = route
+        self.local_result = local_result
+        self.confidence = confidence
+        self.shadow = shadow
+
+class QueryRouter:
+    """
+    Answer template-answerable questions locally, and the rest with the model
+
+    Every query is matched by the intent matcher first (about 40
+    microseconds). Matches at or above min_confidence are answered locally,
+    unless the query asked for something the intent's SQL cannot express (a
+    date range on a table without dates, a limit on an ungrouped answer, or a
+    concept such as "average" or "count" that the intent does not compute); a
+    partial answer would look right but ignore part of the question.
+    Whenever the model answers too, its SQL is compared with the local SQL
+    (see sql_signature), and agreement is counted per confidence bucket. That
+    happens for every model-routed query, and for shadow_sample_rate of the
+    local ones. The agreement rates show where min_confidence can safely sit.
+    """
+
+    def __init__(self, enabled=ROUTER_ENABLED, min_confidence=ROUTER_MIN_CONFIDENCE,
+                 shadow_sample_rate=ROUTER_SHADOW_SAMPLE_RATE):
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        self.shadow_sample_rate = shadow_sample_rate
+        self._lock = threading.Lock()
+        self._routes = {LOCAL: 0, MODEL: 0}
+        self._unapplied = 0
+        self._intents = {}
+        self._agreement = {}
+
+    def route(self, query_text, language_code='en'):
+        """
+        Decide whether a query is answered locally or by the model
+
+        Args:
+            query_text: The natural language query text
+            language_code: The language code of the query
+
+        Returns:
+            A RouteDecision; for LOCAL its local_result is the answer
+        """
+        local_result = intent_matcher.match(query_text, language_code)
+        confidence = local_result["confidence"]
+        confident = self.enabled and confidence >= self.min_confidence
+        # Every parameter in the question has to make it into the local SQL
+        route = LOCAL if confident and not local_result["unapplied"] else MODEL
+        shadow = route == LOCAL and self.shadow_sample_rate > 0 and random.random() < self.shadow_sample_rate
+
+        with self._lock:
+            self._routes[route] += 1
+            counts = self._intents.setdefault(local_result["intent"], {LOCAL: 0, MODEL: 0})
+            counts[route] += 1
+            if confident and route == MODEL:
+                self._unapplied += 1
+
+        unapplied = f", unapplied {', '.join(local_result['unapplied'])}" if local_result["unapplied"] else ""
+        logger.info(
+            f"Routed query to {route} (intent {local_result['intent']}, confidence {confidence:.2f}{unapplied}): "
+            f"{query_text}"
+        )
+        if route == LOCAL:
+            local_result = {**local_result, "model": LOCAL}
+        return RouteDecision(route, local_result, confidence, shadow)
+
+    def record_model_answer(self, decision, model_result):
+        """
+        Compare the model's SQL with the local answer for the same query
+
+        Args:
+            decision: The RouteDecision for the query
+            model_result: The model's response dictionary
+        """
+        if decision.local_result["intent"] == intent_matcher.default_intent.name:
+            return
+        agreed = sql_signature(decision.local_result["sql"]) == sql_signature(model_result["sql"])
+        bucket = _bucket(decision.confidence)
+        with self._lock:
+            counts = self._agreement.setdefault(bucket, {"compared": 0, "agreed": 0})
+            counts["compared"] += 1
+            counts["agreed"] += int(agreed)
+
+        if not agreed:
+            logger.info(
+                f"Local intent {decision.local_result['intent']} (confidence {decision.confidence:.2f}) "
+                f"disagreed with the model{' (shadow)' if decision.shadow else ''}: "
+                f"{canonicalize_sql(decision.local_result['sql'])} vs {canonicalize_sql(model_result['sql'])}"
+            )
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._routes.values())
+            return {
+                "enabled": self.enabled,
+                "min_confidence": self.min_confidence,
+                "shadow_sample_rate": self.shadow_sample_rate,
+                "routes": dict(self._routes),
+                "local_ratio": round(self._routes[LOCAL] / total, 4) if total else 0.0,
+                "unapplied_parameters": self._unapplied,
+                "intents": {intent: dict(counts) for intent, counts in self._intents.items()},
+                "agreement": {
+                    bucket: {**counts, "rate": round(counts["agreed"] / counts["compared"], 4)}
+                    for bucket, counts in sorted(self._agreement.items())
+                },
+            }
+
+# Shared router in front of process_voice_query
+query_router = QueryRouter()
@@ -0,0 +1,348 @@
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, text, bindparam
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from config import RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# String literals, quoted identifiers, comments and everything else
+SQL_TOKEN_PATTERN = re.compile(
+    r"('(?:[^']|'')*')|(\"(?:[^\"]|\"\")*\")|(--[^\n]*)|(/\*.*?\*/)|([^'\"\-/]+|[\-/])",
+    re.DOTALL,
+)
+IDENTIFIER = r'(?:"(?:[^"]|"")+"|[a-z_][\w$]*)'
+TABLE_REFERENCE_PATTERN = re.compile(r"\b(from|join)\s+")
+# One FROM item: a (possibly schema-qualified, possibly quoted) table and an optional alias
+FROM_ITEM_PATTERN = re.compile(
+    rf"({IDENTIFIER}(?:\s*\.\s*{IDENTIFIER})*)(?:\s+(?:as\s+)?{IDENTIFIER})?\s*"
+)
+WRITE_STATEMENT_PATTERN = re.compile(
+    r"^\s*(?:insert\s+into|update|delete\s+from|truncate(?:\s+table)?|alter\s+table|drop\s+table|copy)"
+    r"\s+(?:only\s+)?\"?([a-z_][\w.]*)",
+    re.IGNORECASE,
+)
+READ_STATEMENT_PATTERN = re.compile(r"^\s*(?:select|with)\b", re.IGNORECASE)
+
+VERSION_TABLE = "table_version"
+# Portable upsert (PostgreSQL and SQLite 3.24+); the table name comes from WRITE_STATEMENT_PATTERN
+BUMP_VERSION_SQL = (
+    f"INSERT INTO {VERSION_TABLE} (table_name, version) VALUES ('{{table_name}}', 1) "
+    f"ON CONFLICT (table_name) DO UPDATE SET version = {VERSION_TABLE}.version + 1"
+)
+SELECT_VERSIONS_SQL = text(
+    f"SELECT table_name, version FROM {VERSION_TABLE} WHERE table_name IN :table_names"
+).bindparams(bindparam("table_names", expanding=True))
+
+def canonicalize_sql(sql_query):
+    """
+    Canonicalize SQL text so formatting differences share a cache entry
+
+    Comments are removed, whitespace is collapsed, text outside string
+    literals and quoted identifiers is lowercased and a trailing semicolon is
+    dropped.
+
+    Args:
+        sql_query: The SQL query text
+
+    Returns:
+        The canonical SQL string
+    """
+    parts = []
+    for literal, quoted, line_comment, block_comment, other in SQL_TOKEN_PATTERN.findall(sql_query):
+        if literal or quoted:
+            parts.append(literal or quoted)
+            continue
+        piece = " " if line_comment or block_comment else re.sub(r"\s+", " ", other.lower())
+        if parts and parts[-1].endswith(" ") and piece.startswith(" "):
+            piece = piece[1:]
+        if piece:
+            parts.append(piece)
+    canonical = "".join(parts).strip()
+    return canonical.rstrip(";").rstrip()
+
+def _table_name(reference):
+    name = re.split(r"\s*\.\s*", reference)[-1]
+    if name.startswith('"'):
+        name = name[1:-1].replace('""', '"')
+    return name.lower()
+
+def referenced_tables(canonical_sql):
+    """
+    Find the tables a canonical SELECT reads from
+
+    Handles JOINs, comma-separated FROM lists and quoted identifiers.
+
+    Args:
+        canonical_sql: SQL text returned by canonicalize_sql
+
+    Returns:
+        A sorted tuple of table names (schema prefixes and quotes removed)
+    """
+    tables = set()
+    for reference in TABLE_REFERENCE_PATTERN.finditer(canonical_sql):
+        position = reference.end()
+        while True:
+            item = FROM_ITEM_PATTERN.match(canonical_sql, position)
+            if item is None:
+                break
+            tables.add(_table_name(item.group(1)))
+            position = item.end()
+            # "from a x, b y" lists more tables; a JOIN names exactly one
+            if reference.group(1) == "join" or not canonical_sql.startswith(",", position):
+                break
+            position += 1
+            while canonical_sql.startswith(" ", position):
+                position += 1
+    return tuple(sorted(tables))
+
+class TableVersions:
+    """
+    Per-table write counters kept in the table_version table
+
+    Every worker, the CLI commands and COPY loads bump the same rows, so a
+    write in any process invalidates results cached by all of them. A bump
+    runs in the writing transaction, so it only counts once the write
+    commits. Writes made outside this application (psql, other services) are
+    not seen; the result cache TTL bounds how stale those can get.
+    """
+
+    def bump(self, table_name, dbapi_connection=None):
+        """
+        Bump a table's version
+
+        Args:
+            table_name: The table that was written
+            dbapi_connection: The DB-API connection of the writing transaction
+                (by default the bump commits on its own)
+        """
+        statement = BUMP_VERSION_SQL.format(table_name=table_name)
+        if dbapi_connection is None:
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql(statement)
+            return
+        # A separate cursor, so a pending INSERT ... RETURNING result is not discarded
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    def snapshot(self, table_names):
+        """
+        Read the current versions of some tables
+
+        Returns:
+            A tuple of versions in the order of table_names, or None if they
+            could not be read
+        """
+        if not table_names:
+            return ()
+        try:
+            with db.engine.connect() as connection:
+                versions = dict(connection.execute(SELECT_VERSIONS_SQL, {"table_names": list(table_names)}).all())
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not read table versions: {str(e)}")
+            return None
+        return tuple(versions.get(name, 0) for name in table_names)
+
+    def as_dict(self):
+        try:
+            with db.engine.connect() as connection:
+                return dict(connection.exec_driver_sql(f"SELECT table_name, version FROM {VERSION_TABLE}").all())
+        except SQLAlchemyError:
+            return {}
+
+table_versions = TableVersions()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _track_table_writes(conn, cursor, statement, parameters, context, executemany):
+    """Bump the version of any table written through SQLAlchemy, in the writing transaction"""
+    match = WRITE_STATEMENT_PATTERN.match(statement)
+    if match:
+        table_name = match.group(1).lower().split(".")[-1]
+        if table_name != VERSION_TABLE:
+            table_versions.bump(table_name, conn.connection.dbapi_connection)
+
+def _estimate_size(rows, columns):
+    """Cheap size estimate from the first row, so caching large results stays O(1)"""
+    if not rows:
+        return sys.getsizeof(rows)
+    row_size = sys.getsizeof(rows[0]) + sum(sys.getsizeof(value) for value in rows[0])
+    return sys.getsizeof(rows) + row_size * len(rows) + sum(sys.getsizeof(c) for c in columns)
+
+class ResultCache:
+    """
+    In-process LRU cache of SQL result sets with a memory budget and TTL
+
+    Entries are keyed on canonical SQL text and remember the version of every
+    table they read (see TableVersions). A write to any of those tables, from
+    any worker, makes the entry stale; each lookup reads the versions with one
+    small query. The TTL bounds staleness for writes made outside the
+    application.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+                 versions=table_versions):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.versions = versions
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.current_bytes -= entry["size"]
+
+    def get(self, sql_query, with_metadata=False):
+        """
+        Look up a cached result set
+
+        Args:
+            sql_query: The SQL query text
+            with_metadata: Also return the metadata stored with the entry
+
+        Returns:
+            Tuple of (rows, columns, age_seconds), plus the metadata when
+            with_metadata is set, or None on a miss. The cached lists are
+            shared and must not be modified.
+        """
+        key = canonicalize_sql(sql_query)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+        # Read outside the lock; it is a database round trip
+        versions = self.versions.snapshot(entry["tables"]) if entry is not None else None
+
+        with self._lock:
+            if entry is not None and self._entries.get(key) is not entry:
+                # Replaced or removed while the versions were read
+                entry = None
+            if entry is not None:
+                if self.ttl_seconds and now - entry["stored_at"] > self.ttl_seconds:
+                    self._remove(key)
+                    entry = None
+                elif versions is None:
+                    # Cannot tell whether it is current
+                    entry = None
+                elif versions != entry["versions"]:
+                    self._remove(key)
+                    self.invalidations += 1
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if with_metadata:
+                return entry["rows"], entry["columns"], now - entry["stored_at"], entry["metadata"]
+            return entry["rows"], entry["columns"], now - entry["stored_at"]
+
+    def current_versions(self, sql_query):
+        """
+        Snapshot the versions of the tables a query reads
+
+        Take the snapshot before executing the query and pass it to set(), so
+        a write that lands while the query runs still invalidates the entry.
+
+        Args:
+            sql_query: The SQL query text
+
+        Returns:
+            A tuple of table versions, or None if they could not be read
+        """
+        return self.versions.snapshot(referenced_tables(canonicalize_sql(sql_query)))
+
+    def set(self, sql_query, rows, columns, versions=None, metadata=None):
+        """
+        Store a result set if it is a read query that fits the memory budget
+
+        Args:
+            sql_query: The SQL query text
+            rows: List of row value tuples
+            columns: List of column names
+            versions: Table versions from current_versions() taken before execution
+            metadata: Optional value returned with the rows (e.g. the guard decision)
+        """
+        if not READ_STATEMENT_PATTERN.match(sql_query.lstrip("( \n\t")):
+            return
+
+        key = canonicalize_sql(sql_query)
+        tables = referenced_tables(key)
+        if not tables:
+            # Without its tables, writes could never invalidate the entry
+            logger.debug("Not caching a result whose tables could not be determined")
+            return
+        size = _estimate_size(rows, columns)
+        if size > self.max_bytes:
+            logger.debug(f"Result set of ~{size} bytes exceeds the result cache budget")
+            return
+        if versions is None:
+            versions = self.versions.snapshot(tables)
+            if versions is None:
+                return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {
+                "rows": rows,
+                "columns": columns,
+                "metadata": metadata,
+                "tables": tables,
+                "versions": versions,
+                "size": size,
+                "stored_at": time.monotonic(),
+            }
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.hits = self.misses = self.invalidations = self.evictions = 0
+
+    def stats(self):
+        """
+        Get the cache counters
+
+        Returns:
+            A dictionary with size, memory use, counters and table versions
+        """
+        table_version_counts = self.versions.as_dict()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "table_versions": table_version_counts,
+            }
+
+# Shared cache used by /api/run-sql
+result_cache = ResultCache(max_bytes=RESULT_CACHE_MAX_BYTES if RESULT_CACHE_ENABLED else 0)
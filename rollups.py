@@ -0,0 +1,409 @@
+import datetime
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import click
+from sqlalchemy import select, func, update, delete, insert, cast, and_, or_, true, false, Date
+from sqlalchemy.exc import SQLAlchemyError
+from app import app, db
+from models import Sales, Product, Customer, SalesDailyRollup, SalesMonthlyCategoryRollup, RollupState
+from result_cache import canonicalize_sql, table_versions
+from config import ROLLUPS_ENABLED, ROLLUP_REFRESH_ON_READ, ROLLUP_FRESHNESS_CHECK_SECONDS, ROLLUP_REFRESH_LAG_IDS
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = "sales"
+SUPPORTED_DIALECTS = ("postgresql", "sqlite")
+
+# "<table> <alias>" or "<table> AS <alias>", where the alias is not the next keyword
+ALIAS = r"(?:as\s+)?(?!(?:join|inner|left|on|where|group|order|limit)\b)([a-z_]\w*)"
+FROM_SALES_PATTERN = re.compile(r"\bfrom\s+sales\s+" + ALIAS)
+JOIN_PATTERN = re.compile(r"\bjoin\b")
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+OUTPUT_ALIAS_PATTERN = re.compile(r"\bas\s+[a-z_]\w*")
+# Sales columns the rollups do not keep, when they appear outside a supported aggregate
+BARE_SALES_COLUMN_PATTERN = re.compile(r"(?<![\w.])(?:id|customer_id|quantity|total_amount)\b")
+# Any aggregate call; once the supported ones are taken out, none may be left
+AGGREGATE_CALL_PATTERN = re.compile(r"\b(?:count|sum|avg|min|max)\s*\(")
+MONTH_TRUNC_PATTERN = r"date_trunc\(\s*'(month|quarter|year)'\s*,\s*{alias}\.date\s*\)"
+
+def _join_pattern(table, sales_alias, foreign_key):
+    """Match "JOIN <table> <alias> ON <sales>.<fk> = <alias>.id" in either order"""
+    return re.compile(
+        rf"\s+(?:inner\s+|left\s+(?:outer\s+)?)?join\s+{table}\s+{ALIAS}\s+on\s+"
+        rf"(?:{sales_alias}\.{foreign_key}\s*=\s*([a-z_]\w*)\.id|([a-z_]\w*)\.id\s*=\s*{sales_alias}\.{foreign_key})"
+    )
+
+def _find_join(sql, table, sales_alias, foreign_key):
+    match = _join_pattern(table, sales_alias, foreign_key).search(sql)
+    if not match:
+        return None, None
+    alias = match.group(1)
+    if alias != (match.group(2) or match.group(3)):
+        return None, None
+    return match, alias
+
+def _bare_columns(sql, table, keep=()):
+    """Find unqualified references to columns of a table (other than the kept ones)"""
+    names = [column.name for column in table.columns if column.name not in keep]
+    return re.findall(rf"(?<![\w.])(?:{'|'.join(names)})\b", sql)
+
+def _aggregate_rewrites(sales_alias):
+    """Aggregates over sales and their equivalents over a rollup table"""
+    a = sales_alias
+    return [
+        (re.compile(rf"count\(\s*(?:\*|1|{a}\.id)\s*\)"), f"cast(sum({a}.sale_count) as bigint)", "count"),
+        (re.compile(rf"sum\(\s*{a}\.quantity\s*\)"), f"cast(sum({a}.quantity) as bigint)", "sum"),
+        (re.compile(rf"sum\(\s*{a}\.total_amount\s*\)"), f"sum({a}.total_amount)", None),
+        (re.compile(rf"avg\(\s*{a}\.total_amount\s*\)"), f"(sum({a}.total_amount) / sum({a}.sale_count))", "avg"),
+    ]
+
+def _split_select_list(select_list):
+    """Split a select list on top-level commas"""
+    items, depth, start = [], 0, 0
+    for index, char in enumerate(select_list):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(select_list[start:index])
+            start = index + 1
+    items.append(select_list[start:])
+    return items
+
+def _rewrite_select_list(select_list, rewrites):
+    """Rewrite aggregates in the select list, keeping the output column names"""
+    items = []
+    for item in _split_select_list(select_list):
+        expression = item.strip()
+        has_alias = bool(re.search(r"(?:\bas\s+[a-z_]\w*|\)\s+[a-z_]\w*)$", expression))
+        for pattern, replacement, name in rewrites:
+            if name and pattern.fullmatch(expression) and not has_alias:
+                expression = f"{expression} as {name}"
+                break
+        items.append(" " + expression)
+    return ",".join(items) + " "
+
+@lru_cache(maxsize=1024)
+def plan_rollup_rewrite(sql_query):
+    """
+    Rewrite an aggregate query over sales to read a rollup table instead
+
+    Only simple dashboard queries are rewritten: SUM/COUNT/AVG of sales
+    amounts over one aliased "FROM sales" without subqueries, optionally
+    joined to product and to customer (segment only). Queries at month,
+    quarter or year grain by category go to the monthly rollup. Other
+    queries go to the daily product x segment rollup.
+
+    Args:
+        sql_query: The SQL query text
+
+    Returns:
+        Tuple of (rewritten SQL, rollup table name), or None if the query
+        cannot be answered from a rollup
+    """
+    sql = canonicalize_sql(sql_query)
+    if not sql.startswith("select ") or "(select" in sql or re.search(r"\b(?:union|intersect|except|over)\b", sql):
+        return None
+
+    from_matches = FROM_SALES_PATTERN.findall(sql)
+    if len(from_matches) != 1 or len(re.findall(r"\bsales\b", LITERAL_PATTERN.sub("''", sql))) != 1:
+        return None
+    a = from_matches[0]
+
+    product_join, p = _find_join(sql, "product", a, "product_id")
+    customer_join, c = _find_join(sql, "customer", a, "customer_id")
+    if len(JOIN_PATTERN.findall(sql)) != (product_join is not None) + (customer_join is not None):
+        return None
+
+    rewrites = _aggregate_rewrites(a)
+    month_trunc = re.compile(MONTH_TRUNC_PATTERN.format(alias=a))
+
+    # Check what is left once month truncations, supported aggregates, literals and joins are taken out
+    remaining = LITERAL_PATTERN.sub("''", month_trunc.sub(" ", sql))
+    for join in (product_join, customer_join):
+        if join:
+            remaining = remaining.replace(join.group(0), " ")
+    for pattern, _, _ in rewrites:
+        remaining = pattern.sub(" ", remaining)
+    # Any other aggregate (COUNT(s.date), SUM(p.price), MIN/MAX, DISTINCT) would be
+    # computed over rollup rows instead of sales rows
+    if AGGREGATE_CALL_PATTERN.search(remaining):
+        return None
+    remaining = OUTPUT_ALIAS_PATTERN.sub(" ", remaining)
+    if re.search(r"(?:select|,)\s*\*|\.\*", remaining) or BARE_SALES_COLUMN_PATTERN.search(remaining):
+        return None
+    sales_columns = set(re.findall(rf"\b{a}\.(\w+)", remaining))
+    if not sales_columns <= {"date", "product_id"}:
+        return None
+    if c and (set(re.findall(rf"\b{c}\.(\w+)", remaining)) - {"segment"}
+              or _bare_columns(remaining, Customer.__table__, keep={"segment"})):
+        return None
+
+    # Month/quarter/year by category (or no dimension) can use the much smaller monthly rollup
+    monthly = (
+        not customer_join
+        and not sales_columns
+        and not re.search(r"(?<![\w.])(?:date|product_id)\b", remaining)
+        and (not p or not (set(re.findall(rf"\b{p}\.(\w+)", remaining)) - {"category"}
+                           or _bare_columns(remaining, Product.__table__, keep={"category"})))
+    )
+
+    rewritten = sql
+    for join in (product_join, customer_join) if monthly else (customer_join,):
+        if join:
+            rewritten = rewritten.replace(join.group(0), "", 1)
+    if monthly:
+        table_name = SalesMonthlyCategoryRollup.__tablename__
+        if p:
+            rewritten = re.sub(rf"\b{p}\.category\b", f"{a}.category", rewritten)
+        rewritten = month_trunc.sub(lambda m: f"date_trunc('{m.group(1)}', {a}.month_start)", rewritten)
+    else:
+        table_name = SalesDailyRollup.__tablename__
+        if c:
+            rewritten = re.sub(rf"\b{c}\.segment\b", f"{a}.segment", rewritten)
+
+    from_match = FROM_SALES_PATTERN.search(rewritten)
+    select_list = rewritten[len("select "):from_match.start()]
+    distinct = re.match(r"\s*distinct\b", select_list)
+    if distinct:
+        select_list = select_list[distinct.end():]
+    rewritten = (
+        "select" + (" distinct" if distinct else "") + _rewrite_select_list(select_list, rewrites)
+        + f"from {table_name} {a}" + rewritten[from_match.end():]
+    )
+    for pattern, replacement, _ in rewrites:
+        rewritten = pattern.sub(replacement, rewritten)
+    return rewritten, table_name
+
+def _month_expression(dialect_name, date_column):
+    if dialect_name == "postgresql":
+        return cast(func.date_trunc("month", date_column), Date)
+    return func.date(date_column, "start of month")
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+def refresh_rollups(full=False):
+    """
+    Bring the rollup tables up to date with the sales table
+
+    Refreshes are incremental: the rollup rows of every date (and month)
+    touched by a sales id above the stored watermark are rebuilt from all of
+    that date's sales. Ids can commit out of order (a transaction holding a
+    lower id commits after a higher one), so each refresh also rescans the
+    ROLLUP_REFRESH_LAG_IDS ids below the watermark; a row that committed late
+    is picked up by the next refresh as long as fewer ids than that were
+    handed out while it was in flight. Rebuilding is idempotent, and the
+    watermark moves with a compare-and-set so concurrent workers do not
+    repeat the work. After updating or deleting older sales rows, run a full
+    refresh ("flask refresh-rollups --full").
+
+    Args:
+        full: Rebuild the rollups from scratch
+
+    Returns:
+        The number of sales ids the watermark moved by (0 if already current)
+    """
+    sales = Sales.__table__
+    daily = SalesDailyRollup.__table__
+    monthly = SalesMonthlyCategoryRollup.__table__
+    state = RollupState.__table__
+
+    with db.engine.begin() as connection:
+        low = connection.execute(select(state.c.last_sales_id).where(state.c.name == STATE_NAME)).scalar()
+        if low is None:
+            connection.execute(insert(state).values(name=STATE_NAME, last_sales_id=0))
+            low = 0
+        high = connection.execute(select(func.coalesce(func.max(sales.c.id), 0))).scalar()
+
+        # Sales ids going backwards means the table was truncated or rows were deleted
+        if full or high < low:
+            connection.execute(update(state).where(state.c.name == STATE_NAME).values(last_sales_id=0))
+            low = 0
+        if high <= low and not full:
+            return 0
+
+        moved = connection.execute(
+            update(state)
+            .where(state.c.name == STATE_NAME, state.c.last_sales_id == low)
+            .values(last_sales_id=high, refreshed_at=datetime.datetime.utcnow())
+        ).rowcount
+        if moved != 1:
+            # Another worker refreshed this range first
+            return 0
+
+        if low == 0:
+            connection.execute(delete(daily))
+            connection.execute(delete(monthly))
+            days = months = None
+            day_filter = month_filter = true()
+        else:
+            days = connection.execute(
+                select(sales.c.date).where(sales.c.id > max(low - ROLLUP_REFRESH_LAG_IDS, 0)).distinct()
+            ).scalars().all()
+            months = sorted({day.replace(day=1) for day in days})
+            connection.execute(delete(daily).where(daily.c.date.in_(days)))
+            connection.execute(delete(monthly).where(monthly.c.month_start.in_(months)))
+            day_filter = sales.c.date.in_(days)
+            month_filter = or_(false(), *(and_(sales.c.date >= month, sales.c.date < _next_month(month)) for month in months))
+
+        value_columns = ["sale_count", "quantity", "total_amount"]
+        aggregates = [func.count(), func.sum(sales.c.quantity), func.sum(sales.c.total_amount)]
+
+        customer = Customer.__table__
+        connection.execute(insert(daily).from_select(
+            ["date", "product_id", "segment"] + value_columns,
+            select(sales.c.date, sales.c.product_id, customer.c.segment, *aggregates)
+            .select_from(sales.join(customer, sales.c.customer_id == customer.c.id))
+            .where(day_filter)
+            .group_by(sales.c.date, sales.c.product_id, customer.c.segment),
+        ))
+
+        product = Product.__table__
+        month = _month_expression(connection.dialect.name, sales.c.date)
+        connection.execute(insert(monthly).from_select(
+            ["month_start", "category"] + value_columns,
+            select(month, product.c.category, *aggregates)
+            .select_from(sales.join(product, sales.c.product_id == product.c.id))
+            .where(month_filter)
+            .group_by(month, product.c.category),
+        ))
+
+    rebuilt = "all dates" if days is None else f"{len(days)} dates"
+    logger.info(f"Rollups refreshed with sales ids {low + 1}-{high} ({rebuilt} rebuilt)")
+    return high - low
+
+def rollups_current():
+    """Check whether the rollups include every sales row"""
+    with db.engine.connect() as connection:
+        watermark = connection.execute(
+            select(RollupState.last_sales_id).where(RollupState.name == STATE_NAME)
+        ).scalar()
+        latest = connection.execute(select(func.coalesce(func.max(Sales.id), 0))).scalar()
+    return watermark is not None and watermark == latest
+
+# Rollup refreshes run here, one at a time, instead of on the request that found them stale
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollup-refresh")
+
+class RollupRouter:
+    """
+    Send matching aggregate queries to the rollup tables
+
+    Before a rewrite the rollups are checked against the latest sales id (at
+    most every ROLLUP_FRESHNESS_CHECK_SECONDS, and right away after a sales
+    write in any worker). When they are behind, the original query runs
+    unchanged and, with refresh_on_read, a background refresh is started.
+    """
+
+    def __init__(self, enabled=ROLLUPS_ENABLED, refresh_on_read=ROLLUP_REFRESH_ON_READ,
+                 freshness_check_seconds=ROLLUP_FRESHNESS_CHECK_SECONDS):
+        self.enabled = enabled
+        self.refresh_on_read = refresh_on_read
+        self.freshness_check_seconds = freshness_check_seconds
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._checked_versions = None
+        self._current = False
+        self._refresh = None
+        self._counts = {"rewrites": 0, "passthrough": 0, "refreshes": 0, "stale": 0}
+        self._by_table = {}
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def _is_current(self):
+        versions = table_versions.snapshot(("sales",))
+        now = time.monotonic()
+        with self._lock:
+            if (self._checked_at is not None and versions == self._checked_versions
+                    and now - self._checked_at < self.freshness_check_seconds):
+                return self._current
+
+        try:
+            current = rollups_current()
+        except SQLAlchemyError as e:
+            logger.warning(f"Could not check rollup freshness: {str(e)}")
+            current = False
+        if not current and self.refresh_on_read:
+            self._start_refresh()
+
+        with self._lock:
+            self._checked_at = now
+            self._checked_versions = versions
+            self._current = current
+        return current
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refresh is not None and not self._refresh.done():
+                return
+            self._refresh = _refresh_executor.submit(self._run_refresh)
+
+    def _run_refresh(self):
+        try:
+            with app.app_context():
+                if refresh_rollups():
+                    self._count("refreshes")
+        except SQLAlchemyError as e:
+            logger.warning(f"Background rollup refresh failed: {str(e)}")
+        finally:
+            # Check again on the next query instead of waiting out the freshness window
+            with self._lock:
+                self._checked_at = None
+
+    def rewrite(self, sql_query):
+        """
+        Get the SQL to execute for a query
+
+        Args:
+            sql_query: The SQL query text
+
+        Returns:
+            The query rewritten to a rollup table, or the original query
+        """
+        if not self.enabled or db.engine.dialect.name not in SUPPORTED_DIALECTS:
+            return sql_query
+
+        plan = plan_rollup_rewrite(sql_query)
+        if plan is None:
+            self._count("passthrough")
+            return sql_query
+        if not self._is_current():
+            self._count("stale")
+            return sql_query
+
+        rewritten, table_name = plan
+        with self._lock:
+            self._counts["rewrites"] += 1
+            self._by_table[table_name] = self._by_table.get(table_name, 0) + 1
+        logger.debug(f"Rewrote query to use {table_name}: {rewritten}")
+        return rewritten
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                **self._counts,
+                "rewrites_by_table": dict(self._by_table),
+            }
+
+# Shared router used by ai_agent and pagination
+rollup_router = RollupRouter()
+
+def rewrite_for_rollups(sql_query):
+    """Rewrite a query to use the rollup tables when possible"""
+    return rollup_router.rewrite(sql_query)
+
+@app.cli.command("refresh-rollups")
+@click.option("--full", is_flag=True, help="Rebuild the rollups from scratch")
+def refresh_rollups_command(full):
+    """Bring the sales rollup tables up to date"""
+    started = time.monotonic()
+    folded = refresh_rollups(full=full)
+    click.echo(f"Folded {folded:,} sales ids into the rollups in {time.monotonic() - started:.1f}s")
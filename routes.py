@@ -1,9 +1,28 @@
 import json
 import logging
-from flask import request, jsonify, render_template
-from app import app, db
+from flask import request, jsonify, render_template, Response, stream_with_context
+from app import app
 from models import QueryHistory
-from ai_agent import process_voice_query, execute_sql_query
+from ai_agent import process_voice_query, fetch_sql_rows_cached, fetch_sql_rows, stream_sql_query, StreamingGeneration
+from query_cache import query_cache, persistent_query_cache
+from result_cache import result_cache
+from circuit_breaker import model_breakers
+from rollups import rollup_router
+from query_guard import query_guard, QueryRejectedError
+from db_pool import pool_stats
+from jobs import job_manager, JobQueueFullError
+from database import record_query_history
+from tracing import span, render_metrics
+from query_router import query_router
+from sql_normalizer import fingerprint_stats, prepared_statements
+from serializers import (
+    typed_columns, dumps, dumps_lines, arrow_ipc, arrow_available, export_batches,
+    ARROW_MIMETYPE, PARQUET_MIMETYPE, UnsupportedFormatError
+)
+from config import JOB_SSE_HEARTBEAT_SECONDS, JOB_RETRY_AFTER_SECONDS, STREAM_BATCH_SIZE, EXPORT_BATCH_SIZE, EXPORT_MAX_ROWS
+from pagination import (
+    InvalidCursorError, build_page_query, clamp_page_size, decode_cursor, next_cursor, total_row_count
+)
 from sqlalchemy.exc import SQLAlchemyError
 
 logger = logging.getLogger(__name__)
@@ -38,20 +57,106 @@ def handle_voice_query():
             return jsonify({'error': 'Failed to process query with AI'}), 500
         
         # Save query to history
-        query_history = QueryHistory(
-            voice_query=voice_query,
-            generated_sql=result['sql'],
-            explanation=result['explanation']
-        )
-        db.session.add(query_history)
-        db.session.commit()
+        with span("history"):
+            record_query_history(voice_query, result)
         
-        return jsonify(result)
+        with span("serialize"):
+            return jsonify(result)
     
     except Exception as e:
         logger.error(f"Error processing voice query: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ask', methods=['POST'])
+def ask():
+    """
+    Generate SQL for a voice query and run it in a single request
+    
+    The response is NDJSON. The model's answer is streamed, and the SQL starts
+    running as soon as the model has written it. The first line is
+    {"type": "query", "sql", "partial": true} when the rest of the answer is
+    still being generated, and the full AI response ({"type": "query", "sql",
+    "explanation", "chart_type", ...}) follows once it is ready. Then come
+    {"type": "columns"}, columnar {"type": "rows", "values": [...]} batches
+    and a final {"type": "end", "rowCount", "truncated"}, plus "limited" and
+    "estimatedRows" when the guard added a LIMIT. Rows go through the result
+    cache like /api/run-sql, so a repeated question does not reach the
+    database. Errors after the first line are sent as {"type": "error"}.
+    """
+    data = request.json
+    
+    if not data or 'query' not in data:
+        return jsonify({'error': 'No query provided'}), 400
+    
+    voice_query = data['query']
+    language = data.get('language', 'en-US')
+    main_language = language.split('-')[0] if '-' in language else language
+    try:
+        max_rows = requested_max_rows(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_rows must be a positive integer'}), 400
+    
+    logger.info(f"Received voice query for execution: {voice_query} (language: {language})")
+    
+    try:
+        generation = StreamingGeneration(voice_query, language_code=main_language)
+        sql = generation.wait_for_sql()
+        if not sql:
+            return jsonify({'error': 'Failed to process query with AI'}), 500
+    except Exception as e:
+        logger.error(f"Error processing voice query: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    try:
+        batch_size = max(1, min(int(data.get('batch_size') or STREAM_BATCH_SIZE), STREAM_BATCH_SIZE))
+    except (TypeError, ValueError):
+        batch_size = STREAM_BATCH_SIZE
+    
+    def query_line(result):
+        if not result:
+            raise ValueError('Failed to process query with AI')
+        if result['sql'] != sql:
+            # Only happens if the model that streamed the SQL failed before finishing
+            raise ValueError('The generated query changed while it was running; please try again')
+        record_query_history(voice_query, result)
+        return app.json.dumps({'type': 'query', **result}) + '\n'
+    
+    def generate():
+        result = generation.result() if generation.done() else None
+        try:
+            if result is None:
+                yield app.json.dumps({'type': 'query', 'sql': sql, 'partial': True}) + '\n'
+            else:
+                yield query_line(result)
+            
+            # The SQL never leaves the server, so it goes straight to the result cache
+            # or, on a miss, through the guard (which may add a LIMIT) to the database
+            rows, columns, decision, _ = fetch_sql_rows_cached(sql)
+            columns = list(map(str, columns))
+            truncated = max_rows is not None and len(rows) > max_rows
+            if truncated:
+                rows = rows[:max_rows]
+            yield app.json.dumps({'type': 'columns', 'columns': columns}) + '\n'
+            for start in range(0, len(rows), batch_size):
+                if result is None and generation.done():
+                    result = generation.result()
+                    yield query_line(result)
+                batch = rows[start:start + batch_size]
+                yield app.json.dumps({'type': 'rows', 'values': typed_columns(batch, len(columns))}) + '\n'
+            
+            if result is None:
+                result = generation.result()
+                yield query_line(result)
+            end = {'type': 'end', 'rowCount': len(rows), 'truncated': truncated}
+            if decision['limited']:
+                end.update(limited=True, estimatedRows=decision['estimated_rows'])
+            yield app.json.dumps(end) + '\n'
+        except Exception as e:
+            logger.error(f"Error executing generated SQL: {str(e)}")
+            yield app.json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/run-sql', methods=['POST'])
 def run_sql():
     """Execute a generated SQL query against the database"""
@@ -63,32 +168,382 @@ def run_sql():
     sql_query = data['sql']
     logger.info(f"Executing SQL query: {sql_query}")
     
+    # Large results can be streamed as NDJSON instead of one JSON document
+    wants_stream = data.get('stream') or request.accept_mimetypes.best == 'application/x-ndjson'
+    
     try:
-        # Execute the SQL query
-        results, columns = execute_sql_query(sql_query)
+        if wants_stream:
+            try:
+                max_rows = requested_max_rows(data)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'max_rows must be a positive integer'}), 400
+            return stream_sql_response(sql_query, max_rows)
         
-        # Prepare response - ensure columns are JSON serializable
-        response = {
-            'columns': list(map(str, columns)),
-            'data': results,
-            'rowCount': len(results)
-        }
+        if 'page_size' in data or 'cursor' in data:
+            return paginated_sql_response(sql_query, data)
         
-        # Debug logging
-        logger.debug(f"SQL results: {len(results)} rows with columns {columns}")
+        # Repeated dashboard queries are served from the result cache
+        rows, columns, decision, age = fetch_sql_rows_cached(sql_query)
         
-        return jsonify(response)
+        with span("serialize"):
+            fields = {'limited': True, 'estimatedRows': decision['estimated_rows']} if decision['limited'] else {}
+            
+            # Debug logging
+            logger.debug(f"SQL results: {len(rows)} rows with columns {columns}")
+            
+            http_response = sql_results_response(rows, list(map(str, columns)),
+                                                 requested_result_format(data, allow_arrow=True), **fields)
+        http_response.headers['X-Cache'] = 'HIT' if age is not None else 'MISS'
+        http_response.headers['Age'] = str(int(age or 0))
+        return http_response
     
     except SQLAlchemyError as e:
         logger.error(f"SQL error: {str(e)}")
         return jsonify({'error': f'SQL error: {str(e)}'}), 400
     
+    except (InvalidCursorError, QueryRejectedError, UnsupportedFormatError) as e:
+        return jsonify({'error': str(e)}), 400
+    
     except Exception as e:
         logger.error(f"Error executing SQL query: {str(e)}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
+def requested_max_rows(data):
+    """
+    Read the optional "max_rows" row limit from the request body or query string
+    
+    JSON integers and digit-only strings (from the query string) are
+    accepted; floats such as 2.5 and booleans are not.
+    
+    Returns:
+        The limit as an int, or None when it is not given
+    
+    Raises:
+        ValueError: If the value is not a positive integer
+    """
+    value = data.get('max_rows')
+    if value is None or value == '':
+        return None
+    if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError('max_rows must be an integer')
+    max_rows = value
+    if max_rows < 1:
+        raise ValueError('max_rows must be positive')
+    return max_rows
+
+RESULT_FORMAT_MIMETYPES = {
+    'application/vnd.querytalk.columnar+json': 'columnar',
+    'application/vnd.querytalk.rows+json': 'rows',
+}
+
+def requested_result_format(data, allow_arrow=False):
+    """
+    Pick the result payload format from the request body or Accept header
+    
+    Args:
+        data: The request body (or query arguments)
+        allow_arrow: Whether the endpoint can answer with an Arrow IPC stream
+    
+    Returns:
+        One of 'records' (default), 'columnar' or 'rows', or 'arrow' when allowed
+    """
+    formats = dict(RESULT_FORMAT_MIMETYPES)
+    if allow_arrow and arrow_available():
+        formats[ARROW_MIMETYPE] = 'arrow'
+    result_format = data.get('format')
+    if not result_format:
+        best = request.accept_mimetypes.best_match(list(formats) + ['application/json'])
+        result_format = formats.get(best, 'records')
+    if result_format == 'arrow' and allow_arrow:
+        return result_format
+    return result_format if result_format in ('records', 'columnar', 'rows') else 'records'
+
+def format_sql_results(rows, columns, result_format='records'):
+    """
+    Shape query rows into the response payload
+    
+    'records' repeats the column names in every row (the original format),
+    'columnar' sends one array per column and 'rows' sends one array per row.
+    Values are converted to JSON types a column at a time (see
+    serializers.typed_columns), so decimals become numbers and dates ISO 8601
+    strings.
+    """
+    response = {
+        'columns': columns,
+        'rowCount': len(rows)
+    }
+    values = typed_columns(rows, len(columns))
+    if result_format == 'columnar':
+        response['format'] = 'columnar'
+        response['values'] = values
+    elif result_format == 'rows':
+        response['format'] = 'rows'
+        response['rows'] = list(zip(*values))
+    else:
+        response['data'] = [dict(zip(columns, row)) for row in zip(*values)]
+    return response
+
+def sql_results_response(rows, columns, result_format='records', **fields):
+    """
+    Serialize query rows into an HTTP response
+    
+    JSON formats are encoded with serializers.dumps (orjson when installed).
+    'arrow' sends an Arrow IPC stream with the other response fields in its
+    schema metadata.
+    
+    Args:
+        rows: A list of value tuples
+        columns: The column names
+        result_format: 'records', 'columnar', 'rows' or 'arrow'
+        **fields: Extra response fields, such as "limited" or "nextCursor"
+    """
+    if result_format == 'arrow':
+        return Response(arrow_ipc(rows, columns, {'rowCount': len(rows), **fields}), mimetype=ARROW_MIMETYPE)
+    response = format_sql_results(rows, columns, result_format)
+    response.update(fields)
+    return Response(dumps(response), mimetype='application/json')
+
+def paginated_sql_response(sql_query, data):
+    """
+    Execute one page of a SQL query
+    
+    The request carries "page_size" and the opaque "cursor" from the previous
+    page. The response adds "nextCursor", "hasMore", "pageSize" and, unless
+    "include_total" is false, a cached "totalCount".
+    """
+    page_size = clamp_page_size(data.get('page_size'))
+    state = decode_cursor(data['cursor']) if data.get('cursor') else None
+    
+    page_sql, params = build_page_query(sql_query, page_size, state)
+    rows, columns = fetch_sql_rows(page_sql, params)
+    cursor = next_cursor(sql_query, state, rows, columns, page_size)
+    rows = rows[:page_size]
+    
+    fields = {'pageSize': page_size, 'nextCursor': cursor, 'hasMore': cursor is not None}
+    if data.get('include_total', True):
+        fields['totalCount'] = total_row_count(sql_query)
+    
+    return sql_results_response(rows, list(map(str, columns)), requested_result_format(data, allow_arrow=True),
+                                **fields)
+
+def stream_sql_response(sql_query, max_rows=None):
+    """
+    Build a chunked NDJSON response for a SQL query
+    
+    The first line is {"columns": [...]}, followed by one JSON object per row
+    and a final {"rowCount": n, "truncated": bool} line. Errors after the
+    response has started are reported as an {"error": ...} line.
+    """
+    rows = stream_sql_query(sql_query, max_rows=max_rows, as_dicts=False)
+    # Start the query before responding so SQL errors still get a 400
+    columns = next(rows)
+    
+    def generate():
+        try:
+            yield dumps_lines([{'columns': columns}])
+            while True:
+                values = typed_columns(next(rows), len(columns))
+                yield dumps_lines(dict(zip(columns, row)) for row in zip(*values))
+        except StopIteration as done:
+            row_count, truncated = done.value or (0, False)
+            yield dumps_lines([{'rowCount': row_count, 'truncated': truncated}])
+        except Exception as e:
+            logger.error(f"Error streaming SQL query: {str(e)}")
+            yield dumps_lines([{'error': str(e)}])
+        finally:
+            # Release the server-side cursor if the client disconnects early
+            rows.close()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Export formats: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'arrow': (ARROW_MIMETYPE, 'arrows'),
+    'parquet': (PARQUET_MIMETYPE, 'parquet'),
+}
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_sql():
+    """
+    Export a SQL query's result as an Arrow IPC stream or a Parquet file
+    
+    Takes "sql", "format" ('parquet' by default, or 'arrow') and an optional
+    "max_rows" from the JSON body or the query string, so notebooks can read
+    the URL directly (pd.read_parquet, pyarrow.ipc.open_stream). Rows come
+    from a server-side cursor and are encoded EXPORT_BATCH_SIZE at a time, so
+    the full result is never held in memory.
+    
+    Exports stop at EXPORT_MAX_ROWS. Parquet files record "rowCount" and
+    "truncated" in their footer metadata. Arrow streams cannot carry anything
+    after the schema, so an Arrow export that reaches EXPORT_MAX_ROWS without
+    a smaller max_rows fails instead. Errors after the response has started
+    abort the connection, so the client sees a failed download rather than a
+    short file.
+    """
+    data = request.get_json(silent=True) or request.args
+    sql_query = data.get('sql')
+    if not sql_query:
+        return jsonify({'error': 'No SQL query provided'}), 400
+    
+    file_format = data.get('format', 'parquet')
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unknown export format: {file_format} (use {' or '.join(EXPORT_FORMATS)})"}), 400
+    if not arrow_available():
+        return jsonify({'error': f'{file_format.capitalize()} export needs the pyarrow package'}), 400
+    try:
+        max_rows = requested_max_rows(data)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_rows must be a positive integer'}), 400
+    
+    logger.info(f"Exporting SQL query as {file_format}: {sql_query}")
+    
+    try:
+        rows = stream_sql_query(sql_query, max_rows=max_rows, batch_size=EXPORT_BATCH_SIZE, as_dicts=False,
+                                row_cap=EXPORT_MAX_ROWS)
+        # Start the query before responding so SQL errors still get a 400
+        columns = next(rows)
+    
+    except SQLAlchemyError as e:
+        logger.error(f"SQL error: {str(e)}")
+        return jsonify({'error': f'SQL error: {str(e)}'}), 400
+    
+    except QueryRejectedError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    except Exception as e:
+        logger.error(f"Error exporting SQL query: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    outcome = {}
+    
+    def batches():
+        row_count, truncated = yield from rows
+        outcome.update(rowCount=row_count, truncated=truncated)
+        logger.info(f"Exported {row_count} rows as {file_format}{' (truncated)' if truncated else ''}")
+        if truncated and file_format == 'arrow' and (max_rows is None or max_rows > EXPORT_MAX_ROWS):
+            raise ValueError(f'The result has more than {EXPORT_MAX_ROWS} rows; export it as Parquet or pass max_rows')
+    
+    def generate():
+        try:
+            yield from export_batches(columns, batches(), file_format, footer=lambda: outcome)
+        except Exception as e:
+            logger.error(f"Error exporting SQL query: {str(e)}")
+            # The status is already sent; dropping the connection keeps the client from taking a short file as complete
+            raise
+        finally:
+            # Release the server-side cursor if the client disconnects early
+            rows.close()
+    
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="querytalk-export.{extension}"'
+    return response
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_query_job():
+    """
+    Start a voice query in the background
+    
+    Returns 202 with a job ID right away. Progress (queued, generating,
+    sql_ready, executing, done/failed) is available by polling
+    /api/jobs/<id> or as server-sent events from /api/jobs/<id>/events.
+    """
+    data = request.json
+    
+    if not data or 'query' not in data:
+        return jsonify({'error': 'No query provided'}), 400
+    
+    language = data.get('language', 'en-US')
+    main_language = language.split('-')[0] if '-' in language else language
+    
+    try:
+        job = job_manager.submit(data['query'], main_language)
+    except JobQueueFullError as e:
+        http_response = jsonify({'error': str(e)})
+        http_response.status_code = 429
+        http_response.headers['Retry-After'] = str(JOB_RETRY_AFTER_SECONDS)
+        return http_response
+    
+    http_response = jsonify({
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f'/api/jobs/{job.id}',
+        'eventsUrl': f'/api/jobs/{job.id}/events'
+    })
+    http_response.status_code = 202
+    http_response.headers['Location'] = f'/api/jobs/{job.id}'
+    return http_response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_query_job(job_id):
+    """Get a job's status and events, plus the AI response and rows once available"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    response = job.to_dict()
+    if job.ai_result:
+        response['result'] = job.ai_result
+    if job.status == 'done':
+        rows, columns, decision = job.result_rows()
+        response['data'] = format_sql_results(rows, list(map(str, columns)), requested_result_format(request.args))
+        if decision['limited']:
+            response['data']['limited'] = True
+            response['data']['estimatedRows'] = decision['estimated_rows']
+    return jsonify(response)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_query_job(job_id):
+    """Cancel a job that is still queued"""
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_manager.cancel(job_id):
+        return jsonify({'error': 'Job has already started'}), 409
+    return jsonify({'jobId': job_id, 'status': 'cancelled'})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_query_job_events(job_id):
+    """
+    Stream a job's status changes as server-sent events
+    
+    Each event is named after the status and carries the event JSON. The
+    stream resumes after Last-Event-ID and ends once the job finishes.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    try:
+        next_seq = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        next_seq = 0
+    
+    def generate():
+        seq = next_seq
+        while True:
+            events = job.wait_for_events(seq, JOB_SSE_HEARTBEAT_SECONDS)
+            if not events:
+                if job.finished:
+                    return
+                # Comment line keeps proxies from closing an idle stream
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                yield f"id: {event['seq']}\nevent: {event['status']}\ndata: {app.json.dumps(event)}\n\n"
+            seq = events[-1]['seq'] + 1
+            if job.finished and seq >= len(job.events):
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/query-history', methods=['GET'])
 def get_query_history():
     """Get the history of previous queries"""
@@ -109,6 +564,47 @@ def get_query_history():
         logger.error(f"Error retrieving query history: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Get counters for the NL-to-SQL and result-set caches, rollup router, query guard and job queue"""
+    return jsonify({
+        'query_cache': query_cache.stats(),
+        'persistent_query_cache': persistent_query_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'rollups': rollup_router.stats(),
+        'query_guard': query_guard.stats(),
+        'jobs': job_manager.stats()
+    })
+
+@app.route('/api/pool-stats', methods=['GET'])
+def get_pool_stats():
+    """Get connection pool saturation and checkout wait times per database engine"""
+    return jsonify(pool_stats())
+
+@app.route('/api/router-stats', methods=['GET'])
+def get_router_stats():
+    """Get local/model routing counts and local-vs-model agreement rates by confidence"""
+    return jsonify(query_router.stats())
+
+@app.route('/api/query-stats', methods=['GET'])
+def get_query_stats():
+    """Get execution counts and latencies per SQL fingerprint, most total time first"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "prepared_statements": prepared_statements.stats(),
+        "fingerprints": fingerprint_stats.stats(limit),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get pipeline stage and request duration histograms in the Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/model-status', methods=['GET'])
+def get_model_status():
+    """Get circuit breaker state for each Gemini model"""
+    return jsonify({'models': model_breakers.status()})
+
 @app.errorhandler(404)
 def not_found(e):
     return jsonify({'error': 'Not found'}), 404
@@ -0,0 +1,219 @@
+import logging
+import re
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+import models  # noqa: F401  (registers the tables on db.metadata)
+from config import (
+    DB_SCHEMA_DESCRIPTION,
+    SCHEMA_CONTEXT_MODE,
+    SCHEMA_CONTEXT_TABLES,
+    SCHEMA_SAMPLE_COLUMNS,
+    SCHEMA_SAMPLE_MAX_VALUES,
+    SCHEMA_SAMPLE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CONTEXT_HEADER = "Tables (column type; pk=primary key; fk>table.column=foreign key; {a|b}=known values):"
+
+# Short type names keep the rendered schema small
+TYPE_NAMES = {
+    "integer": "int",
+    "biginteger": "bigint",
+    "smallinteger": "int",
+    "string": "str",
+    "text": "text",
+    "float": "float",
+    "numeric": "num",
+    "date": "date",
+    "datetime": "datetime",
+    "boolean": "bool",
+}
+
+# Words that point at a table even though they are not one of its column names
+TABLE_KEYWORDS = {
+    "sales": {"sale", "sales", "sold", "revenue", "order", "orders", "amount", "quantity", "trend",
+              "trends", "month", "monthly", "daily", "weekly", "year", "yearly", "growth", "selling"},
+    "product": {"product", "products", "item", "items", "category", "categories", "price", "cost",
+                "margin", "margins", "profit"},
+    "customer": {"customer", "customers", "client", "clients", "segment", "segments", "region",
+                 "regions", "location", "locations", "lifetime", "buyer", "buyers"},
+    "query_history": {"history", "asked", "previous", "queries"},
+}
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def compact_schema_description(schema_text=DB_SCHEMA_DESCRIPTION):
+    """
+    Strip indentation and blank lines from the schema description
+
+    Args:
+        schema_text: The hand-written schema description
+
+    Returns:
+        The same description with fewer tokens
+    """
+    return "\n".join(line.strip() for line in schema_text.splitlines() if line.strip())
+
+class SchemaContextBuilder:
+    """
+    Build a token-minimal schema description from the SQLAlchemy models
+
+    Each table renders as one line, e.g.
+    "sales(id int pk, product_id int fk>product.id, total_amount float)".
+    Configured low-cardinality columns also list their distinct values, which
+    are cached for SCHEMA_SAMPLE_TTL_SECONDS. build() can limit the output to
+    the tables a query refers to.
+    """
+
+    def __init__(self, metadata, table_names=SCHEMA_CONTEXT_TABLES, sample_columns=SCHEMA_SAMPLE_COLUMNS,
+                 max_sample_values=SCHEMA_SAMPLE_MAX_VALUES, sample_ttl_seconds=SCHEMA_SAMPLE_TTL_SECONDS):
+        self.tables = [metadata.tables[name] for name in table_names if name in metadata.tables]
+        self.sample_columns = set(sample_columns)
+        self.max_sample_values = max_sample_values
+        self.sample_ttl_seconds = sample_ttl_seconds
+        self._samples = {}
+        self._samples_loaded_at = None
+        self._lock = threading.Lock()
+        self._keywords = self._build_keywords()
+
+    def _build_keywords(self):
+        keywords = {}
+        for table in self.tables:
+            words = set(TABLE_KEYWORDS.get(table.name, ()))
+            words.add(table.name)
+            for column in table.columns:
+                if column.name != "id":
+                    words.update(column.name.split("_"))
+            keywords[table.name] = words
+        return keywords
+
+    def _column_text(self, column, samples):
+        type_name = TYPE_NAMES.get(type(column.type).__name__.lower(), type(column.type).__name__.lower())
+        parts = [column.name, type_name]
+        if column.primary_key:
+            parts.append("pk")
+        for foreign_key in column.foreign_keys:
+            parts.append(f"fk>{foreign_key.target_fullname}")
+        values = samples.get(f"{column.table.name}.{column.name}")
+        if values:
+            parts.append("{" + "|".join(values) + "}")
+        return " ".join(parts)
+
+    def _load_samples(self):
+        """Fetch the distinct values of the sample columns, at most once per TTL"""
+        with self._lock:
+            now = time.monotonic()
+            if self._samples_loaded_at is not None and now - self._samples_loaded_at < self.sample_ttl_seconds:
+                return self._samples
+
+            samples = {}
+            try:
+                with db.engine.connect() as connection:
+                    for table in self.tables:
+                        for column in table.columns:
+                            if f"{table.name}.{column.name}" not in self.sample_columns:
+                                continue
+                            values = connection.execute(
+                                select(column).where(column.isnot(None)).distinct()
+                                .order_by(column).limit(self.max_sample_values + 1)
+                            ).scalars().all()
+                            # Only low-cardinality columns are worth listing
+                            if len(values) <= self.max_sample_values:
+                                samples[f"{table.name}.{column.name}"] = [str(value) for value in values]
+            except (SQLAlchemyError, RuntimeError) as e:
+                logger.warning(f"Could not load schema value samples: {str(e)}")
+                return self._samples
+
+            self._samples = samples
+            self._samples_loaded_at = now
+            return samples
+
+    def relevant_tables(self, query_text):
+        """
+        Pick the tables a query refers to, plus their foreign key neighbours
+
+        Args:
+            query_text: The natural language query text
+
+        Returns:
+            A list of table names, or every table if nothing matched
+        """
+        samples = self._samples
+        words = {word.lower() for word in WORD_PATTERN.findall(query_text or "")}
+        matched = set()
+        for table in self.tables:
+            sample_words = {
+                word for key, values in samples.items()
+                if key.startswith(f"{table.name}.") for value in values for word in value.lower().split()
+            }
+            if words & (self._keywords[table.name] | sample_words):
+                matched.add(table.name)
+
+        if not matched:
+            return [table.name for table in self.tables]
+
+        # Follow foreign keys one hop both ways: the tables that reference a matched one
+        # (sales for customer) and the tables a matched one references (product and
+        # customer for sales), so the model sees both sides of every join it may need
+        found = set(matched)
+        for table in self.tables:
+            referenced = {fk.column.table.name for fk in table.foreign_keys}
+            if referenced & found:
+                matched.add(table.name)
+            if table.name in found:
+                matched.update(referenced)
+        return [table.name for table in self.tables if table.name in matched]
+
+    def build(self, query_text=None, include_samples=True):
+        """
+        Render the schema context sent to the model
+
+        Args:
+            query_text: If given, only tables relevant to this query are included
+            include_samples: Whether to list known values of low-cardinality columns
+
+        Returns:
+            The schema context string
+        """
+        samples = self._load_samples() if include_samples else {}
+        table_names = set(self.relevant_tables(query_text)) if query_text else None
+        lines = [SCHEMA_CONTEXT_HEADER]
+        for table in self.tables:
+            if table_names is not None and table.name not in table_names:
+                continue
+            columns = ", ".join(self._column_text(column, samples) for column in table.columns)
+            lines.append(f"{table.name}({columns})")
+        return "\n".join(lines)
+
+# Shared builder for the application models
+schema_context = SchemaContextBuilder(db.metadata)
+
+def default_schema_text():
+    """
+    Get the full schema text for the configured SCHEMA_CONTEXT_MODE
+
+    Value samples are left out so the text only changes when the schema does.
+    That makes it suitable for cache fingerprints.
+    """
+    if SCHEMA_CONTEXT_MODE == "introspected":
+        return schema_context.build(include_samples=False)
+    return compact_schema_description()
+
+def schema_for_query(query_text):
+    """
+    Get the schema context to send with a query
+
+    Args:
+        query_text: The natural language query text
+
+    Returns:
+        Only the relevant tables, with value samples, in "introspected" mode;
+        otherwise the compacted hand-written description
+    """
+    if SCHEMA_CONTEXT_MODE == "introspected":
+        return schema_context.build(query_text)
+    return compact_schema_description()
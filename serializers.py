@@ -0,0 +1,281 @@
+import base64
+import json
+import logging
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+from config import RESULT_JSON_ENCODER, EXPORT_PARQUET_COMPRESSION
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    if RESULT_JSON_ENCODER == 'orjson':
+        logger.warning("RESULT_JSON_ENCODER is orjson but orjson is not installed; using the json module")
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+class UnsupportedFormatError(ValueError):
+    """Raised when a result format needs a package that is not installed"""
+
+def _iso(value):
+    return value.isoformat()
+
+def _bytes(value):
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+# JSON conversion for each database value type that JSON has no native form for
+CONVERTERS = {
+    Decimal: float,
+    datetime: _iso,
+    date: _iso,
+    time: _iso,
+    timedelta: timedelta.total_seconds,
+    uuid.UUID: str,
+    bytes: _bytes,
+    memoryview: _bytes,
+}
+NATIVE_TYPES = (str, int, float, bool)
+USE_ORJSON = orjson is not None and RESULT_JSON_ENCODER != 'json'
+# orjson writes these itself (as ISO 8601 and UUID strings), faster than converting them first
+ENCODER_NATIVE_TYPES = NATIVE_TYPES + ((datetime, date, time, uuid.UUID) if USE_ORJSON else ())
+
+def convert_value(value):
+    """Convert one value to its JSON form (the per-cell fallback for mixed-type columns)"""
+    if value is None or isinstance(value, NATIVE_TYPES):
+        return value
+    converter = CONVERTERS.get(type(value))
+    if converter is None:
+        converter = next((convert for kind, convert in CONVERTERS.items() if isinstance(value, kind)), str)
+    return converter(value)
+
+def convert_column(values):
+    """
+    Convert one column of values to JSON types
+
+    The converter is chosen once, from the column's first non-null value, and
+    applied to the whole column. Columns the encoder handles itself (strings,
+    numbers, and with orjson also dates, timestamps and UUIDs) are returned
+    untouched. If a value does not fit the chosen converter (SQLite columns
+    can mix types), the column falls back to per-value conversion.
+
+    Args:
+        values: A sequence holding one column's values
+
+    Returns:
+        A list (or the original sequence) of JSON-serializable values
+    """
+    sample = next((value for value in values if value is not None), None)
+    if sample is None or isinstance(sample, ENCODER_NATIVE_TYPES):
+        # Stray values of other types are left to the encoder's default hook
+        return values
+
+    converter = CONVERTERS.get(type(sample))
+    if converter is not None:
+        try:
+            return list(map(converter, values))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        # Nulls (or stray types) in the column; checking for them up front costs more than retrying
+        try:
+            return [None if value is None else converter(value) for value in values]
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return [convert_value(value) for value in values]
+
+def typed_columns(rows, column_count):
+    """
+    Transpose rows into JSON-ready columns
+
+    Args:
+        rows: A list of value tuples
+        column_count: Number of columns (used when there are no rows)
+
+    Returns:
+        A list with one sequence of converted values per column
+    """
+    if not rows:
+        return [[] for _ in range(column_count)]
+    return [convert_column(values) for values in zip(*rows)]
+
+def dumps(payload):
+    """
+    Encode a JSON payload to bytes
+
+    Uses orjson when it is installed, unless RESULT_JSON_ENCODER is "json";
+    otherwise the standard library encoder. Values should already be
+    converted with typed_columns; anything left goes through convert_value.
+    """
+    if USE_ORJSON:
+        return orjson.dumps(payload, default=convert_value)
+    return json.dumps(payload, default=convert_value, separators=(',', ':')).encode('utf-8')
+
+class ResultJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with dumps, so jsonify writes values the same way"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+def dumps_lines(payloads):
+    """Encode payloads as newline-delimited JSON bytes"""
+    return b''.join(dumps(payload) + b'\n' for payload in payloads)
+
+def _arrow_array(values):
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        # Mixed-type columns become strings of their JSON form
+        return pyarrow.array([None if value is None else str(convert_value(value)) for value in values])
+
+def arrow_ipc(rows, columns, metadata=None):
+    """
+    Encode rows as an Arrow IPC stream
+
+    Columns keep their database types (decimals, dates and timestamps are not
+    converted to JSON forms). Response fields such as "rowCount" go in the
+    schema metadata as JSON strings.
+
+    Args:
+        rows: A list of value tuples
+        columns: The column names
+        metadata: Optional dictionary of extra response fields
+
+    Returns:
+        The IPC stream as bytes
+
+    Raises:
+        UnsupportedFormatError: If pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise UnsupportedFormatError('Arrow output needs the pyarrow package')
+
+    arrays = [_arrow_array(list(values)) for values in zip(*rows)] if rows else [pyarrow.array([])] * len(columns)
+    schema_metadata = {key: dumps(value) for key, value in (metadata or {}).items()}
+    table = pyarrow.Table.from_arrays(arrays, names=columns).replace_schema_metadata(schema_metadata)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def arrow_available():
+    return pyarrow is not None
+
+class _ChunkSink:
+    """Write-only file object that collects what a writer writes until it is drained"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _export_field(name, array):
+    """Pick a column's export type from its first batch"""
+    if pyarrow.types.is_null(array.type):
+        return pyarrow.field(name, pyarrow.string())
+    if pyarrow.types.is_decimal(array.type):
+        # Later batches can need more precision or scale than the first one
+        return pyarrow.field(name, pyarrow.float64())
+    return pyarrow.field(name, array.type)
+
+def _export_array(values, field):
+    try:
+        return pyarrow.array(values, type=field.type)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        pass
+    if pyarrow.types.is_string(field.type):
+        return pyarrow.array([None if value is None else str(convert_value(value)) for value in values],
+                             type=field.type)
+    # Decimals into float64, for example
+    return pyarrow.array(convert_column(values), type=field.type)
+
+def _export_writer(sink, schema, file_format):
+    if file_format == 'parquet':
+        return pyarrow.parquet.ParquetWriter(sink, schema, compression=EXPORT_PARQUET_COMPRESSION)
+    return pyarrow.ipc.new_stream(sink, schema)
+
+def export_batches(columns, batches, file_format='arrow', footer=None):
+    """
+    Encode row batches as an Arrow IPC stream or a Parquet file, batch by batch
+
+    The schema is taken from the first batch: decimals are exported as
+    float64, and columns with no values in the first batch as strings. Each
+    later batch becomes one record batch (Arrow) or row group (Parquet), and
+    the bytes are yielded as soon as it is written, so only one batch is in
+    memory at a time.
+
+    Args:
+        columns: The column names
+        batches: An iterable of lists of value tuples
+        file_format: 'arrow' or 'parquet'
+        footer: Optional function called after the last batch that returns
+            fields (such as "rowCount") for the Parquet footer metadata, as
+            JSON strings like arrow_ipc's schema metadata. Arrow IPC streams
+            have no footer, so it is only called for Parquet.
+
+    Yields:
+        Chunks of the encoded file as bytes
+
+    Raises:
+        UnsupportedFormatError: If pyarrow is not installed
+    """
+    if pyarrow is None:
+        raise UnsupportedFormatError(f'{file_format.capitalize()} export needs the pyarrow package')
+
+    sink = _ChunkSink()
+    schema = None
+    writer = None
+    for batch in batches:
+        if not batch:
+            continue
+        values = list(zip(*batch))
+        if schema is None:
+            schema = pyarrow.schema([
+                _export_field(name, _arrow_array(list(column))) for name, column in zip(columns, values)
+            ])
+            writer = _export_writer(sink, schema, file_format)
+        arrays = [_export_array(list(column), field) for column, field in zip(values, schema)]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+
+    if writer is None:
+        # No rows: still write a valid, empty file with the column names
+        schema = pyarrow.schema([pyarrow.field(name, pyarrow.string()) for name in columns])
+        writer = _export_writer(sink, schema, file_format)
+    if footer is not None and file_format == 'parquet':
+        writer.add_key_value_metadata({key: dumps(value) for key, value in footer().items()})
+    writer.close()
+    yield sink.drain()
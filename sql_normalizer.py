@@ -0,0 +1,332 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
+from sqlalchemy import text
+from result_cache import canonicalize_sql, SQL_TOKEN_PATTERN
+from config import (
+    SQL_NORMALIZE_ENABLED,
+    SQL_NORMALIZE_CACHE_SIZE,
+    SQL_PREPARED_STATEMENTS,
+    SQL_PREPARED_MAX_PER_CONNECTION,
+    SQL_FINGERPRINT_STATS_MAX,
+    SQL_FINGERPRINT_SAMPLES,
+)
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers, two-character operators and single symbols, plus whitespace
+CODE_TOKEN_PATTERN = re.compile(r"(\s+)|(\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?![\w.]))|(\w+)|(<>|!=|<=|>=|::)|(.)", re.DOTALL)
+BIND_PATTERN = re.compile(r"(?<![:\w]):(\w+)")
+
+# A literal right after one of these is a value, not part of the query's shape
+VALUE_CONTEXTS = {"=", "<>", "!=", "<", ">", "<=", ">=", "like", "ilike", "limit", "offset"}
+PARAM_PREFIX = "qt_lit"
+
+class NormalizedQuery:
+    """
+    A query with its literal values lifted into bound parameters
+
+    Attributes:
+        sql: The SQL with :qt_litN placeholders in place of the lifted literals
+        params: Dictionary of the lifted values
+        fingerprint: Hash of the canonical parameterized SQL, shared by every
+            query that differs only in those values
+    """
+
+    __slots__ = ("sql", "params", "fingerprint")
+
+    def __init__(self, sql, params, fingerprint):
+        self.sql = sql
+        self.params = params
+        self.fingerprint = fingerprint
+
+def _literal_value(token):
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    return float(token) if any(char in token for char in ".eE") else int(token)
+
+def _lift_literals(sql_query):
+    """
+    Replace value literals with placeholders
+
+    Only literals in value positions are lifted: after a comparison, LIKE,
+    LIMIT or OFFSET, inside an IN (...) list, or as BETWEEN bounds. Literals
+    that shape the query (function arguments such as DATE_TRUNC('month', ...),
+    ORDER BY 1, typed literals like INTERVAL '1 day' or '2024-01-01'::date)
+    are left alone, so expressions repeated in SELECT and GROUP BY stay
+    identical. Equal values share one placeholder for the same reason.
+    """
+    pieces = []
+    params = {}
+    names = {}
+    # The lifted literal waiting for the next token, which may be a :: cast
+    state = {"previous": None, "depth": 0, "in_list_depth": None, "between": None, "pending": None}
+
+    def is_value_position():
+        previous = state["previous"]
+        if previous in VALUE_CONTEXTS:
+            return True
+        # "x BETWEEN <bound> AND <bound>"
+        if (state["between"], previous) in (("low", "between"), ("high", "and")):
+            return True
+        return state["depth"] == state["in_list_depth"] and previous in ("(", ",")
+
+    def settle(next_token):
+        pending = state["pending"]
+        state["pending"] = None
+        if pending is None or next_token == "::":
+            # :qt_lit0::date would not be read as a bind parameter
+            return
+        index, value, key = pending
+        if key not in names:
+            names[key] = f"{PARAM_PREFIX}{len(params)}"
+            params[names[key]] = value
+        pieces[index] = f":{names[key]}"
+
+    def advance(token, value):
+        settle(token)
+        if value is not None and is_value_position():
+            # LIMIT and OFFSET take bigint; sharing their value with a numeric comparison would not type-check
+            key = (type(value), value, state["previous"] in ("limit", "offset"))
+            state["pending"] = (len(pieces), value, key)
+        pieces.append(token)
+
+        lowered = token.lower()
+        if lowered == "between":
+            state["between"] = "low"
+        elif state["between"] == "low" and lowered == "and":
+            state["between"] = "high"
+        elif state["between"] == "high":
+            state["between"] = None
+        elif lowered == "(":
+            state["depth"] += 1
+            if state["previous"] == "in":
+                state["in_list_depth"] = state["depth"]
+        elif lowered == ")":
+            if state["in_list_depth"] == state["depth"]:
+                state["in_list_depth"] = None
+            state["depth"] -= 1
+        elif lowered == "select" and state["previous"] == "(":
+            # IN (SELECT ...) is a subquery, not a list of values
+            if state["in_list_depth"] == state["depth"]:
+                state["in_list_depth"] = None
+
+        state["previous"] = lowered
+
+    for literal, quoted, line_comment, block_comment, other in SQL_TOKEN_PATTERN.findall(sql_query):
+        if line_comment or block_comment:
+            pieces.append(" ")
+        elif literal or quoted:
+            advance(literal or quoted, _literal_value(literal) if literal else None)
+        else:
+            for space, number, word, operator, symbol in CODE_TOKEN_PATTERN.findall(other):
+                if space:
+                    pieces.append(space)
+                else:
+                    advance(number or word or operator or symbol, _literal_value(number) if number else None)
+    settle(None)
+
+    return "".join(pieces).strip(), params
+
+@lru_cache(maxsize=SQL_NORMALIZE_CACHE_SIZE)
+def _normalize(sql_query, enabled):
+    if enabled:
+        template, params = _lift_literals(sql_query)
+    else:
+        template, params = sql_query, {}
+    fingerprint = hashlib.sha256(canonicalize_sql(template).encode("utf-8")).hexdigest()[:16]
+    return template, tuple(params.items()), fingerprint
+
+def normalize_sql(sql_query):
+    """
+    Lift literals out of a query and fingerprint its shape
+
+    Args:
+        sql_query: The SQL query text
+
+    Returns:
+        A NormalizedQuery (when SQL_NORMALIZE_ENABLED is off the SQL is kept
+        as is, but still fingerprinted)
+    """
+    template, params, fingerprint = _normalize(sql_query, SQL_NORMALIZE_ENABLED)
+    return NormalizedQuery(template, dict(params), fingerprint)
+
+@lru_cache(maxsize=SQL_NORMALIZE_CACHE_SIZE)
+def _positional(template):
+    """Rewrite :name placeholders as $1, $2, ... for PREPARE, returning (sql, names)"""
+    names = []
+    pieces = []
+    for literal, quoted, line_comment, block_comment, other in SQL_TOKEN_PATTERN.findall(template):
+        if literal or quoted:
+            pieces.append(literal or quoted)
+            continue
+        if line_comment or block_comment:
+            pieces.append(" ")
+            continue
+
+        def number(match):
+            name = match.group(1)
+            if name not in names:
+                names.append(name)
+            return f"${names.index(name) + 1}"
+        pieces.append(BIND_PATTERN.sub(number, other))
+    return "".join(pieces), tuple(names)
+
+class PreparedStatements:
+    """
+    Execute normalized queries as server-side prepared statements on Postgres
+
+    Each pooled connection keeps up to max_per_connection statements named
+    after their fingerprint, evicting the least recently used one with
+    DEALLOCATE. Postgres then plans a query shape once per connection instead
+    of once per literal value. PREPARE runs in a savepoint; shapes Postgres
+    cannot prepare (untyped parameters, for example) are remembered and run
+    as plain parameterized statements. Other databases run the parameterized
+    SQL directly (SQLite's driver already caches prepared statements).
+    """
+
+    def __init__(self, enabled=SQL_PREPARED_STATEMENTS, max_per_connection=SQL_PREPARED_MAX_PER_CONNECTION):
+        self.enabled = enabled
+        self.max_per_connection = max_per_connection
+        self._unpreparable = set()
+        self._lock = threading.Lock()
+        self._counts = {"prepared": 0, "reused": 0, "deallocated": 0, "unpreparable": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def execute(self, connection, normalized, params=None, prepare=True):
+        """
+        Execute a normalized query
+
+        Args:
+            connection: An open SQLAlchemy connection
+            normalized: The NormalizedQuery to run
+            params: Extra bind parameters the SQL already had
+            prepare: Use a prepared statement where possible (server-side
+                cursors cannot DECLARE over EXECUTE, so streaming passes False)
+
+        Returns:
+            The SQLAlchemy result
+        """
+        bind_params = {**(params or {}), **normalized.params}
+        if (not prepare or not self.enabled or connection.dialect.name != "postgresql"
+                or normalized.fingerprint in self._unpreparable):
+            return connection.execute(text(normalized.sql), bind_params)
+
+        name = f"qt_{normalized.fingerprint}"
+        statements = connection.connection.info.setdefault("prepared_statements", OrderedDict())
+        positional_sql, names = _positional(normalized.sql)
+        if name in statements:
+            statements.move_to_end(name)
+            self._count("reused")
+        else:
+            try:
+                with connection.begin_nested():
+                    connection.execute(text(f"PREPARE {name} AS {positional_sql}"))
+            except Exception as e:
+                logger.debug(f"Could not prepare query {normalized.fingerprint}: {str(e)}")
+                with self._lock:
+                    self._unpreparable.add(normalized.fingerprint)
+                    self._counts["unpreparable"] += 1
+                return connection.execute(text(normalized.sql), bind_params)
+
+            statements[name] = True
+            self._count("prepared")
+            while len(statements) > self.max_per_connection:
+                evicted, _ = statements.popitem(last=False)
+                connection.execute(text(f"DEALLOCATE {evicted}"))
+                self._count("deallocated")
+
+        arguments = f"({', '.join(':' + param for param in names)})" if names else ""
+        return connection.execute(text(f"EXECUTE {name}{arguments}"), bind_params)
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, "max_per_connection": self.max_per_connection, **self._counts}
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class FingerprintStats:
+    """
+    Execution counts and latencies per query fingerprint
+
+    Keeps the max_entries most recently run fingerprints, each with its
+    parameterized SQL, call and error counts, rows returned and a window of
+    recent latencies for percentiles.
+    """
+
+    def __init__(self, max_entries=SQL_FINGERPRINT_STATS_MAX, samples=SQL_FINGERPRINT_SAMPLES):
+        self.max_entries = max_entries
+        self.samples = samples
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, normalized, seconds, rows=0, failed=False):
+        """
+        Record one execution
+
+        Args:
+            normalized: The NormalizedQuery that ran
+            seconds: Time to execute and fetch
+            rows: Number of rows returned
+            failed: Whether the query raised an error
+        """
+        with self._lock:
+            entry = self._entries.get(normalized.fingerprint)
+            if entry is None:
+                entry = self._entries[normalized.fingerprint] = {
+                    "sql": normalized.sql, "calls": 0, "errors": 0, "rows": 0, "total_seconds": 0.0,
+                    "max_seconds": 0.0, "latencies": deque(maxlen=self.samples),
+                }
+            self._entries.move_to_end(normalized.fingerprint)
+            entry["calls"] += 1
+            entry["errors"] += int(failed)
+            entry["rows"] += rows
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["latencies"].append(seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self, limit=50):
+        """
+        Get the fingerprints that took the most total time
+
+        Args:
+            limit: Maximum number of fingerprints to return
+
+        Returns:
+            A list of per-fingerprint dictionaries, slowest total first
+        """
+        with self._lock:
+            entries = [(fingerprint, dict(entry, latencies=sorted(entry["latencies"])))
+                       for fingerprint, entry in self._entries.items()]
+
+        entries.sort(key=lambda item: item[1]["total_seconds"], reverse=True)
+        return [
+            {
+                "fingerprint": fingerprint,
+                "sql": entry["sql"],
+                "calls": entry["calls"],
+                "errors": entry["errors"],
+                "rows": entry["rows"],
+                "total_ms": round(entry["total_seconds"] * 1000, 3),
+                "mean_ms": round(entry["total_seconds"] / entry["calls"] * 1000, 3),
+                "p50_ms": round(_percentile(entry["latencies"], 0.5) * 1000, 3),
+                "p95_ms": round(_percentile(entry["latencies"], 0.95) * 1000, 3),
+                "max_ms": round(entry["max_seconds"] * 1000, 3),
+            }
+            for fingerprint, entry in entries[:limit]
+        ]
+
+# Shared by every query run on behalf of a client
+prepared_statements = PreparedStatements()
+fingerprint_stats = FingerprintStats()
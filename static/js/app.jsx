@@ -50,8 +50,8 @@ const App = () => {
     setError('');
     
     try {
-      // Send query to AI agent
-      const aiResponse = await fetch('/api/voice-query', {
+      // Generate and run the SQL in one request; the response is NDJSON
+      const response = await fetch('/api/ask', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -59,35 +59,65 @@ const App = () => {
         body: JSON.stringify({ query }),
       });
       
-      const aiData = await aiResponse.json();
-      
-      if (!aiResponse.ok) {
-        setError(aiData.error || 'Error processing query with AI');
+      if (!response.ok) {
+        const errorData = await response.json();
+        setError(errorData.error || 'Error processing query with AI');
         setIsProcessing(false);
         return;
       }
       
-      setAiResponse(aiData);
-      setProcessingStep('Running SQL query...');
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffered = '';
+      let results = null;
+      // A "partial" query line only carries the SQL; rendering waits for the full answer
+      let answered = false;
+      let done = false;
       
-      // Execute the SQL query
-      const sqlResponse = await fetch('/api/run-sql', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ sql: aiData.sql }),
-      });
-      
-      const sqlData = await sqlResponse.json();
-      
-      if (!sqlResponse.ok) {
-        setError(sqlData.error || 'Error executing SQL query');
-        setIsProcessing(false);
-        return;
+      while (!done) {
+        const chunk = await reader.read();
+        done = chunk.done;
+        buffered += decoder.decode(chunk.value || new Uint8Array(), { stream: !done });
+        const lines = buffered.split('\n');
+        buffered = done ? '' : lines.pop();
+        
+        for (const line of lines) {
+          if (!line.trim()) {
+            continue;
+          }
+          const message = JSON.parse(line);
+          
+          if (message.type === 'error') {
+            setError(message.error || 'Error executing SQL query');
+            setIsProcessing(false);
+            return;
+          } else if (message.type === 'query') {
+            setProcessingStep('Running SQL query...');
+            if (message.partial) {
+              continue;
+            }
+            answered = true;
+            setAiResponse(message);
+            if (results) {
+              setQueryResults(results);
+            }
+          } else if (message.type === 'columns') {
+            results = { columns: message.columns, format: 'columnar', values: message.columns.map(() => []), rowCount: 0 };
+          } else if (message.type === 'rows') {
+            results = {
+              ...results,
+              values: results.values.map((columnValues, index) => columnValues.concat(message.values[index])),
+            };
+            results.rowCount = results.values[0] ? results.values[0].length : 0;
+            if (answered) {
+              setQueryResults(results);
+            }
+          } else if (message.type === 'end') {
+            setQueryResults(results);
+          }
+        }
       }
       
-      setQueryResults(sqlData);
       setIsProcessing(false);
       
       // Refresh query history
@@ -125,7 +155,7 @@ const App = () => {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ sql }),
+        body: JSON.stringify({ sql, format: 'columnar' }),
       });
       
       const sqlData = await sqlResponse.json();
@@ -212,7 +242,7 @@ const App = () => {
                     Visualization
                   </h5>
                   <Visualization 
-                    data={queryResults.data} 
+                    values={queryResults.values} 
                     columns={queryResults.columns} 
                     chartType={aiResponse?.chart_type || 'bar'} 
                   />
@@ -235,10 +265,10 @@ const App = () => {
                         </tr>
                       </thead>
                       <tbody>
-                        {queryResults.data.map((row, rowIndex) => (
+                        {Array.from({ length: queryResults.rowCount }, (_, rowIndex) => (
                           <tr key={rowIndex}>
-                            {queryResults.columns.map((column, colIndex) => (
-                              <td key={colIndex}>{row[column]}</td>
+                            {queryResults.values.map((columnValues, colIndex) => (
+                              <td key={colIndex}>{columnValues[rowIndex]}</td>
                             ))}
                           </tr>
                         ))}
@@ -1,13 +1,20 @@
 import React, { useEffect, useRef } from 'react';
 import Chart from 'chart.js/auto';
 
-const Visualization = ({ data, columns, chartType }) => {
+const Visualization = ({ data, values, columns, chartType }) => {
   const chartRef = useRef(null);
   const chartInstance = useRef(null);
   
+  // Columnar payloads pass one array per column in `values`;
+  // row payloads pass row objects in `data`
+  const rowCount = values ? (values[0] || []).length : (data || []).length;
+  const getColumn = (column) => values
+    ? values[columns.indexOf(column)]
+    : data.map(item => item[column]);
+  
   // Process data for visualization
   const processDataForChart = () => {
-    if (!data || data.length === 0 || !columns || columns.length === 0) {
+    if (rowCount === 0 || !columns || columns.length === 0) {
       return null;
     }
     
@@ -59,7 +66,7 @@ const Visualization = ({ data, columns, chartType }) => {
     }
     
     // Get unique labels
-    const labels = data.map(item => item[labelColumn]);
+    const labels = getColumn(labelColumn);
     
     // Get datasets
     let datasets = [];
@@ -68,7 +75,7 @@ const Visualization = ({ data, columns, chartType }) => {
     const remainingColumns = columns.filter(col => 
       col !== labelColumn && 
       !col.toLowerCase().includes('id') &&
-      typeof data[0][col] === 'number'
+      typeof getColumn(col)[0] === 'number'
     );
     
     if (remainingColumns.length > 0) {
@@ -77,7 +84,7 @@ const Visualization = ({ data, columns, chartType }) => {
         datasets = remainingColumns.map((col, index) => {
           return {
             label: col,
-            data: data.map(item => item[col]),
+            data: getColumn(col),
             backgroundColor: getColorArray(index, remainingColumns.length),
             borderColor: getColorArray(index, remainingColumns.length),
             borderWidth: 1
@@ -87,9 +94,9 @@ const Visualization = ({ data, columns, chartType }) => {
         // Single series
         datasets = [{
           label: valueColumn,
-          data: data.map(item => item[valueColumn]),
-          backgroundColor: getColorArray(0, data.length),
-          borderColor: chartType === 'line' ? getColorArray(0, 1) : getColorArray(0, data.length),
+          data: getColumn(valueColumn),
+          backgroundColor: getColorArray(0, rowCount),
+          borderColor: chartType === 'line' ? getColorArray(0, 1) : getColorArray(0, rowCount),
           borderWidth: 1
         }];
       }
@@ -175,9 +182,9 @@ const Visualization = ({ data, columns, chartType }) => {
         chartInstance.current.destroy();
       }
     };
-  }, [data, columns, chartType]);
+  }, [data, values, columns, chartType]);
   
-  if (!data || data.length === 0) {
+  if (rowCount === 0) {
     return (
       <div className="alert alert-info">
         No data available to visualize.
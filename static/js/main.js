@@ -239,54 +239,118 @@ document.addEventListener('DOMContentLoaded', function() {
   // Setup keyboard shortcuts
   setupKeyboardShortcuts();
   
-  // Process the query
+  // Rows are streamed from /api/ask in batches; the first batch is shown
+  // immediately and the chart is redrawn at most every RENDER_INTERVAL_MS
+  const STREAM_BATCH_SIZE = 500;
+  const MAX_STREAMED_ROWS = 10000;
+  const RENDER_INTERVAL_MS = 250;
+  let activeQueryId = 0;
+  
+  // Read an NDJSON response body and call onMessage for every complete line
+  async function readNdjson(response, onMessage) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    
+    while (true) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+      
+      const lines = buffered.split('\n');
+      buffered = lines.pop();
+      for (const line of lines) {
+        if (line.trim() && onMessage(JSON.parse(line)) === false) {
+          reader.cancel();
+          return;
+        }
+      }
+      
+      if (done) {
+        if (buffered.trim()) {
+          onMessage(JSON.parse(buffered));
+        }
+        return;
+      }
+    }
+  }
+  
+  // Process the query: generate and run the SQL in one streamed request
   function processQuery(query) {
+    const queryId = ++activeQueryId;
     showLoading('Analyzing with AI...');
     
     // Get the selected language
     const selectedLanguage = document.getElementById('language-selector').value;
     
-    // First, send to AI to generate SQL
-    fetch('/api/voice-query', {
+    let aiResponse = null;
+    let queryResults = null;
+    let lastRenderAt = 0;
+    
+    fetch('/api/ask', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
       body: JSON.stringify({ 
         query,
-        language: selectedLanguage 
+        language: selectedLanguage,
+        batch_size: STREAM_BATCH_SIZE,
+        max_rows: MAX_STREAMED_ROWS
       }),
     })
-    .then(response => response.json())
-    .then(aiResponse => {
-      if (aiResponse.error) {
-        throw new Error(aiResponse.error);
+    .then(response => {
+      if (!response.ok) {
+        return response.json().then(data => {
+          throw new Error(data.error || 'Error processing query with AI');
+        });
       }
       
-      showLoading('Running SQL query...');
-      
-      // Then execute the SQL
-      return fetch('/api/run-sql', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ sql: aiResponse.sql }),
-      })
-      .then(response => response.json())
-      .then(sqlData => {
-        if (sqlData.error) {
-          throw new Error(sqlData.error);
+      return readNdjson(response, message => {
+        // Stop reading a stream the user has already replaced
+        if (queryId !== activeQueryId) {
+          return false;
         }
         
-        // Hide loading indicator
-        hideLoading();
-        
-        // Display results
-        displayResults(sqlData, aiResponse);
+        if (message.type === 'error') {
+          throw new Error(message.error);
+        }
         
-        // Update query history
-        fetchQueryHistory();
+        if (message.type === 'query') {
+          // The SQL can arrive first ("partial"); the full answer follows while rows stream
+          aiResponse = message;
+          if (message.partial) {
+            showLoading('Running SQL query...');
+          } else if (queryResults && queryResults.rowCount) {
+            hideLoading();
+            displayResults(queryResults, aiResponse);
+          }
+        } else if (message.type === 'columns') {
+          queryResults = {
+            columns: message.columns,
+            format: 'columnar',
+            values: message.columns.map(() => []),
+            rowCount: 0
+          };
+        } else if (message.type === 'rows') {
+          message.values.forEach((columnValues, index) => {
+            queryResults.values[index].push(...columnValues);
+          });
+          queryResults.rowCount = queryResults.values[0] ? queryResults.values[0].length : 0;
+          
+          const now = Date.now();
+          if (!aiResponse.partial && now - lastRenderAt >= RENDER_INTERVAL_MS) {
+            lastRenderAt = now;
+            hideLoading();
+            displayResults(queryResults, aiResponse);
+          }
+        } else if (message.type === 'end') {
+          queryResults.hasMore = message.truncated;
+          hideLoading();
+          displayResults(queryResults, aiResponse);
+          
+          // Update query history
+          fetchQueryHistory();
+        }
       });
     })
     .catch(error => {
@@ -298,7 +362,7 @@ document.addEventListener('DOMContentLoaded', function() {
   // Display results
   function displayResults(queryResults, aiResponse) {
     console.log('Displaying results:', { 
-      rows: queryResults.data.length, 
+      rows: queryResults.rowCount, 
       columns: queryResults.columns.length,
       chartType: aiResponse.chart_type 
     });
@@ -331,7 +395,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Create chart
     const chartCanvas = document.getElementById('chart-canvas');
     console.log('Chart canvas found:', !!chartCanvas);
-    const chartData = processDataForChart(queryResults.data, queryResults.columns, chartType);
+    const chartData = processDataForChart(getColumnArrays(queryResults), queryResults.columns, chartType);
     
     if (chartData) {
       // Use preferred color theme if enabled
@@ -408,7 +472,7 @@ document.addEventListener('DOMContentLoaded', function() {
     tableHead.appendChild(headerRow);
     
     // Add data rows
-    queryResults.data.forEach(row => {
+    getRowObjects(queryResults).forEach(row => {
       const tr = document.createElement('tr');
       queryResults.columns.forEach(column => {
         const td = document.createElement('td');
@@ -461,11 +525,40 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
   
+  // Get one array of values per column, keyed by column name.
+  // Columnar payloads already have this shape, so no per-row work is needed.
+  function getColumnArrays(queryResults) {
+    const columnArrays = {};
+    queryResults.columns.forEach((column, index) => {
+      columnArrays[column] = queryResults.format === 'columnar'
+        ? queryResults.values[index]
+        : queryResults.data.map(row => row[column]);
+    });
+    return columnArrays;
+  }
+  
+  // Get row objects for the table view and exports
+  function getRowObjects(queryResults) {
+    if (queryResults.format !== 'columnar') {
+      return queryResults.data;
+    }
+    const rows = [];
+    for (let rowIndex = 0; rowIndex < queryResults.rowCount; rowIndex++) {
+      const row = {};
+      queryResults.columns.forEach((column, index) => {
+        row[column] = queryResults.values[index][rowIndex];
+      });
+      rows.push(row);
+    }
+    return rows;
+  }
+  
   // Process data for chart visualization
-  function processDataForChart(data, columns, chartType) {
-    if (!data || data.length === 0 || !columns || columns.length === 0) {
+  function processDataForChart(columnArrays, columns, chartType) {
+    if (!columnArrays || !columns || columns.length === 0 || columnArrays[columns[0]].length === 0) {
       return null;
     }
+    const rowCount = columnArrays[columns[0]].length;
     
     // For simplicity, we'll assume the first column is labels (x-axis)
     // and the second column is values (y-axis)
@@ -515,7 +608,7 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Get unique labels
-    const labels = data.map(item => item[labelColumn]);
+    const labels = columnArrays[labelColumn];
     
     // Get datasets
     let datasets = [];
@@ -524,7 +617,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const remainingColumns = columns.filter(col => 
       col !== labelColumn && 
       !col.toLowerCase().includes('id') &&
-      typeof data[0][col] === 'number'
+      typeof columnArrays[col][0] === 'number'
     );
     
     if (remainingColumns.length > 0) {
@@ -533,7 +626,7 @@ document.addEventListener('DOMContentLoaded', function() {
         datasets = remainingColumns.map((col, index) => {
           return {
             label: col,
-            data: data.map(item => item[col]),
+            data: columnArrays[col],
             backgroundColor: getColorArray(index, remainingColumns.length, chartType),
             borderColor: getColorArray(index, remainingColumns.length, chartType),
             borderWidth: 1
@@ -543,9 +636,9 @@ document.addEventListener('DOMContentLoaded', function() {
         // Single series
         datasets = [{
           label: valueColumn,
-          data: data.map(item => item[valueColumn]),
-          backgroundColor: getColorArray(0, data.length, chartType),
-          borderColor: chartType && chartType === 'line' ? getColorArray(0, 1, chartType) : getColorArray(0, data.length, chartType),
+          data: columnArrays[valueColumn],
+          backgroundColor: getColorArray(0, rowCount, chartType),
+          borderColor: chartType && chartType === 'line' ? getColorArray(0, 1, chartType) : getColorArray(0, rowCount, chartType),
           borderWidth: 1
         }];
       }
@@ -737,7 +830,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     const { queryResults } = window.currentChartData;
-    const { columns, data } = queryResults;
+    const { columns } = queryResults;
+    const data = getRowObjects(queryResults);
     
     // Create CSV content
     let csvContent = columns.join(',') + '\\n';
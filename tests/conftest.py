@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The app reads its settings at import time, so point it at a throwaway database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402,F401  (import the app before the modules that need it)
@@ -0,0 +1,67 @@
+import datetime
+import pytest
+from intent_matcher import intent_matcher, extract_parameters
+
+TODAY = datetime.date(2024, 5, 15)
+LAST_30_DAYS = "s.date >= '2024-04-16' AND s.date < '2024-05-16'"
+YEAR_2023 = "s.date >= '2023-01-01' AND s.date < '2024-01-01'"
+
+# (language, query, intent, SQL fragments, unapplied)
+CASES = [
+    ("en", "top 5 products", "top_products", ["LIMIT 5"], []),
+    ("en", "top ten customers", "top_customers", ["LIMIT 10"], []),
+    ("en", "monthly sales trend", "monthly_trend", ["DATE_TRUNC('month', s.date)"], []),
+    ("en", "revenue by category", "revenue_by_category", ["GROUP BY p.category"], []),
+    ("en", "top products by revenue in 2023", "top_products", [YEAR_2023, "LIMIT 5"], []),
+    ("en", "revenue in the last 30 days", "total_revenue", [LAST_30_DAYS], []),
+    ("en", "sales of electronics last month", "total_revenue",
+     ["p.category = 'Electronics'", "s.date >= '2024-04-01' AND s.date < '2024-05-01'"], []),
+    ("en", "revenue last month in 2023", "total_revenue", ["s.date >= '2024-04-01'"], ["date_range"]),
+    ("en", "customers per segment count in 2023", "customers_by_segment", ["FROM customer c"], ["date_range"]),
+    ("de", "top 5 produkte", "top_products", ["LIMIT 5"], []),
+    ("de", "umsatz pro monat", "monthly_trend", ["DATE_TRUNC('month', s.date)"], []),
+    ("de", "umsatz der letzten 30 tage", "total_revenue", [LAST_30_DAYS], []),
+    ("de", "umsatz nach kategorie", "revenue_by_category", ["GROUP BY p.category"], []),
+    ("hi", "शीर्ष 5 उत्पाद", "top_products", ["LIMIT 5"], []),
+    ("hi", "मासिक बिक्री का रुझान", "monthly_trend", ["DATE_TRUNC('month', s.date)"], []),
+    ("hi", "पिछले 30 दिनों की बिक्री", "total_revenue", [LAST_30_DAYS], []),
+    ("ja", "上位5製品", "top_products", ["LIMIT 5"], []),
+    ("ja", "月別の売上推移", "monthly_trend", ["DATE_TRUNC('month', s.date)"], []),
+    ("ja", "過去30日間の売上", "total_revenue", [LAST_30_DAYS], []),
+    ("ja", "2023年の売上", "total_revenue", [YEAR_2023], []),
+]
+
+@pytest.mark.parametrize("language, query, intent, fragments, unapplied", CASES)
+def test_match(language, query, intent, fragments, unapplied):
+    result = intent_matcher.match(query, language, today=TODAY)
+    assert result["intent"] == intent
+    for fragment in fragments:
+        assert fragment in result["sql"]
+    assert result["unapplied"] == unapplied
+
+@pytest.mark.parametrize("language, query", [
+    ("en", "top products by revenue in 2023"),
+    ("de", "top produkte 2023"),
+    ("ja", "2023年の上位製品"),
+])
+def test_year_is_not_a_limit(language, query):
+    lexicon = intent_matcher.lexicon(language)
+    matches, _ = lexicon.scan(query)
+    parameters = extract_parameters(matches, TODAY)
+    assert parameters["limit"] is None
+    assert parameters["date_range"] == (datetime.date(2023, 1, 1), datetime.date(2024, 1, 1))
+
+@pytest.mark.parametrize("language, query", [
+    ("en", "top products excluding electronics"),
+    ("de", "top produkte ohne elektronik"),
+    ("ja", "電子機器以外の上位製品"),
+])
+def test_negation_has_no_confidence(language, query):
+    result = intent_matcher.match(query, language, today=TODAY)
+    assert result["confidence"] == 0.0
+    assert "Electronics" not in result["sql"]
+
+def test_unknown_query_falls_back_to_default():
+    result = intent_matcher.match("what is the weather like", "en", today=TODAY)
+    assert result["intent"] == "default"
+    assert result["confidence"] == 0.0
@@ -0,0 +1,44 @@
+import pytest
+from query_router import QueryRouter, LOCAL, MODEL
+
+@pytest.fixture
+def router():
+    return QueryRouter(enabled=True, min_confidence=0.85, shadow_sample_rate=0)
+
+@pytest.mark.parametrize("language, query", [
+    ("en", "top 5 products"),
+    ("en", "monthly sales trend"),
+    ("en", "total sales by month"),
+    ("en", "revenue by category"),
+    ("en", "how many customers per segment"),
+    ("en", "revenue in the last 30 days"),
+    ("de", "top 5 produkte"),
+    ("ja", "月別の売上推移"),
+])
+def test_routes_template_questions_locally(router, language, query):
+    decision = router.route(query, language)
+    assert decision.route == LOCAL
+    assert decision.local_result["unapplied"] == []
+
+@pytest.mark.parametrize("query, concept", [
+    ("which city has the most customers", "concept:location"),
+    ("top 10 customers by number of orders", "concept:count"),
+    ("top customers by quantity", "concept:quantity"),
+    ("number of sales per month", "concept:count"),
+    ("average sales by segment", "concept:average"),
+])
+def test_routes_partial_matches_to_model(router, query, concept):
+    decision = router.route(query, "en")
+    assert decision.route == MODEL
+    assert concept in decision.local_result["unapplied"]
+
+def test_counts_unapplied_parameters(router):
+    router.route("top products by revenue in 2023", "en")
+    router.route("average sales by segment", "en")
+    stats = router.stats()
+    assert stats["routes"] == {LOCAL: 1, MODEL: 1}
+    assert stats["unapplied_parameters"] == 1
+
+def test_disabled_router_sends_everything_to_model():
+    decision = QueryRouter(enabled=False).route("top 5 products", "en")
+    assert decision.route == MODEL
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from config import TRACING_ENABLED, TRACING_HISTOGRAM_BUCKETS, OTEL_ENABLED, OTEL_SERVICE_NAME, OTEL_EXPORTER_ENDPOINT
+
+logger = logging.getLogger(__name__)
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+class Histogram:
+    """
+    A Prometheus-style histogram with one series per label value
+
+    Observations are counted into cumulative "le" buckets, with a running sum
+    and count, and rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, name, description, label, buckets=TRACING_HISTOGRAM_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = sorted(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            series["counts"][bisect_left(self.buckets, seconds)] += 1
+            series["sum"] += seconds
+
+    def render(self):
+        """Render the histogram as Prometheus text exposition lines"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                labels = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                cumulative += series["counts"][-1]
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+stage_durations = Histogram(
+    "querytalk_stage_duration_seconds", "Time spent in each stage of the query pipeline", "stage"
+)
+request_durations = Histogram(
+    "querytalk_request_duration_seconds", "Time to build each API response, by endpoint", "endpoint"
+)
+
+def configure_opentelemetry():
+    """
+    Export spans with OpenTelemetry when OTEL_ENABLED is set
+
+    Needs the opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http
+    packages; without them spans are only recorded locally.
+    """
+    if not OTEL_ENABLED:
+        return
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("OTEL_ENABLED is set but the OpenTelemetry SDK is not installed; not exporting spans")
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    exporter = OTLPSpanExporter(endpoint=OTEL_EXPORTER_ENDPOINT) if OTEL_EXPORTER_ENDPOINT else OTLPSpanExporter()
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    otel_trace.set_tracer_provider(provider)
+    logger.info(f"Exporting OpenTelemetry spans as {OTEL_SERVICE_NAME}")
+
+def _otel_span(name):
+    if otel_trace is None or not OTEL_ENABLED:
+        return None
+    return otel_trace.get_tracer(__name__).start_as_current_span(f"querytalk.{name}")
+
+@contextmanager
+def span(name):
+    """
+    Time one stage of the query pipeline
+
+    The duration goes into the stage histogram, into the current request's
+    Server-Timing header when there is one, and to OpenTelemetry when enabled.
+    Stages that run on background threads only reach the histogram.
+
+    Args:
+        name: The stage name (a token such as "gemini" or "sql_execute")
+    """
+    if not TRACING_ENABLED:
+        yield
+        return
+
+    otel_span = _otel_span(name)
+    if otel_span is not None:
+        otel_span.__enter__()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if otel_span is not None:
+            otel_span.__exit__(None, None, None)
+        stage_durations.observe(name, elapsed)
+        if has_request_context():
+            spans = g.setdefault("trace_spans", {})
+            spans[name] = spans.get(name, 0.0) + elapsed
+
+def server_timing_header(spans, total=None):
+    """
+    Format stage durations as a Server-Timing header value
+
+    Args:
+        spans: Dictionary of stage name to seconds
+        total: Optional total request time in seconds
+
+    Returns:
+        The header value, e.g. "gemini;dur=812.4, sql_execute;dur=35.1"
+    """
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+def start_request_timer():
+    g.trace_started = time.perf_counter()
+
+def finish_request_timer(response):
+    """Record the request duration and add a Server-Timing header to the response"""
+    started = g.get("trace_started")
+    if not TRACING_ENABLED or started is None:
+        return response
+
+    total = time.perf_counter() - started
+    request_durations.observe(request.endpoint or "unknown", total)
+    # Streamed bodies are generated after this point, so their header only covers setup
+    response.headers["Server-Timing"] = server_timing_header(g.get("trace_spans", {}), total)
+    return response
+
+def render_metrics():
+    """Render every histogram in the Prometheus text exposition format"""
+    lines = stage_durations.render() + request_durations.render()
+    return "\n".join(lines) + "\n"